@@ -1,70 +1,117 @@
-import os
-import psycopg2
-import yfinance as yf
-from datetime import datetime, timedelta
+import time
+from datetime import timedelta
+import db
+import metrics
+import price_cache
+from psycopg2.extras import execute_values
 
-DATABASE_URL = os.getenv("DATABASE_URL")
+def price_window(post_time):
+    """帖子对应的观察窗口：发帖当天起 2 个自然日 (end 不含)"""
+    start = post_time.date()
+    return start, start + timedelta(days=2)
 
-def get_price_change(ticker, start_time):
-    """获取股票在特定时间点的价格变化"""
-    try:
-        stock = yf.Ticker(ticker)
-        # 转换时间格式为 yfinance 需要的日期
-        date_str = start_time.strftime('%Y-%m-%d')
-        end_date = (start_time + timedelta(days=2)).strftime('%Y-%m-%d')
-        
-        hist = stock.history(start=date_str, end=end_date)
-        if len(hist) >= 2:
-            open_price = hist.iloc[0]['Open']
-            close_price = hist.iloc[-1]['Close']
-            return (close_price - open_price) / open_price
-        return None
-    except Exception as e:
-        print(f"获取 {ticker} 价格失败: {e}")
-        return None
+def get_price_change(bars, start_time):
+    """基于缓存日线计算股票在特定时间点之后的价格变化"""
+    if bars is None: return None
+    start, end = price_window(start_time)
+    hist = bars[(bars.index >= start) & (bars.index < end)]
+    if len(hist) >= 2:
+        open_price = hist.iloc[0]['open']
+        close_price = hist.iloc[-1]['close']
+        return (close_price - open_price) / open_price
+    return None
+
+def collect_windows(records):
+    """把所有帖子合并成每个标的一个 (最早开始, 最晚结束) 窗口"""
+    windows = {}
+    for _, ticker, _, _, post_time in records:
+        if not ticker: continue
+        start, end = price_window(post_time)
+        if ticker in windows:
+            start, end = min(start, windows[ticker][0]), max(end, windows[ticker][1])
+        windows[ticker] = (start, end)
+    return windows
+
+def is_prediction_correct(sentiment, change):
+    """判断预测是否正确"""
+    if sentiment == 'Bullish' and change > 0:
+        return True
+    if sentiment == 'Bearish' and change < 0:
+        return True
+    return False
+
+def apply_outcomes(cur, outcomes):
+    """
+    一条语句完成：标记帖子已评分 + 按作者聚合后 upsert 排名表。
+    UPDATE ... WHERE evaluated_at IS NULL 保证即使任务重跑或并发，每条帖子也只计一次。
+    """
+    if not outcomes: return 0
+    execute_values(cur, """
+        WITH outcome (id, author, correct) AS (VALUES %s),
+        marked AS (
+            UPDATE stock_trends s SET evaluated_at = NOW()
+            FROM outcome o
+            WHERE s.id = o.id AND s.evaluated_at IS NULL
+            RETURNING o.author, o.correct
+        ),
+        agg AS (
+            SELECT author, COUNT(*) AS total, SUM(correct) AS correct
+            FROM marked WHERE author IS NOT NULL GROUP BY author
+        )
+        INSERT INTO author_performance (author, total_predictions, correct_predictions, accuracy_rate)
+        SELECT author, total, correct, CAST(correct AS FLOAT) / total * 100 FROM agg
+        ON CONFLICT (author) DO UPDATE SET
+        total_predictions = author_performance.total_predictions + EXCLUDED.total_predictions,
+        correct_predictions = author_performance.correct_predictions + EXCLUDED.correct_predictions,
+        accuracy_rate = (CAST(author_performance.correct_predictions + EXCLUDED.correct_predictions AS FLOAT) / 
+                        (author_performance.total_predictions + EXCLUDED.total_predictions)) * 100
+    """, outcomes, page_size=len(outcomes))
+    return len(outcomes)
 
 def run_analysis():
     print("开始每日准确率分析...")
-    conn = psycopg2.connect(DATABASE_URL)
+    started = time.perf_counter()
+    metrics.REGISTRY.reset() # 汇总只统计本次运行
+    conn = db.connect() # 表结构由部署时的 entrypoint.py migrate 任务维护
     cur = conn.cursor()
 
-    # 1. 找出过去 24-48 小时内的预测记录进行核对
-    # (确保已经有足够的时间观察涨跌)
-    cur.execute("""
-        SELECT id, ticker, sentiment, author, post_time 
-        FROM stock_trends 
-        WHERE post_time < NOW() - INTERVAL '24 hours' 
-        AND post_time > NOW() - INTERVAL '72 hours'
-    """)
-    
-    records = cur.fetchall()
-    
+    # 1. 只取尚未评分、且已经过 24 小时观察期的帖子 (72 小时之外的不再补评)
+    with metrics.timed("db_select"):
+        cur.execute("""
+            SELECT id, ticker, sentiment, author, post_time 
+            FROM stock_trends 
+            WHERE evaluated_at IS NULL
+            AND post_time < NOW() - INTERVAL '24 hours' 
+            AND post_time > NOW() - INTERVAL '72 hours'
+        """)
+        records = cur.fetchall()
+    print(f"待评分帖子: {len(records)} 条")
+
+    # 先按标的去重，批量拉取 (或命中缓存) 日线，而不是每条帖子请求一次
+    try:
+        with metrics.timed("price_bars"):
+            bars = price_cache.load_daily_bars(conn, collect_windows(records))
+    except Exception as e:
+        conn.rollback()
+        print(f"获取价格失败: {e}")
+        bars = {}
+
+    # 价格数据不足的帖子保持未评分，下次运行再试
+    outcomes = []
     for rec_id, ticker, sentiment, author, post_time in records:
-        change = get_price_change(ticker, post_time)
-        
+        change = get_price_change(bars.get(ticker), post_time)
         if change is not None:
-            # 判断预测是否正确
-            is_correct = False
-            if sentiment == 'Bullish' and change > 0:
-                is_correct = True
-            elif sentiment == 'Bearish' and change < 0:
-                is_correct = True
-            
-            # 2. 更新发帖人排名表
-            cur.execute("""
-                INSERT INTO author_performance (author, total_predictions, correct_predictions)
-                VALUES (%s, 1, %s)
-                ON CONFLICT (author) DO UPDATE SET
-                total_predictions = author_performance.total_predictions + 1,
-                correct_predictions = author_performance.correct_predictions + EXCLUDED.correct_predictions,
-                accuracy_rate = (CAST(author_performance.correct_predictions + EXCLUDED.correct_predictions AS FLOAT) / 
-                                (author_performance.total_predictions + 1)) * 100
-            """, (author, 1 if is_correct else 0))
+            outcomes.append((rec_id, author, 1 if is_prediction_correct(sentiment, change) else 0))
 
-    conn.commit()
+    # 2. 一次性集合式更新发帖人排名表
+    with metrics.timed("db_write"):
+        apply_outcomes(cur, outcomes)
+        conn.commit()
+    metrics.count("posts_scored_total", len(outcomes), "Posts scored by the analyst job")
     cur.close()
     conn.close()
-    print("分析完成！")
+    print(f"分析完成！本次评分 {len(outcomes)} 条。")
+    metrics.emit_summary("analyst", started, pending=len(records), scored=len(outcomes))
 
 if __name__ == "__main__":
-    run_analysis()
\ No newline at end of file
+    run_analysis()
@@ -0,0 +1,105 @@
+"""
+过期分区的 Parquet 归档 (写入由 retention.py 完成，读取供回测等历史视图直接使用)。
+目录结构：<ARCHIVE_URI>/<表名>/month=YYYY-MM/<来源>.parquet；ARCHIVE_URI 可以是本地目录或 gs://bucket/prefix。
+"""
+import os
+from functools import lru_cache
+import pandas as pd
+
+# 未配置时退回仓库内的本地目录，只用于读取 (回测) 与 bench；retention 要求显式配置 gs:// 才会删除在线数据
+ARCHIVE_URI_SETTING = os.getenv("ARCHIVE_URI", "").strip()
+ARCHIVE_URI = ARCHIVE_URI_SETTING or os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive")
+# 每批从 Postgres 读取并写成一个 row group 的行数
+ARCHIVE_BATCH_ROWS = int(os.getenv("ARCHIVE_BATCH_ROWS", "50000"))
+
+# Postgres 类型 -> Arrow 类型；NUMERIC 统一导出为 float64，JSONB / BIT / 数组等其余类型导出为文本
+ARROW_TYPES = {
+    "integer": ("int32",), "bigint": ("int64",), "smallint": ("int16",),
+    "numeric": ("float64",), "double precision": ("float64",), "real": ("float32",),
+    "boolean": ("bool_",), "date": ("date32",), "text": ("string",), "character varying": ("string",),
+    "timestamp without time zone": ("timestamp", "us"),
+    "timestamp with time zone": ("timestamp", "us", "UTC"),
+}
+
+def is_durable():
+    """归档是否显式配置到容器之外的持久存储 (gs://)；容器内目录会随实例一起消失"""
+    return ARCHIVE_URI_SETTING.startswith("gs://")
+
+def arrow_type(pg_type):
+    import pyarrow as pa
+    name, *args = ARROW_TYPES.get(pg_type, ("string",))
+    return getattr(pa, name)(*args)
+
+def select_expr(column, pg_type):
+    if pg_type == "numeric":
+        return f"{column}::float8"
+    return column if pg_type in ARROW_TYPES else f"{column}::text"
+
+@lru_cache(maxsize=1)
+def filesystem():
+    """(pyarrow 文件系统, 根路径)；gs:// 使用 pyarrow 内置的 GCS 支持"""
+    from pyarrow import fs
+    if "://" in ARCHIVE_URI:
+        return fs.FileSystem.from_uri(ARCHIVE_URI)
+    return fs.LocalFileSystem(), os.path.abspath(ARCHIVE_URI)
+
+def table_columns(cur, table):
+    cur.execute("""
+        SELECT column_name, data_type FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = %s ORDER BY ordinal_position
+    """, (table,))
+    return cur.fetchall()
+
+def export(conn, table, relation, month, where="TRUE", params=()):
+    """
+    把 relation (分区或默认分区) 中满足 where 的行流式写入 <表>/month=<month>/ 下的一个 Parquet 文件。
+    使用服务端游标分批读取，内存只占一批。文件名由来源和 id 范围决定，重跑时覆盖同一文件而不会重复归档。
+    返回写入行数。
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    with conn.cursor() as cur:
+        columns = table_columns(cur, table)
+        cur.execute(f"SELECT MIN(id), MAX(id), COUNT(*) FROM public.{relation} WHERE {where}", params)
+        first_id, last_id, total = cur.fetchone()
+    if not total:
+        return 0
+    schema = pa.schema([(name, arrow_type(pg_type)) for name, pg_type in columns])
+    fs, root = filesystem()
+    directory = f"{root}/{table}/month={month}"
+    fs.create_dir(directory, recursive=True)
+    path = f"{directory}/{relation}-{first_id}-{last_id}.parquet"
+
+    written = 0
+    with conn.cursor(name=f"archive_{relation}") as cur, fs.open_output_stream(path) as out, \
+            pq.ParquetWriter(out, schema, compression="zstd") as writer:
+        cur.itersize = ARCHIVE_BATCH_ROWS
+        cur.execute(f"SELECT {', '.join(select_expr(n, t) for n, t in columns)} FROM public.{relation} WHERE {where} ORDER BY id", params)
+        while True:
+            rows = cur.fetchmany(ARCHIVE_BATCH_ROWS)
+            if not rows: break
+            batch = {name: [row[i] for row in rows] for i, name in enumerate(schema.names)}
+            writer.write_table(pa.Table.from_pydict(batch, schema=schema))
+            written += len(rows)
+    if written != total:
+        fs.delete_file(path)
+        raise RuntimeError(f"{relation}: archived {written} rows, expected {total}")
+    return written
+
+def read(table, columns=None, filter=None):
+    """
+    直接读取某张表的全部归档 (不回灌 Postgres)。columns 只解码需要的列，filter 为 pyarrow.dataset 表达式，
+    可按 month 分区目录和 row group 统计信息跳过无关文件。没有归档时返回空 DataFrame。
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    from pyarrow.fs import FileType
+    fs, root = filesystem()
+    path = f"{root}/{table}"
+    if fs.get_file_info(path).type != FileType.Directory:
+        return pd.DataFrame(columns=columns or [])
+    dataset = ds.dataset(path, format="parquet", partitioning="hive", filesystem=fs)
+    # 不同时期归档的文件列可能不同 (后来新增的列)，按全部文件合并出统一 schema，缺的列读为空值
+    schema = pa.unify_schemas([f.physical_schema for f in dataset.get_fragments()] + [dataset.partitioning.schema])
+    dataset = ds.dataset(path, format="parquet", partitioning="hive", filesystem=fs, schema=schema)
+    return dataset.to_table(columns=columns, filter=filter).to_pandas()
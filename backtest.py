@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+from datetime import date, timedelta
+import archive
+import iv_engine
+import price_cache
+
+# 历史记录缺少 IV 时使用的默认波动率
+DEFAULT_IV = 0.5
+# 到期当日剩余时间下限 (年)，BS 价格退化为内在价值
+MIN_T = 1e-6
+
+HISTORY_QUERY = """
+    SELECT t.ticker, t.side AS strategy, t.suggested_strike AS strike, t.entry_stock_price AS entry_price,
+           t.expiration_date AS expiry, t.scan_timestamp, iv.iv_value AS iv
+    FROM public.option_trades t
+    LEFT JOIN public.iv_analysis iv ON iv.ticker = t.ticker AND iv.scan_timestamp = t.scan_timestamp
+    UNION ALL
+    SELECT c.ticker, 'CSP', c.suggested_strike, c.current_price, c.expiration_date, c.scan_timestamp, c.iv_level
+    FROM public.csp_suggestions c
+"""
+
+HISTORY_COLUMNS = ['ticker', 'strategy', 'strike', 'entry_price', 'expiry', 'scan_timestamp', 'iv']
+
+def load_archived_history():
+    """超过保留期、已归档为 Parquet 的历史建议，与 HISTORY_QUERY 同样的列；只解码用到的列"""
+    trades = archive.read("option_trades", ['ticker', 'side', 'suggested_strike', 'entry_stock_price', 'expiration_date', 'scan_timestamp'])
+    ivs = archive.read("iv_analysis", ['ticker', 'scan_timestamp', 'iv_value'])
+    csp = archive.read("csp_suggestions", ['ticker', 'suggested_strike', 'current_price', 'expiration_date', 'scan_timestamp', 'iv_level'])
+    if not ivs.empty and not trades.empty:
+        trades = trades.merge(ivs.drop_duplicates(['ticker', 'scan_timestamp']), on=['ticker', 'scan_timestamp'], how='left')
+    else:
+        trades = trades.assign(iv_value=np.nan)
+    frames = [
+        trades.rename(columns={'side': 'strategy', 'suggested_strike': 'strike', 'entry_stock_price': 'entry_price',
+                               'expiration_date': 'expiry', 'iv_value': 'iv'}),
+        csp.rename(columns={'suggested_strike': 'strike', 'current_price': 'entry_price',
+                            'expiration_date': 'expiry', 'iv_level': 'iv'}).assign(strategy='CSP'),
+    ]
+    return pd.concat([f.reindex(columns=HISTORY_COLUMNS) for f in frames if not f.empty] or [pd.DataFrame(columns=HISTORY_COLUMNS)],
+                     ignore_index=True)
+
+def load_trade_history(conn):
+    """全部历史策略建议 (option_trades 的 CALL/PUT + csp_suggestions 的 CSP)，在线表与 Parquet 归档合并"""
+    with conn.cursor() as cur:
+        cur.execute(HISTORY_QUERY)
+        rows = cur.fetchall()
+    trades = pd.DataFrame(rows, columns=HISTORY_COLUMNS)
+    archived = load_archived_history()
+    if not archived.empty:
+        trades = pd.concat([archived, trades], ignore_index=True)
+    for col in ('strike', 'entry_price', 'iv'):
+        trades[col] = pd.to_numeric(trades[col], errors='coerce')
+    trades['entry_date'] = pd.to_datetime(trades['scan_timestamp']).dt.date
+    trades['expiry'] = pd.to_datetime(trades['expiry']).dt.date
+    return trades.dropna(subset=['ticker', 'strike', 'entry_price', 'expiry']).reset_index(drop=True)
+
+def load_prices(conn, trades):
+    """每个标的一个 [最早建仓日, 最晚到期日] 窗口，走日线缓存批量获取"""
+    if trades.empty:
+        return {}
+    end_cap = date.today() + timedelta(days=1)
+    spans = trades.groupby('ticker').agg(start=('entry_date', 'min'), end=('expiry', 'max'))
+    windows = {t: (row.start, min(row.end + timedelta(days=1), end_cap)) for t, row in spans.iterrows()}
+    return price_cache.load_daily_bars(conn, windows)
+
+def close_matrix(bars, tickers):
+    """收盘价矩阵 [标的 x 交易日]，缺失日前向填充"""
+    frames = {t: pd.Series(bars[t]['close'].astype(float).values, index=pd.to_datetime(list(bars[t].index)))
+              for t in tickers if t in bars and not bars[t].empty}
+    if not frames:
+        return np.array([], dtype='datetime64[D]'), np.full((len(tickers), 0), np.nan)
+    wide = pd.DataFrame(frames).sort_index().ffill()
+    wide = wide.reindex(columns=tickers)
+    return wide.index.values.astype('datetime64[D]'), wide.to_numpy().T
+
+def run_backtest(trades, bars, r=iv_engine.RISK_FREE_RATE):
+    """
+    把所有历史建议一次性按日线回放 (全部为 [交易 x 持有天数] 的数组运算)：
+    期权每日按 Black-Scholes (建仓时 IV) 重新估值；CALL/PUT 按买方计收益率 (相对权利金)，
+    CSP 按卖方计收益率 (相对占用的行权价保证金)。
+    返回 (paths, summary)：paths 含 dates / pnl / drawdown 三个 [交易 x 天] 矩阵。
+    """
+    n = len(trades)
+    tickers = sorted(trades['ticker'].unique()) if n else []
+    dates, closes = close_matrix(bars, tickers)
+    empty = np.full((n, 0), np.nan)
+    if n == 0 or dates.size == 0:
+        return {"dates": empty.astype('datetime64[D]'), "pnl": empty, "drawdown": empty}, summarize(trades, empty, empty)
+
+    tk = np.searchsorted(tickers, trades['ticker'].to_numpy())
+    entry = np.array(trades['entry_date'].to_numpy(), dtype='datetime64[D]')
+    expiry = np.array(trades['expiry'].to_numpy(), dtype='datetime64[D]')
+    strike = trades['strike'].to_numpy(dtype=float)
+    s0 = trades['entry_price'].to_numpy(dtype=float)
+    sigma = np.where(trades['iv'].to_numpy(dtype=float) > 0, trades['iv'].to_numpy(dtype=float), DEFAULT_IV)
+    is_call = (trades['strategy'] == 'CALL').to_numpy()
+    is_short = (trades['strategy'] == 'CSP').to_numpy()
+
+    # 建仓后第一个交易日 ~ 到期前最后一个交易日
+    start_idx = np.searchsorted(dates, entry, side='left')
+    end_idx = np.searchsorted(dates, expiry, side='right') - 1
+    horizon = int(max(np.max(end_idx - start_idx) + 1, 1))
+    idx = start_idx[:, None] + np.arange(horizon)[None, :]
+    valid = (idx <= end_idx[:, None]) & (idx < dates.size)
+    idx = np.clip(idx, 0, dates.size - 1)
+
+    path_dates = dates[idx]
+    spot = closes[tk[:, None], idx]
+    valid &= np.isfinite(spot)
+    t_left = np.maximum((expiry[:, None] - path_dates).astype(float) / 365.0, MIN_T)
+    t0 = np.maximum((expiry - entry).astype(float) / 365.0, MIN_T)
+
+    premium = iv_engine.bs_price(s0, strike, t0, r, sigma, is_call)
+    value = iv_engine.bs_price(spot, strike[:, None], t_left, r, sigma[:, None], is_call[:, None])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        long_pnl = (value - premium[:, None]) / premium[:, None] * 100
+        short_pnl = (premium[:, None] - value) / strike[:, None] * 100
+    pnl = np.where(valid, np.where(is_short[:, None], short_pnl, long_pnl), np.nan)
+
+    # 回撤：相对此前最高收益的回落 (百分点)
+    peak = np.fmax.accumulate(np.where(valid, pnl, -np.inf), axis=1)
+    drawdown = np.where(valid, peak - pnl, np.nan)
+    paths = {"dates": np.where(valid, path_dates, np.datetime64('NaT')), "pnl": pnl, "drawdown": drawdown}
+    return paths, summarize(trades, pnl, drawdown)
+
+def summarize(trades, pnl, drawdown):
+    """每笔交易的最新收益、最大回撤、已持有天数"""
+    summary = trades[['ticker', 'strategy', 'strike', 'entry_price', 'entry_date', 'expiry']].copy()
+    has = np.isfinite(pnl)
+    days = has.sum(axis=1) if pnl.size else np.zeros(len(trades), dtype=int)
+    last = np.where(days > 0, days - 1, 0)
+    rows = np.arange(len(trades))
+    summary['days_held'] = days
+    summary['final_pnl'] = np.where(days > 0, pnl[rows, last], np.nan) if pnl.size else np.nan
+    summary['max_drawdown'] = np.nanmax(np.where(has, drawdown, -np.inf), axis=1) if pnl.size else np.nan
+    summary.loc[summary['days_held'] == 0, 'max_drawdown'] = np.nan
+    summary['closed'] = pd.to_datetime(summary['expiry']) < pd.Timestamp(date.today())
+    return summary
+
+def strategy_curves(trades, paths):
+    """按策略聚合：第 N 个持有日的平均收益 (各交易按持有天数对齐)"""
+    curves = {}
+    pnl = paths['pnl']
+    if pnl.size == 0:
+        return pd.DataFrame()
+    for strategy in sorted(trades['strategy'].unique()):
+        mask = (trades['strategy'] == strategy).to_numpy()
+        block = pnl[mask]
+        counts = np.isfinite(block).sum(axis=0)
+        with np.errstate(invalid='ignore'):
+            mean = np.where(counts > 0, np.nansum(block, axis=0) / np.maximum(counts, 1), np.nan)
+        curves[strategy] = mean
+    return pd.DataFrame(curves).rename_axis('day_held')
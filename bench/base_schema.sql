@@ -0,0 +1,8 @@
+-- 线上 (Neon) 已有的基础表；其余表和列由 db.SCHEMA_DDL 增量创建
+CREATE TABLE stock_trends (id SERIAL PRIMARY KEY, ticker TEXT, sentiment TEXT, author TEXT, post_time TIMESTAMP, reason TEXT, source TEXT, created_at TIMESTAMPTZ DEFAULT NOW());
+CREATE TABLE author_performance (author TEXT PRIMARY KEY, total_predictions INT DEFAULT 0, correct_predictions INT DEFAULT 0, accuracy_rate FLOAT DEFAULT 0);
+CREATE TABLE iv_analysis (id SERIAL PRIMARY KEY, ticker TEXT, iv_value NUMERIC, analysis_reason TEXT, scan_timestamp TIMESTAMP, current_price NUMERIC, market_cap NUMERIC, created_at TIMESTAMPTZ DEFAULT NOW());
+CREATE TABLE csp_suggestions (id SERIAL PRIMARY KEY, ticker TEXT, current_price NUMERIC, suggested_strike NUMERIC, expiration_date DATE, safety_buffer TEXT, iv_level NUMERIC, analysis_logic TEXT, scan_timestamp TIMESTAMP, created_at TIMESTAMPTZ DEFAULT NOW());
+CREATE TABLE option_trades (id SERIAL PRIMARY KEY, ticker TEXT, side TEXT, sentiment_score NUMERIC, narrative_type TEXT, suggested_strike NUMERIC, entry_stock_price NUMERIC, expiration_date DATE, risk_reward_ratio NUMERIC, final_score NUMERIC, scan_timestamp TIMESTAMP, created_at TIMESTAMPTZ DEFAULT NOW());
+CREATE TABLE posts (post_id TEXT PRIMARY KEY, ticker TEXT, initial_price NUMERIC, sentiment TEXT, created_at TIMESTAMPTZ DEFAULT NOW());
+CREATE TABLE price_tracking (post_id TEXT PRIMARY KEY, price_1h NUMERIC, is_correct_1h BOOLEAN);
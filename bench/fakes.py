@@ -0,0 +1,98 @@
+"""
+yfinance / Gemini 的本地替身：按固定的模拟网络延迟回放 fixtures 中的数据。
+延迟可通过 BENCH_YF_LATENCY / BENCH_GEMINI_LATENCY (秒) 调整；比较不同提交时应保持一致。
+"""
+import os
+import json
+import time
+import types
+import asyncio
+from contextlib import contextmanager
+import pandas as pd
+from bench import fixtures
+
+YF_LATENCY = float(os.getenv("BENCH_YF_LATENCY", "0.02"))
+GEMINI_LATENCY = float(os.getenv("BENCH_GEMINI_LATENCY", "0.3"))
+
+class FakeTicker:
+    def __init__(self, ticker, session=None):
+        self.ticker = ticker
+
+    @property
+    def fast_info(self):
+        time.sleep(YF_LATENCY)
+        return {'last_price': fixtures.spot(self.ticker)}
+
+    @property
+    def options(self):
+        time.sleep(YF_LATENCY)
+        return fixtures.expirations(self.ticker)
+
+    def option_chain(self, expiry):
+        time.sleep(YF_LATENCY)
+        calls, puts = fixtures.option_chain(self.ticker, expiry)
+        return types.SimpleNamespace(calls=calls, puts=puts)
+
+    @property
+    def info(self):
+        time.sleep(YF_LATENCY * 5) # 线上 info 是最慢的接口
+        return {'marketCap': fixtures.market_cap(self.ticker)}
+
+    @property
+    def news(self):
+        time.sleep(YF_LATENCY)
+        return fixtures.news(self.ticker)
+
+    def history(self, start=None, end=None, period=None, interval='1d', **kwargs):
+        time.sleep(YF_LATENCY)
+        end = pd.Timestamp(end) if end is not None else pd.Timestamp.today().normalize() + pd.Timedelta(days=1)
+        start = pd.Timestamp(start) if start is not None else end - pd.Timedelta(days=31)
+        return fixtures.daily_bars(self.ticker, start, end)
+
+def download(tickers, start=None, end=None, period=None, interval='1d', group_by='column', **kwargs):
+    """多标的批量下载：一次请求的延迟，返回 (Ticker, Price) 两级列的宽表"""
+    time.sleep(YF_LATENCY * 5)
+    tickers = [tickers] if isinstance(tickers, str) else list(tickers)
+    end = pd.Timestamp(end) if end is not None else pd.Timestamp.today().normalize()
+    start = pd.Timestamp(start) if start is not None else end - pd.Timedelta(days=31)
+    frames = {t: fixtures.daily_bars(t, start, end) for t in tickers}
+    return pd.concat(frames, axis=1, names=['Ticker', 'Price'])
+
+class FakeModel:
+    """GenerativeModel 替身：字符串 Prompt 视为扫描器调用，含图片的列表视为截图分析"""
+
+    def __init__(self, model_name=None, *args, **kwargs):
+        self.model_name = model_name
+
+    def _respond(self, contents):
+        if isinstance(contents, str):
+            return types.SimpleNamespace(text=fixtures.scanner_response(contents))
+        images = [c for c in contents if isinstance(c, dict) and 'data' in c or hasattr(c, 'size')]
+        seed = sum(len(c['data']) if isinstance(c, dict) else c.size[0] * c.size[1] for c in images)
+        if len(images) == 1:
+            return types.SimpleNamespace(text=json.dumps(fixtures.screenshot_posts(seed)))
+        posts = [p for i in range(len(images)) for p in fixtures.screenshot_posts(seed + i, image_index=i)]
+        return types.SimpleNamespace(text=json.dumps(posts))
+
+    def generate_content(self, contents, **kwargs):
+        time.sleep(GEMINI_LATENCY)
+        return self._respond(contents)
+
+    async def generate_content_async(self, contents, **kwargs):
+        await asyncio.sleep(GEMINI_LATENCY)
+        return self._respond(contents)
+
+@contextmanager
+def installed():
+    """在 with 块内把 yfinance / Gemini 入口替换为本地替身"""
+    import yfinance as yf
+    import google.generativeai as genai
+    saved = [(yf, 'Ticker', yf.Ticker), (yf, 'download', yf.download),
+             (genai, 'GenerativeModel', genai.GenerativeModel), (genai, 'configure', genai.configure)]
+    yf.Ticker, yf.download = FakeTicker, download
+    genai.GenerativeModel, genai.configure = FakeModel, lambda **kwargs: None
+    try:
+        yield
+    finally:
+        for module, name, value in saved:
+            setattr(module, name, value)
@@ -0,0 +1,204 @@
+"""
+确定性的基准测试数据：期权链、日线、新闻、Gemini 回复与截图。
+同一标的在任何机器、任何一次运行中生成的数据都相同 (按标的名派生随机种子)；
+bench/fixtures/recorded.json.gz 存在时优先回放其中录制的真实 yfinance 数据。
+日期一律相对运行当天锚定，保证到期日筛选、24~72 小时观察窗等逻辑与线上一致。
+"""
+import os
+import io
+import re
+import gzip
+import json
+import zlib
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from datetime import date, datetime, timedelta
+from PIL import Image, ImageDraw
+import iv_engine
+
+SEED = 20240601
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+RECORDED_PATH = os.path.join(FIXTURE_DIR, "recorded.json.gz")
+# 合成日线的起点，各标的的价格路径从这里开始累积，任意窗口取到的都是同一条路径的切片
+BAR_EPOCH = date(2024, 1, 1)
+TERM_EXPIRIES = 8
+
+def rng(*keys):
+    return np.random.default_rng([SEED, *(zlib.crc32(str(k).encode()) for k in keys)])
+
+def universe(size):
+    """确定性的合成代码 (ZAAAA, ZAAAB, ...)，不与真实代码冲突"""
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    out = []
+    for i in range(size):
+        code, n = '', i
+        for _ in range(4):
+            code = letters[n % 26] + code
+            n //= 26
+        out.append('Z' + code)
+    return out
+
+_recorded = None
+
+def recorded():
+    """录制数据：{ticker: {...}}，不存在时为空"""
+    global _recorded
+    if _recorded is None:
+        _recorded = {}
+        if os.path.exists(RECORDED_PATH):
+            with gzip.open(RECORDED_PATH, 'rt', encoding='utf-8') as f:
+                _recorded = json.load(f)
+    return _recorded
+
+def spot(ticker):
+    rec = recorded().get(ticker)
+    if rec: return rec['spot']
+    return float(np.round(np.exp(rng(ticker, 'spot').uniform(np.log(5), np.log(500))), 2))
+
+def expirations(ticker, today=None):
+    """未来若干个周五 (录制数据按录制时的剩余天数重新锚定)"""
+    today = today or date.today()
+    rec = recorded().get(ticker)
+    if rec:
+        return tuple((today + timedelta(days=d)).isoformat() for d in sorted(int(k) for k in rec['chains']))
+    first = today + timedelta(days=(4 - today.weekday()) % 7 or 7)
+    return tuple((first + timedelta(weeks=i)).isoformat() for i in range(TERM_EXPIRIES))
+
+def option_chain(ticker, expiry, today=None):
+    """(calls, puts) 两张 DataFrame，列与 yfinance option_chain 一致"""
+    calls, puts = _option_chain(ticker, expiry, today or date.today())
+    return calls.copy(), puts.copy()
+
+@lru_cache(maxsize=None)
+def _option_chain(ticker, expiry, today):
+    rec = recorded().get(ticker)
+    if rec:
+        dte = str((date.fromisoformat(expiry) - today).days)
+        chain = rec['chains'].get(dte)
+        if chain:
+            return pd.DataFrame(chain['calls']), pd.DataFrame(chain['puts'])
+    r = rng(ticker, 'chain', expiry)
+    s = spot(ticker)
+    t = max((date.fromisoformat(expiry) - today).days, 1) / 365.0
+    base_iv = rng(ticker, 'iv').uniform(0.25, 1.2)
+    step = max(round(s * 0.025 * 2) / 2, 0.5)
+    strikes = np.arange(max(step, s * 0.6) // step * step, s * 1.4, step)
+    frames = []
+    for is_call in (True, False):
+        # 简单的波动率微笑 + 期限结构
+        iv = base_iv * (1 + 0.4 * np.log(strikes / s) ** 2 * 10) * (1 + 0.1 * np.sqrt(t))
+        mid = iv_engine.bs_price(s, strikes, t, iv_engine.RISK_FREE_RATE, iv, is_call)
+        spread = np.maximum(mid * r.uniform(0.02, 0.1, len(strikes)), 0.01)
+        frames.append(pd.DataFrame({
+            'contractSymbol': [f"{ticker}{expiry}{'C' if is_call else 'P'}{k:.1f}" for k in strikes],
+            'strike': strikes,
+            'lastPrice': np.round(mid, 2),
+            'bid': np.round(np.maximum(mid - spread / 2, 0), 2),
+            'ask': np.round(mid + spread / 2, 2),
+            'volume': r.integers(0, 2000, len(strikes)).astype(float),
+            'openInterest': r.integers(0, 20000, len(strikes)).astype(float),
+            'impliedVolatility': iv,
+        }))
+    return frames[0], frames[1]
+
+def daily_bars(ticker, start, end):
+    """[start, end) 的日线 DataFrame (列 Open/High/Low/Close/Volume，索引为交易日)"""
+    days = pd.bdate_range(start, pd.Timestamp(end) - pd.Timedelta(days=1))
+    rec = recorded().get(ticker)
+    if rec and rec.get('bars'):
+        # 录制的日线按"距录制日的天数"保存，回放时整体平移到今天
+        bars = pd.DataFrame(rec['bars'])
+        bars.index = [pd.Timestamp(date.today() - timedelta(days=int(d))) for d in bars.pop('days_ago')]
+        return bars.loc[(bars.index >= days.min()) & (bars.index <= days.max())] if len(days) else bars.iloc[:0]
+    frame = _bar_path(ticker, date.today())
+    return frame.loc[(frame.index >= days.min()) & (frame.index <= days.max())].copy() if len(days) else frame.iloc[:0]
+
+@lru_cache(maxsize=None)
+def _bar_path(ticker, today):
+    """BAR_EPOCH 到今天之后两周的完整合成日线，同一标的只生成一次"""
+    all_days = pd.bdate_range(BAR_EPOCH, today + timedelta(days=14))
+    r = rng(ticker, 'bars')
+    vol = r.uniform(0.015, 0.05)
+    close = spot(ticker) * np.exp(np.cumsum(r.normal(0, vol, len(all_days))))
+    volume = np.round(r.lognormal(14, 0.6, len(all_days)))
+    return pd.DataFrame({'Open': close * (1 - vol / 4), 'High': close * (1 + vol / 2), 'Low': close * (1 - vol / 2),
+                         'Close': close, 'Volume': volume}, index=all_days)
+
+def prewarm(tickers):
+    """计时前生成全部 fixture，计时只包含被测代码与模拟延迟"""
+    today = date.today()
+    for t in tickers:
+        _bar_path(t, today)
+        for e in expirations(t, today):
+            _option_chain(t, e, today)
+
+def news(ticker):
+    rec = recorded().get(ticker)
+    if rec: return rec['news']
+    return [{'content': {'title': f"{ticker} headline {i}"}} for i in range(2)]
+
+def market_cap(ticker):
+    rec = recorded().get(ticker)
+    if rec: return rec['market_cap']
+    return float(spot(ticker) * rng(ticker, 'shares').integers(10, 5000) * 1e6)
+
+def scanner_response(prompt):
+    """扫描器 Prompt -> 合法的 trades / iv_analysis JSON，内容只取决于 Prompt 中的标的"""
+    tickers = re.findall(r'\[([A-Z0-9.\-]+)\] Price', prompt)
+    return json.dumps({
+        "trades": [{"ticker": t, "side": "CALL" if zlib.crc32(t.encode()) % 2 else "PUT",
+                    "final_score": 7.5 + (zlib.crc32(t.encode()) % 25) / 10, "narrative": f"{t} 叙事"}
+                   for t in tickers if zlib.crc32(t.encode()) % 3 == 0],
+        "iv_analysis": [{"ticker": t, "reason": f"{t} 高波动原因", "risk_desc": "中"} for t in tickers],
+    }, ensure_ascii=False)
+
+def screenshot_posts(seed, count=3, image_index=None):
+    r = rng('posts', seed)
+    tickers = ['NVDA', 'TSLA', 'AMD', 'PLTR', 'META', 'AMZN']
+    posts = []
+    for i in range(count):
+        post = {"ticker": tickers[int(r.integers(len(tickers)))], "sentiment": "Bullish" if r.random() < 0.6 else "Bearish",
+                "author": f"user{int(r.integers(500))}", "post_time": (datetime.now() - timedelta(hours=int(r.integers(1, 48)))).strftime("%Y-%m-%d %H:%M:%S")}
+        if image_index is not None:
+            post["image_index"] = image_index
+        posts.append(post)
+    return posts
+
+def screenshot_png(index, size=(1170, 2532)):
+    """一张确定性的"截图"：每张的文本块布局不同，感知哈希彼此不相近"""
+    r = rng('image', index)
+    img = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(img)
+    y = 40
+    while y < size[1] - 60:
+        h = int(r.integers(20, 60))
+        draw.rectangle([40, y, int(r.integers(200, size[0] - 40)), y + h], fill=tuple(int(c) for c in r.integers(0, 160, 3)))
+        y += h + int(r.integers(10, 50))
+    out = io.BytesIO()
+    img.save(out, 'PNG')
+    return out.getvalue()
+
+def record(tickers, path=RECORDED_PATH):
+    """在线录制：抓取真实 yfinance 数据保存为回放用的 fixture (需要网络)"""
+    import yfinance as yf
+    today = date.today()
+    data = recorded().copy()
+    for t in tickers:
+        s = yf.Ticker(t)
+        chains = {}
+        for e in s.options[:TERM_EXPIRIES]:
+            oc = s.option_chain(e)
+            chains[str((date.fromisoformat(e) - today).days)] = {
+                "calls": json.loads(oc.calls.drop(columns=['lastTradeDate'], errors='ignore').to_json(orient='records')),
+                "puts": json.loads(oc.puts.drop(columns=['lastTradeDate'], errors='ignore').to_json(orient='records')),
+            }
+        hist = s.history(period='2y', auto_adjust=True)[['Open', 'High', 'Low', 'Close', 'Volume']]
+        bars = hist.assign(days_ago=[(today - d.date()).days for d in hist.index]).to_dict(orient='list')
+        data[t] = {"spot": float(s.fast_info['last_price']), "chains": chains, "bars": bars,
+                   "news": [{'content': {'title': n.get('content', {}).get('title') or n.get('title')}} for n in (s.news or [])[:2]],
+                   "market_cap": s.info.get('marketCap', 0)}
+        print(f"录制 {t}: {len(chains)} 个到期日, {len(hist)} 根日线")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        json.dump(data, f)
@@ -0,0 +1,322 @@
+"""
+离线基准测试：用 bench/fixtures 的确定性数据和 bench/fakes 的本地替身回放
+options_scanner.run_production_scanner、analyst_job.run_analysis 与 /analyze、/analyze/batch 并发负载，
+输出端到端与分阶段的吞吐和延迟。
+
+    python -m bench.run                          # 全部场景，结果写入 bench_output.txt
+    python -m bench.run --only api --json a.json # 单个场景，另存 JSON 便于跨提交对比
+    python -m bench.run --record NVDA TSLA       # (需要网络) 录制真实 yfinance 数据为 fixture
+
+数据库：BENCH_DATABASE_URL 指向的库会被整库清空重建 (切勿指向线上库)；
+未设置时用 pgserver (pip install pgserver) 在临时目录启动一个本地 Postgres。
+"""
+import os
+import io
+import sys
+import json
+import time
+import asyncio
+import inspect
+import argparse
+import tempfile
+import subprocess
+import contextlib
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OUTPUT_PATH = os.path.join(ROOT, "bench_output.txt")
+BASE_SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "base_schema.sql")
+AUTH_KEY = "bench-key"
+
+class StageTimer:
+    """把模块属性替换成计时包装，记录每次调用耗时；restore() 还原"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self._saved = []
+
+    def wrap(self, owner, attr, name=None):
+        fn = getattr(owner, attr)
+        samples = self.samples[name or attr]
+        if inspect.iscoroutinefunction(fn):
+            async def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    samples.append(time.perf_counter() - start)
+        else:
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    samples.append(time.perf_counter() - start)
+        self._saved.append((owner, attr, fn))
+        setattr(owner, attr, timed)
+
+    def restore(self):
+        for owner, attr, fn in reversed(self._saved):
+            setattr(owner, attr, fn)
+        self._saved.clear()
+
+    def summary(self):
+        return {name: latency_stats(values) for name, values in self.samples.items() if values}
+
+def latency_stats(values):
+    a = np.asarray(values) * 1000
+    return {"calls": len(a), "total_s": round(a.sum() / 1000, 3), "mean_ms": round(a.mean(), 2),
+            "p50_ms": round(np.percentile(a, 50), 2), "p95_ms": round(np.percentile(a, 95), 2),
+            "p99_ms": round(np.percentile(a, 99), 2), "max_ms": round(a.max(), 2)}
+
+@contextlib.contextmanager
+def quiet():
+    """被测代码的进度输出不混进报告"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+def start_database():
+    url = os.getenv("BENCH_DATABASE_URL")
+    if url:
+        return url, None
+    try:
+        import pgserver
+    except ImportError:
+        sys.exit("需要设置 BENCH_DATABASE_URL，或 pip install pgserver 以启动临时本地 Postgres")
+    server = pgserver.get_server(tempfile.mkdtemp(prefix="bench-pg-"), cleanup_mode='delete')
+    return server.get_uri(), server
+
+def reset_database(url):
+    import psycopg2
+    conn = psycopg2.connect(url)
+    conn.autocommit = True
+    with conn.cursor() as cur, open(BASE_SCHEMA_PATH, encoding='utf-8') as f:
+        cur.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public;")
+        cur.execute(f.read())
+    conn.close()
+
+def scalar(sql, params=None):
+    import db
+    conn = db.connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            return cur.fetchone()[0]
+    finally:
+        conn.close()
+
+def bench_scanner(args):
+    import db, screener, options_scanner
+    from bench import fixtures
+    conn = db.connect()
+    db.ensure_schema(conn)
+    with conn, conn.cursor() as cur:
+        db.bulk_insert(cur, "public.scan_universe", ['ticker', 'source'], [(t, 'bench') for t in fixtures.universe(args.universe)])
+    # 与扫描器相同的宇宙 (文件 + 表)，报告实际扫描的标的数
+    universe = screener.load_universe(conn)
+    conn.close()
+    fixtures.prewarm(universe)
+
+    runs = {}
+    for label in ("cold", "warm"):
+        timer = StageTimer()
+        timer.wrap(screener, 'screen_universe')
+        timer.wrap(options_scanner, 'fetch_snapshot')
+        timer.wrap(options_scanner, 'analyze_shard')
+        timer.wrap(options_scanner, 'save_scan_results')
+        start = time.perf_counter()
+        try:
+            with quiet():
+                options_scanner.run_production_scanner()
+        finally:
+            timer.restore()
+        wall = time.perf_counter() - start
+        tickers = scalar("SELECT COUNT(*) FROM public.iv_analysis WHERE scan_timestamp = (SELECT MAX(scan_timestamp) FROM public.iv_analysis)")
+        runs[label] = {"wall_s": round(wall, 3), "tickers_saved": tickers,
+                       "tickers_per_s": round(tickers / wall, 2) if wall else 0, "stages": timer.summary()}
+    return {"universe": len(universe), **runs}
+
+def bench_analyst(args):
+    import db, analyst_job, price_cache
+    from bench import fixtures
+    now = datetime.now()
+    tickers = fixtures.universe(args.analyst_tickers)
+    rows = [(tickers[i % len(tickers)], 'Bullish' if i % 3 else 'Bearish', f"author{i % 300}",
+             now - timedelta(hours=25 + (i * 37) % 46), 'bench', 'Bench') for i in range(args.posts)]
+    conn = db.connect()
+    db.ensure_schema(conn)
+    with conn, conn.cursor() as cur:
+        db.bulk_insert(cur, "public.stock_trends", ['ticker', 'sentiment', 'author', 'post_time', 'reason', 'source'], rows)
+    conn.close()
+    fixtures.prewarm(tickers)
+
+    timer = StageTimer()
+    timer.wrap(price_cache, 'load_daily_bars')
+    timer.wrap(price_cache, 'bulk_download')
+    timer.wrap(analyst_job, 'apply_outcomes')
+    start = time.perf_counter()
+    try:
+        with quiet():
+            analyst_job.run_analysis()
+    finally:
+        timer.restore()
+    wall = time.perf_counter() - start
+    scored = scalar("SELECT COUNT(*) FROM public.stock_trends WHERE evaluated_at IS NOT NULL")
+    return {"posts": args.posts, "tickers": len(tickers), "scored": scored, "wall_s": round(wall, 3),
+            "posts_per_s": round(scored / wall, 1) if wall else 0, "stages": timer.summary()}
+
+async def _load(client, requests, concurrency):
+    """固定并发度地发送请求，返回 (每个请求的延迟, 状态计数, 墙钟时间)"""
+    gate = asyncio.Semaphore(concurrency)
+    latencies, statuses = [], Counter()
+
+    async def one(kwargs):
+        async with gate:
+            start = time.perf_counter()
+            r = await client.post(**kwargs)
+            latencies.append(time.perf_counter() - start)
+            body = r.json()
+            statuses[f"{r.status_code}:{'cached' if body.get('cached') else body.get('status')}"] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(kw) for kw in requests))
+    return latencies, statuses, time.perf_counter() - start
+
+async def _bench_api(args):
+    import httpx
+    import main
+    from screenshot_cache import ScreenshotCache
+    from bench import fixtures
+    images = [fixtures.screenshot_png(i) for i in range(args.images)]
+    headers = {'X-Internal-Key': AUTH_KEY}
+    results = {}
+
+    timer = StageTimer()
+    timer.wrap(main, 'decode_image')
+    timer.wrap(main, 'persist_results')
+    timer.wrap(main, 'analyze_shard')
+    try:
+        with quiet():
+            async with main.lifespan(main.app):
+                transport = httpx.ASGITransport(app=main.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+                    # 单图接口：每张图发送 repeat 次，第二轮起应命中截图缓存
+                    main.screenshot_cache = ScreenshotCache(persist=False)
+                    single = [dict(url="/analyze", content=images[i % len(images)],
+                                   headers={**headers, 'Content-Type': 'image/png'})
+                              for i in range(len(images) * args.repeat)]
+                    results["analyze"] = await _load(client, single, args.concurrency)
+                    single_stages = timer.summary()
+                    for values in timer.samples.values():
+                        values.clear()
+
+                    # 批量接口：每个请求 batch_size 张图，缓存清空后全部未命中
+                    main.screenshot_cache = ScreenshotCache(persist=False)
+                    batches = [dict(url="/analyze/batch", headers=headers,
+                                    files=[('images', (f"{j}.png", images[j], 'image/png')) for j in range(i, min(i + args.batch_size, len(images)))])
+                               for i in range(0, len(images), args.batch_size)]
+                    results["analyze_batch"] = await _load(client, batches, max(1, args.concurrency // 2))
+                    batch_stages = timer.summary()
+    finally:
+        timer.restore()
+
+    out = {}
+    for name, stages in (("analyze", single_stages), ("analyze_batch", batch_stages)):
+        latencies, statuses, wall = results[name]
+        out[name] = {"requests": len(latencies), "concurrency": args.concurrency if name == "analyze" else max(1, args.concurrency // 2),
+                     "wall_s": round(wall, 3), "requests_per_s": round(len(latencies) / wall, 2),
+                     "statuses": dict(sorted(statuses.items())), "latency": latency_stats(latencies), "stages": stages}
+    out["analyze_batch"]["images_per_s"] = round(len(images) / results["analyze_batch"][2], 2)
+    return out
+
+def bench_api(args):
+    import db
+    # 生产环境由部署时的 migrate 任务建表，API 启动不再执行 DDL
+    conn = db.connect()
+    db.ensure_schema(conn)
+    conn.close()
+    return asyncio.run(_bench_api(args))
+
+SCENARIOS = {"scanner": bench_scanner, "analyst": bench_analyst, "api": bench_api}
+
+def format_report(report):
+    lines = [f"# bench  commit={report['commit']}  at={report['started_at']}",
+             f"# latency yf={report['latency']['yf_s']}s gemini={report['latency']['gemini_s']}s"]
+
+    def stage_table(stages, indent="    "):
+        lines.append(f"{indent}{'stage':<22}{'calls':>7}{'total_s':>10}{'mean_ms':>10}{'p50_ms':>10}{'p95_ms':>10}{'max_ms':>10}")
+        for name, s in stages.items():
+            lines.append(f"{indent}{name:<22}{s['calls']:>7}{s['total_s']:>10}{s['mean_ms']:>10}{s['p50_ms']:>10}{s['p95_ms']:>10}{s['max_ms']:>10}")
+
+    def walk(title, data):
+        headline = {k: v for k, v in data.items() if not isinstance(v, dict)}
+        lines.append(f"\n== {title} ==  " + "  ".join(f"{k}={v}" for k, v in headline.items()))
+        for k, v in data.items():
+            if k == "stages":
+                stage_table(v)
+            elif k == "latency":
+                stage_table({"request": v})
+            elif k == "statuses":
+                lines.append("    statuses: " + ", ".join(f"{s}={n}" for s, n in v.items()))
+            elif isinstance(v, dict):
+                walk(f"{title}.{k}", v)
+
+    for name, data in report["results"].items():
+        walk(name, data)
+    return "\n".join(lines) + "\n"
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark for the scanner, analyst job and /analyze API")
+    parser.add_argument("--only", default="scanner,analyst,api", help="逗号分隔的场景: scanner,analyst,api")
+    parser.add_argument("--universe", type=int, default=500, help="scan_universe 表中额外的合成标的数")
+    parser.add_argument("--posts", type=int, default=5000, help="analyst 场景待评分的帖子数")
+    parser.add_argument("--analyst-tickers", type=int, default=200)
+    parser.add_argument("--images", type=int, default=24, help="api 场景的不同截图数")
+    parser.add_argument("--repeat", type=int, default=2, help="每张截图发送到 /analyze 的次数")
+    parser.add_argument("--batch-size", type=int, default=6)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--json", help="另存 JSON 结果的路径")
+    parser.add_argument("--record", nargs="+", metavar="TICKER", help="录制真实 yfinance 数据后退出 (需要网络)")
+    args = parser.parse_args()
+
+    if args.record:
+        from bench import fixtures
+        fixtures.record(args.record)
+        return
+
+    url, server = start_database()
+    # 被测模块在导入时读取这些环境变量，必须先于导入设置
+    os.environ.update({"DATABASE_URL": url, "INTERNAL_AUTH_KEY": AUTH_KEY, "GEMINI_API_KEY": "bench"})
+    os.environ.pop("CLOUD_RUN_EXECUTION", None)
+    # 替身不会限流：默认放开令牌桶，结果与引入 market_data 之前的提交可比；显式设置 YF_RATE_PER_SEC 可测限速本身
+    os.environ.setdefault("YF_RATE_PER_SEC", "1000")
+    os.environ.setdefault("YF_BURST", "1000")
+    from bench import fakes
+
+    report = {"commit": subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip() or "unknown",
+              "started_at": datetime.now().isoformat(timespec='seconds'),
+              "latency": {"yf_s": fakes.YF_LATENCY, "gemini_s": fakes.GEMINI_LATENCY}, "results": {}}
+    try:
+        with fakes.installed():
+            import db
+            db.DATABASE_URL = url
+            for name in [s.strip() for s in args.only.split(",") if s.strip()]:
+                reset_database(url)
+                print(f"▶ {name} ...", file=sys.stderr)
+                report["results"][name] = SCENARIOS[name](args)
+    finally:
+        if server is not None:
+            server.cleanup()
+
+    text = format_report(report)
+    print(text)
+    with open(OUTPUT_PATH, "w", encoding="utf-8") as f:
+        f.write(text)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
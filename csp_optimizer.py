@@ -0,0 +1,81 @@
+"""
+CSP (卖出现金担保 Put) 行权价优化：整个观察列表的候选 Put 合并成一张长表，一次性向量化打分并逐标的选出最优行权价。
+每个合约计算权利金收益率、年化收益、到期价外概率 (风险中性 N(d2))、Delta 与买卖价差；
+默认选 |Delta| 最接近 CSP_TARGET_DELTA 的流动合约，设置 CSP_TARGET_RETURN 时改为年化收益最接近目标的合约。
+"""
+import os
+import numpy as np
+import pandas as pd
+import iv_engine
+
+CSP_TARGET_DELTA = float(os.getenv("CSP_TARGET_DELTA", "0.20"))
+# 年化收益目标 (如 0.25)；留空则按 Delta 选择
+CSP_TARGET_RETURN = float(os.getenv("CSP_TARGET_RETURN")) if os.getenv("CSP_TARGET_RETURN") else None
+# 候选到期日的剩余天数范围
+CSP_MIN_DTE = int(os.getenv("CSP_MIN_DTE", "7"))
+CSP_MAX_DTE = int(os.getenv("CSP_MAX_DTE", "60"))
+# 流动性门槛：买卖价差占中间价的比例上限、最小未平仓量
+CSP_MAX_SPREAD_PCT = float(os.getenv("CSP_MAX_SPREAD_PCT", "0.25"))
+CSP_MIN_OPEN_INTEREST = int(os.getenv("CSP_MIN_OPEN_INTEREST", "10"))
+# 价外候选的最大深度 (行权价不低于现价的该比例)
+CSP_MIN_MONEYNESS = float(os.getenv("CSP_MIN_MONEYNESS", "0.5"))
+PUT_COLUMNS = ['ticker', 'expiry', 'strike', 'bid', 'ask', 'mid', 'volume', 'openInterest', 'T', 'solved_iv', 'impliedVolatility', 'underlying']
+PICK_COLUMNS = ['strike', 'expiry', 'premium', 'premium_yield', 'annualized_return', 'delta', 'prob_otm', 'bid_ask_spread', 'open_interest', 'buffer']
+
+def select_puts(solved):
+    """
+    从单个标的求解后的期权链 (iv_engine.solve_chain 的输出) 中取出 CSP 候选：
+    DTE 范围内、行权价低于现价的 Put，只保留打分需要的列，供扫描器在丢弃整张链前暂存。
+    """
+    if solved is None or solved.empty:
+        return pd.DataFrame(columns=PUT_COLUMNS)
+    dte = solved['T'] * 365
+    keep = ((solved['type'] == 'put') & (dte >= CSP_MIN_DTE) & (dte <= CSP_MAX_DTE)
+            & (solved['strike'] < solved['underlying']) & (solved['strike'] >= solved['underlying'] * CSP_MIN_MONEYNESS))
+    puts = solved.loc[keep]
+    return puts.reindex(columns=PUT_COLUMNS)
+
+def score_puts(puts, r=iv_engine.RISK_FREE_RATE):
+    """
+    对所有候选 Put 逐列向量化计算 CSP 指标 (无逐行循环)。
+    权利金按中间价，收益率相对行权价保证金；反推 IV 缺失时退回 yfinance 的 impliedVolatility。
+    """
+    df = puts.reset_index(drop=True)
+    S, K, T = (df[c].to_numpy(dtype=float) for c in ('underlying', 'strike', 'T'))
+    sigma = df['solved_iv'].fillna(df['impliedVolatility']).to_numpy(dtype=float)
+    bid, ask, mid = (df[c].to_numpy(dtype=float) for c in ('bid', 'ask', 'mid'))
+
+    with np.errstate(all='ignore'):
+        sqrt_t = np.sqrt(T)
+        d1 = (np.log(S / K) + (r + 0.5 * sigma ** 2) * T) / (sigma * sqrt_t)
+        d2 = d1 - sigma * sqrt_t
+        df['delta'] = iv_engine.norm_cdf(d1) - 1.0
+        df['prob_otm'] = iv_engine.norm_cdf(d2)
+        df['premium'] = mid
+        df['premium_yield'] = mid / K
+        df['annualized_return'] = df['premium_yield'] / T
+        df['bid_ask_spread'] = ask - bid
+        df['spread_pct'] = (ask - bid) / mid
+    df['open_interest'] = df['openInterest'].fillna(0).astype(int)
+    df['buffer'] = 1.0 - K / S
+    df['liquid'] = ((bid > 0) & (df['spread_pct'] <= CSP_MAX_SPREAD_PCT)
+                    & ((df['open_interest'] >= CSP_MIN_OPEN_INTEREST) | (df['volume'].fillna(0) > 0)))
+    return df
+
+def optimize(puts, target_delta=CSP_TARGET_DELTA, target_return=CSP_TARGET_RETURN):
+    """
+    整张候选表一次打分后，每个标的选出距离目标最近的流动合约 (同等距离取价差更小者)。
+    返回 {ticker: {strike, expiry, premium, ...}}；没有合格合约的标的不在结果中，由调用方回退。
+    """
+    if puts is None or puts.empty:
+        return {}
+    df = score_puts(puts)
+    df = df[df['liquid'] & np.isfinite(df['delta']) & (df['premium'] > 0)]
+    if df.empty:
+        return {}
+    if target_return is not None:
+        df = df.assign(distance=(df['annualized_return'] - target_return).abs())
+    else:
+        df = df.assign(distance=(df['delta'].abs() - target_delta).abs())
+    best = df.sort_values(['ticker', 'distance', 'spread_pct']).drop_duplicates('ticker')
+    return {row.ticker: {c: getattr(row, c) for c in PICK_COLUMNS} for row in best.itertuples(index=False)}
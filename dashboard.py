@@ -1,11 +1,14 @@
 import streamlit as st
 import pandas as pd
-import psycopg2
 import os
+import time
+import db
+import backtest
+import events
 import plotly.express as px
 import plotly.graph_objects as go
 import pytz # Requires: pip install pytz
-from datetime import datetime, timedelta
+from datetime import datetime
 
 # --- 0. Basic Configuration ---
 st.set_page_config(page_title="Whale Flow AI 智能期权看板", layout="wide")
@@ -30,19 +33,62 @@ if not check_password():
     st.stop()
 
 # --- 2. Database Connection Function ---
-DATABASE_URL = os.getenv("DATABASE_URL")
+# Live data (latest scan pointer, social feed) refreshes every LIVE_TTL seconds;
+# per-scan data is immutable once written, so it is cached by scan_timestamp.
+LIVE_TTL = int(os.getenv("DASHBOARD_LIVE_TTL", "60"))
+SCAN_TTL = int(os.getenv("DASHBOARD_SCAN_TTL", "3600"))
+MAX_DISPLAY_COUNT = 30
+# Sort options for the IV alerts: raw IV compares tickers with each other, rank/percentile with their own 52-week history
+IV_SORT_COLUMNS = {"IV 值": "iv_value", "IV Rank (52 周)": "iv_rank", "IV 百分位 (52 周)": "iv_percentile"}
+# With the API's /events stream configured, live sections refresh on change notifications
+# instead of the LIVE_TTL timer; EVENTS_POLL is how often a section checks its in-memory version.
+EVENTS_URL = os.getenv("DASHBOARD_EVENTS_URL")
+EVENTS_POLL = int(os.getenv("DASHBOARD_EVENTS_POLL", "3"))
 
-def get_data(query):
-    conn = psycopg2.connect(DATABASE_URL)
-    df = pd.read_sql(query, conn)
-    conn.close()
-    return df
+@st.cache_resource
+def get_pool():
+    """One connection pool per Streamlit server process, shared by all sessions and reruns."""
+    return db.create_pool(1, int(os.getenv("DASHBOARD_POOL_MAX", "5")))
+
+def run_query(query, params=None):
+    with db.pooled_connection(get_pool()) as conn:
+        return pd.read_sql(query, conn, params=params)
+
+@st.cache_data(ttl=LIVE_TTL, show_spinner=False)
+def get_live_data(query, params=None):
+    return run_query(query, params)
+
+@st.cache_resource
+def get_event_feed():
+    """One /events subscriber thread per Streamlit server process; None when no stream is configured."""
+    if not EVENTS_URL:
+        return None
+    return events.EventFeed(EVENTS_URL, os.getenv("INTERNAL_AUTH_KEY")).start()
+
+def live_version(event_type):
+    """Cache key for a live section: its event version while the stream is up, else a LIVE_TTL time bucket."""
+    feed = get_event_feed()
+    if feed is not None and feed.connected:
+        return ("event", *feed.version(event_type))
+    return ("poll", int(time.time() // LIVE_TTL))
+
+@st.cache_data(ttl=SCAN_TTL, show_spinner=False)
+def get_versioned_data(query, version):
+    """Live query cached until its section's version changes."""
+    return run_query(query)
+
+@st.cache_data(ttl=SCAN_TTL, show_spinner=False)
+def get_scan_data(query, scan_ts, *params):
+    """Results of one scan; scan_ts is both the first query parameter and the cache key."""
+    return run_query(query, (scan_ts, *params))
 
 # --- 3. Core Data Locking & Timezone Handling (PDT) ---
 try:
-    # Get raw timestamp (UTC from DB)
+    # Get raw timestamp (UTC from DB); keep the raw value as the query parameter
     last_scan_query = "SELECT MAX(scan_timestamp) FROM public.iv_analysis"
-    latest_ts_utc = get_data(last_scan_query).iloc[0, 0]
+    st.session_state["scan_version"] = live_version("scan")
+    latest_scan_raw = get_versioned_data(last_scan_query, st.session_state["scan_version"]).iloc[0, 0]
+    latest_ts_utc = latest_scan_raw
     
     # Convert to Pacific Time (Handles PDT/PST automatically)
     local_tz = pytz.timezone("America/Los_Angeles")
@@ -52,6 +98,7 @@ try:
     ts_display = latest_ts_pdt.strftime('%Y-%m-%d %H:%M:%S %Z')
 except:
     latest_ts_utc = None
+    latest_scan_raw = None
     ts_display = "N/A"
 
 # --- 4. Main UI Start ---
@@ -64,26 +111,49 @@ if latest_ts_utc:
     st.sidebar.markdown(f"⏱️ **最新扫描快照 (PDT):** \n`{ts_display}`")
 
 if st.sidebar.button('手动刷新页面'):
+    # Only live data is dropped; per-scan results stay cached until a new scan lands
+    get_live_data.clear()
+    get_versioned_data.clear()
     st.rerun()
 
+event_feed = get_event_feed()
+live_every = EVENTS_POLL if event_feed is not None else None
+
+@st.fragment(run_every=live_every)
+def watch_scans():
+    """A new scan changes every scan-keyed section, so it reruns the whole page; nothing else does."""
+    if event_feed is None: return
+    st.sidebar.caption("🟢 实时推送已连接" if event_feed.connected else "🟡 实时推送重连中，按定时刷新")
+    if event_feed.connected and live_version("scan") != st.session_state.get("scan_version"):
+        st.rerun(scope="app")
+
+with st.sidebar:
+    watch_scans()
+
 # --- B. High IV Alerts (Dynamic Selection) ---
 st.subheader("🔥 异常波动预警 (AI 深度分析)")
 
-display_count = st.selectbox(
-    "选择展示标的数量:",
-    options=[5, 10, 20, 30],
-    index=1,  # Default to 10
-    help="根据 IV 从高到低排序显示的股票数量"
-)
+col_count, col_sort = st.columns(2)
+with col_count:
+    display_count = st.selectbox(
+        "选择展示标的数量:",
+        options=[5, 10, 20, MAX_DISPLAY_COUNT],
+        index=1,  # Default to 10
+        help="根据所选指标从高到低排序显示的股票数量"
+    )
+with col_sort:
+    sort_label = st.selectbox("排序依据:", options=list(IV_SORT_COLUMNS),
+                              help="IV Rank / 百分位衡量当前 IV 在该标的自身过去 52 周中的位置")
 
 if latest_ts_utc:
+    # Fetch the largest selectable page once per sort key; changing display_count only slices the cached frame
     iv_query = f"""
         SELECT * FROM public.iv_analysis 
-        WHERE scan_timestamp = '{latest_ts_utc}' 
-        ORDER BY iv_value DESC 
-        LIMIT {display_count}
+        WHERE scan_timestamp = %s 
+        ORDER BY {IV_SORT_COLUMNS[sort_label]} DESC NULLS LAST, iv_value DESC 
+        LIMIT %s
     """
-    iv_df = get_data(iv_query)
+    iv_df = get_scan_data(iv_query, latest_scan_raw, MAX_DISPLAY_COUNT).head(display_count)
     
     if not iv_df.empty:
         num_cols = 5
@@ -98,6 +168,10 @@ if latest_ts_utc:
                     with cols[c]:
                         st.error(f"**{row['ticker']}**")
                         st.metric(label="隐含波动率", value=f"{float(row['iv_value']):.1%}")
+                        if pd.notna(row.get('iv_rank')) or pd.notna(row.get('iv_percentile')):
+                            rank = f"{row['iv_rank']:.0f}" if pd.notna(row.get('iv_rank')) else "-"
+                            pct = f"{row['iv_percentile']:.0f}%" if pd.notna(row.get('iv_percentile')) else "-"
+                            st.caption(f"📈 IV Rank: `{rank}` · 百分位: `{pct}`")
                         
                         price = row['current_price'] if row['current_price'] else 0
                         mkt_cap = (float(row['market_cap']) / 1e9) if row['market_cap'] else 0
@@ -114,16 +188,24 @@ else:
 # --- C. CSP (Cash-Secured Put) Suggestions ---
 st.subheader("💰 波动率收割：卖出看跌 (CSP) 机会")
 st.markdown("> **策略逻辑**：针对高 IV 标的卖出深度价外 (OTM) Put。若股价横盘或小跌则收割权利金。")
+st.caption("行权价由期权链优化选出 (目标 Delta 附近、买卖价差与未平仓量合格的合约)；权利金按中间价，年化收益相对行权价保证金，OTM 概率为风险中性到期价外概率。链上无合格合约时退回 12% 安全垫。")
 
 if latest_ts_utc:
     # Added expiration_date to the query
-    csp_query = f"SELECT ticker, current_price, suggested_strike, expiration_date, safety_buffer, iv_level, analysis_logic FROM public.csp_suggestions WHERE scan_timestamp = '{latest_ts_utc}' ORDER BY iv_level DESC"
-    csp_df = get_data(csp_query)
+    csp_query = """
+        SELECT ticker, current_price, suggested_strike, expiration_date, safety_buffer, premium, annualized_return,
+               delta, prob_otm, bid_ask_spread, open_interest, iv_level, analysis_logic
+        FROM public.csp_suggestions WHERE scan_timestamp = %s ORDER BY iv_level DESC
+    """
+    csp_df = get_scan_data(csp_query, latest_scan_raw)
     
     if not csp_df.empty:
         display_df = csp_df.copy()
-        display_df.columns = ['标的', '现价', '建议行权价', '到期日', '安全垫', 'IV 水平', '卖出风险评估 (中文)']
+        display_df.columns = ['标的', '现价', '建议行权价', '到期日', '安全垫', '权利金', '年化收益', 'Delta', 'OTM 概率',
+                              '买卖价差', '未平仓量', 'IV 水平', '卖出风险评估 (中文)']
         display_df['IV 水平'] = display_df['IV 水平'].apply(lambda x: f"{float(x):.1%}")
+        for col in ('年化收益', 'OTM 概率'):
+            display_df[col] = display_df[col].apply(lambda x: f"{float(x):.1%}" if pd.notna(x) else "-")
         # Formatting expiration date
         display_df['到期日'] = pd.to_datetime(display_df['到期日']).dt.date
         st.dataframe(display_df, use_container_width=True, hide_index=True)
@@ -133,82 +215,121 @@ if latest_ts_utc:
 st.divider()
 
 # --- D. Strategy Backtest Curves ---
-st.header("🎯 AI 策略聚合回测 (最新建议)")
+@st.cache_data(ttl=SCAN_TTL, show_spinner="回放历史建议...")
+def get_backtest(scan_ts):
+    """Replays every historical suggestion against cached daily bars; recomputed once per scan."""
+    with db.pooled_connection(get_pool()) as conn:
+        trades = backtest.load_trade_history(conn)
+        bars = backtest.load_prices(conn, trades)
+    paths, summary = backtest.run_backtest(trades, bars)
+    return paths, summary, backtest.strategy_curves(trades, paths)
+
+st.header("🎯 AI 策略历史回测 (真实价格回放)")
+st.markdown("> 所有历史建议按日收盘价回放，期权以建仓时 IV 用 Black-Scholes 逐日估值。CALL/PUT 收益相对权利金，CSP 收益相对行权价保证金。")
 if latest_ts_utc:
-    trades_query = f"SELECT * FROM public.option_trades WHERE scan_timestamp = '{latest_ts_utc}' ORDER BY final_score DESC"
-    df_trades = get_data(trades_query)
+    trades_query = "SELECT * FROM public.option_trades WHERE scan_timestamp = %s ORDER BY final_score DESC"
+    df_trades = get_scan_data(trades_query, latest_scan_raw).copy()
+    try:
+        bt_paths, bt_summary, bt_curves = get_backtest(latest_scan_raw)
+    except Exception as e:
+        st.warning(f"回测数据加载失败: {e}")
+        bt_paths, bt_summary, bt_curves = None, pd.DataFrame(), pd.DataFrame()
 else:
     df_trades = pd.DataFrame()
+    bt_paths, bt_summary, bt_curves = None, pd.DataFrame(), pd.DataFrame()
 
-if not df_trades.empty:
-    df_trades['created_at'] = pd.to_datetime(df_trades['created_at'])
-    df_trades['expiration_date'] = pd.to_datetime(df_trades['expiration_date'])
-    
-    tickers = df_trades['ticker'].unique()
+if not bt_curves.empty:
+    col_curve, col_stats = st.columns([2, 1])
+    with col_curve:
+        fig = go.Figure()
+        for strategy in bt_curves.columns:
+            fig.add_trace(go.Scatter(x=bt_curves.index, y=bt_curves[strategy], name=strategy, line=dict(width=3)))
+        fig.update_layout(height=350, template="plotly_dark", hovermode="x unified",
+                          xaxis_title="持有交易日", yaxis_title="平均收益 (P&L %)", title="策略聚合收益曲线")
+        st.plotly_chart(fig, use_container_width=True, key="chart_strategy_aggregate")
+    with col_stats:
+        held = bt_summary[bt_summary['days_held'] > 0]
+        stats = held.groupby('strategy').agg(笔数=('final_pnl', 'size'),
+                                              胜率=('final_pnl', lambda s: f"{(s > 0).mean():.0%}"),
+                                              平均收益=('final_pnl', lambda s: f"{s.mean():.1f}%"),
+                                              平均最大回撤=('max_drawdown', lambda s: f"{s.mean():.1f}%"))
+        st.dataframe(stats, use_container_width=True)
 
-    for ticker in tickers:
+if not df_trades.empty:
+    for ticker in df_trades['ticker'].unique():
         with st.container():
             st.subheader(f"📊 标的分析: {ticker}")
             ticker_df = df_trades[df_trades['ticker'] == ticker]
             col_chart, col_info = st.columns([2, 1])
-            
+            history = bt_summary.index[bt_summary['ticker'] == ticker] if not bt_summary.empty else []
+
             with col_chart:
                 fig = go.Figure()
-                for idx, row in ticker_df.iterrows():
-                    start_date = row['created_at'].date()
-                    end_date = row['expiration_date'].date()
-                    days = (end_date - start_date).days
-                    if days <= 0: days = 1
-                    
-                    dates = [start_date + timedelta(days=i) for i in range(days + 1)]
-                    side_mult = 1 if row['side'] == 'CALL' else -1
-                    base_pnl = [(i * 0.005 * side_mult * 10 * 100) for i in range(len(dates))]
-                    high_pnl = [p + ((i**0.5)*2.5*10) for i, p in enumerate(base_pnl)]
-                    low_pnl = [p - ((i**0.5)*2.5*10) for i, p in enumerate(base_pnl)]
-
-                    label = f"{row['side']} @ {start_date}"
-                    fig.add_trace(go.Scatter(x=dates + dates[::-1], y=high_pnl + low_pnl[::-1],
-                        fill='toself', fillcolor='rgba(0,176,246,0.1)', line_color='rgba(255,255,255,0)', showlegend=False))
-                    fig.add_trace(go.Scatter(x=dates, y=base_pnl, name=label, line=dict(width=3)))
-
-                fig.update_layout(height=400, template="plotly_dark", hovermode="x unified", yaxis_title="预期回报 (P&L %)")
-                st.plotly_chart(fig, use_container_width=True, key=f"chart_{ticker}_{idx}")
+                for i in history:
+                    mask = ~pd.isna(bt_paths['pnl'][i])
+                    if not mask.any(): continue
+                    row = bt_summary.loc[i]
+                    fig.add_trace(go.Scatter(x=bt_paths['dates'][i][mask], y=bt_paths['pnl'][i][mask],
+                                             name=f"{row['strategy']} @ {row['entry_date']}",
+                                             customdata=bt_paths['drawdown'][i][mask],
+                                             hovertemplate="%{y:.1f}% (回撤 %{customdata:.1f}%)"))
+                fig.update_layout(height=400, template="plotly_dark", hovermode="x unified", yaxis_title="实际回报 (P&L %)")
+                st.plotly_chart(fig, use_container_width=True, key=f"chart_{ticker}")
+                if len(fig.data) == 0:
+                    st.caption("暂无可回放的历史价格。")
 
             with col_info:
                 latest_row = ticker_df.iloc[0]
                 st.markdown(f"### 最新 AI 评分: `{latest_row['final_score']}`")
                 st.write(f"**建议行权:** ${latest_row['suggested_strike']}")
                 st.write(f"**R/R 比率:** {latest_row['risk_reward_ratio']}")
+                done = bt_summary.loc[history] if not bt_summary.empty else bt_summary
+                if not done.empty:
+                    done = done[done['days_held'] > 0]
+                if not done.empty:
+                    st.write(f"**历史建议:** {len(done)} 笔，胜率 {(done['final_pnl'] > 0).mean():.0%}，"
+                             f"最大回撤 {done['max_drawdown'].max():.1f}%")
                 st.info(f"**AI 叙事 (中文):**\n\n{latest_row['narrative_type']}")
             st.divider()
 
 # --- E. Sentiment & Leaderboard ---
+# Heat and raw feed are fragments: a "trends" event re-queries and redraws only these two blocks.
 st.header("🔥 今日社交媒体热门股票 Top 10")
 query_heat = """
-    SELECT ticker, COUNT(*) as mention_count,
-           COUNT(*) FILTER (WHERE sentiment = 'Bullish') as bullish_count,
-           COUNT(*) FILTER (WHERE sentiment = 'Bearish') as bearish_count
-    FROM stock_trends
-    WHERE created_at > NOW() - INTERVAL '24 hours'
+    SELECT ticker, SUM(mention_count) as mention_count,
+           SUM(bullish_count) as bullish_count,
+           SUM(bearish_count) as bearish_count
+    FROM public.stock_trend_rollups
+    WHERE bucket_hour > date_trunc('hour', NOW() - INTERVAL '24 hours')
     GROUP BY ticker ORDER BY mention_count DESC LIMIT 10
 """
-df_stocks = get_data(query_heat)
-if not df_stocks.empty:
-    c1, c2 = st.columns(2)
-    with c1:
-        st.plotly_chart(px.bar(df_stocks, x='ticker', y='mention_count', title="讨论热度", template="plotly_dark"), use_container_width=True)
-    with c2:
-        df_m = df_stocks.melt(id_vars='ticker', value_vars=['bullish_count', 'bearish_count'], var_name='Sentiment', value_name='Count')
-        st.plotly_chart(px.bar(df_m, x='ticker', y='Count', color='Sentiment', barmode='group', title="看涨 vs 看跌", template="plotly_dark"), use_container_width=True)
+
+@st.fragment(run_every=live_every)
+def render_heat():
+    df_stocks = get_versioned_data(query_heat, live_version("trends"))
+    if not df_stocks.empty:
+        c1, c2 = st.columns(2)
+        with c1:
+            st.plotly_chart(px.bar(df_stocks, x='ticker', y='mention_count', title="讨论热度", template="plotly_dark"), use_container_width=True, key="chart_heat")
+        with c2:
+            df_m = df_stocks.melt(id_vars='ticker', value_vars=['bullish_count', 'bearish_count'], var_name='Sentiment', value_name='Count')
+            st.plotly_chart(px.bar(df_m, x='ticker', y='Count', color='Sentiment', barmode='group', title="看涨 vs 看跌", template="plotly_dark"), use_container_width=True, key="chart_sentiment")
+
+render_heat()
 
 st.header("🏆 “民间股神”预测准确率排名")
 try:
-    df_authors = get_data("SELECT author, total_predictions, correct_predictions, accuracy_rate FROM author_performance WHERE total_predictions > 0 ORDER BY accuracy_rate DESC LIMIT 10")
+    df_authors = get_live_data("SELECT author, total_predictions, correct_predictions, accuracy_rate FROM author_performance WHERE total_predictions > 0 ORDER BY accuracy_rate DESC LIMIT 10").copy()
     if not df_authors.empty:
         df_authors['accuracy_rate'] = df_authors['accuracy_rate'].apply(lambda x: f"{x:.2f}%")
         st.table(df_authors)
 except: 
     st.info("Leaderboard data loading...")
 
+@st.fragment(run_every=live_every)
+def render_feed():
+    st.dataframe(get_versioned_data("SELECT ticker, sentiment, author, created_at FROM stock_trends ORDER BY created_at DESC LIMIT 20",
+                                    live_version("trends")), use_container_width=True)
+
 with st.expander("📂 查看原始数据流水线 (最新 20 条)"):
-    st.dataframe(get_data("SELECT ticker, sentiment, author, created_at FROM stock_trends ORDER BY created_at DESC LIMIT 20"), use_container_width=True)
\ No newline at end of file
+    render_feed()
\ No newline at end of file
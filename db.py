@@ -0,0 +1,238 @@
+import os
+import json
+import threading
+import psycopg2
+from contextlib import contextmanager
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+# 连接池借满时最多等待的秒数，超时才报错
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# 写入后广播变更的 NOTIFY 频道，API 的 /events 在这里 LISTEN
+EVENTS_CHANNEL = os.getenv("EVENTS_CHANNEL", "whaleflow_events")
+
+# 增量 DDL：全部幂等，任务启动时执行一次即可
+SCHEMA_DDL = [
+    """
+    ALTER TABLE public.iv_analysis
+        ADD COLUMN IF NOT EXISTS iv_term_structure JSONB,
+        ADD COLUMN IF NOT EXISTS iv_skew DOUBLE PRECISION
+    """,
+    # 记录每次 Cloud Run 执行对应的扫描批次，任务重试时复用同一个 scan_timestamp
+    """
+    CREATE TABLE IF NOT EXISTS public.scan_runs (
+        execution_id TEXT PRIMARY KEY,
+        scan_timestamp TIMESTAMP NOT NULL,
+        created_at TIMESTAMPTZ DEFAULT NOW()
+    )
+    """,
+    # 截图分析结果缓存 (精确哈希 + 4096 bit 感知哈希)
+    """
+    CREATE TABLE IF NOT EXISTS public.screenshot_cache (
+        sha256 TEXT PRIMARY KEY,
+        phash BIT(4096) NOT NULL,
+        aspect REAL NOT NULL,
+        result JSONB NOT NULL,
+        created_at TIMESTAMPTZ DEFAULT NOW()
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS screenshot_cache_created_at_idx ON public.screenshot_cache (created_at)",
+    # 日线缓存：analyst_job / verify_now 共用，price_bar_ranges 记录每个标的已完整覆盖的日期区间
+    """
+    CREATE TABLE IF NOT EXISTS public.price_bars (
+        ticker TEXT NOT NULL,
+        bar_date DATE NOT NULL,
+        open DOUBLE PRECISION,
+        high DOUBLE PRECISION,
+        low DOUBLE PRECISION,
+        close DOUBLE PRECISION,
+        volume DOUBLE PRECISION,
+        PRIMARY KEY (ticker, bar_date)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS public.price_bar_ranges (
+        ticker TEXT PRIMARY KEY,
+        first_date DATE NOT NULL,
+        last_date DATE NOT NULL,
+        fetched_at TIMESTAMPTZ DEFAULT NOW()
+    )
+    """,
+    # 每条帖子只评分一次：evaluated_at 为空的才是待评分帖子。
+    # 首次加列时回填：旧版任务每天重评 24~72 小时窗口，已超过 24 小时的帖子都已计入 author_performance，
+    # 不回填的话上线后第一次运行会再计一遍 (只在列不存在时执行一次，之后评分失败的帖子不受影响)
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM information_schema.columns
+                       WHERE table_schema = 'public' AND table_name = 'stock_trends' AND column_name = 'evaluated_at') THEN
+            ALTER TABLE public.stock_trends ADD COLUMN evaluated_at TIMESTAMPTZ;
+            UPDATE public.stock_trends SET evaluated_at = NOW() WHERE post_time < NOW() - INTERVAL '24 hours';
+        END IF;
+    END $$
+    """,
+    "CREATE INDEX IF NOT EXISTS stock_trends_pending_eval_idx ON public.stock_trends (post_time) WHERE evaluated_at IS NULL",
+    # 每标的每小时的提及/情绪计数，由 main.save_to_db 在写入帖子的同一事务内累加，看板热度图只读这张小表
+    """
+    CREATE TABLE IF NOT EXISTS public.stock_trend_rollups (
+        ticker TEXT NOT NULL,
+        bucket_hour TIMESTAMPTZ NOT NULL,
+        mention_count INTEGER NOT NULL DEFAULT 0,
+        bullish_count INTEGER NOT NULL DEFAULT 0,
+        bearish_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (ticker, bucket_hour)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS stock_trend_rollups_bucket_idx ON public.stock_trend_rollups (bucket_hour)",
+    # 首次建表时从已有帖子回填；之后表非空，这条语句不再写入
+    """
+    INSERT INTO public.stock_trend_rollups (ticker, bucket_hour, mention_count, bullish_count, bearish_count)
+    SELECT ticker, date_trunc('hour', created_at), COUNT(*),
+           COUNT(*) FILTER (WHERE sentiment = 'Bullish'), COUNT(*) FILTER (WHERE sentiment = 'Bearish')
+    FROM public.stock_trends
+    WHERE NOT EXISTS (SELECT 1 FROM public.stock_trend_rollups)
+    GROUP BY 1, 2
+    """,
+    # 扫描器跨次复用的标的字段 (市值、新闻标题等)，有效期按字段在 ticker_cache.FIELD_TTLS 中配置
+    """
+    CREATE TABLE IF NOT EXISTS public.ticker_field_cache (
+        ticker TEXT NOT NULL,
+        field TEXT NOT NULL,
+        value JSONB,
+        fetched_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (ticker, field)
+    )
+    """,
+    # 扫描器 Gemini 分片响应缓存，键为分片 prompt 的 SHA-256
+    """
+    CREATE TABLE IF NOT EXISTS public.ai_response_cache (
+        prompt_hash TEXT PRIMARY KEY,
+        response JSONB NOT NULL,
+        created_at TIMESTAMPTZ DEFAULT NOW()
+    )
+    """,
+    # 扫描宇宙中由表维护的部分 (与 universe/*.txt 文件合并)
+    """
+    CREATE TABLE IF NOT EXISTS public.scan_universe (
+        ticker TEXT PRIMARY KEY,
+        source TEXT,
+        active BOOLEAN NOT NULL DEFAULT TRUE,
+        added_at TIMESTAMPTZ DEFAULT NOW()
+    )
+    """,
+    # 每标的每日一个 IV 观测 (当天最后一次扫描为准) 与 52 周窗口的增量状态，见 iv_rank.py
+    """
+    CREATE TABLE IF NOT EXISTS public.iv_history (
+        ticker TEXT NOT NULL,
+        obs_date DATE NOT NULL,
+        iv DOUBLE PRECISION NOT NULL,
+        PRIMARY KEY (ticker, obs_date)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS public.iv_rank_state (
+        ticker TEXT PRIMARY KEY,
+        window_start DATE,
+        through DATE,
+        n INTEGER NOT NULL DEFAULT 0,
+        bins INTEGER[] NOT NULL,
+        max_dates DATE[] NOT NULL,
+        max_values DOUBLE PRECISION[] NOT NULL,
+        min_dates DATE[] NOT NULL,
+        min_values DOUBLE PRECISION[] NOT NULL,
+        updated_at TIMESTAMPTZ DEFAULT NOW()
+    )
+    """,
+    """
+    ALTER TABLE public.iv_analysis
+        ADD COLUMN IF NOT EXISTS iv_rank DOUBLE PRECISION,
+        ADD COLUMN IF NOT EXISTS iv_percentile DOUBLE PRECISION
+    """,
+    # CSP 行权价优化器选中合约的指标，见 csp_optimizer.py
+    """
+    ALTER TABLE public.csp_suggestions
+        ADD COLUMN IF NOT EXISTS premium DOUBLE PRECISION,
+        ADD COLUMN IF NOT EXISTS premium_yield DOUBLE PRECISION,
+        ADD COLUMN IF NOT EXISTS annualized_return DOUBLE PRECISION,
+        ADD COLUMN IF NOT EXISTS delta DOUBLE PRECISION,
+        ADD COLUMN IF NOT EXISTS prob_otm DOUBLE PRECISION,
+        ADD COLUMN IF NOT EXISTS bid_ask_spread DOUBLE PRECISION,
+        ADD COLUMN IF NOT EXISTS open_interest INTEGER
+    """,
+    # 看板排序/筛选用到的列
+    "CREATE INDEX IF NOT EXISTS stock_trends_created_at_idx ON public.stock_trends (created_at DESC)",
+    "CREATE INDEX IF NOT EXISTS iv_analysis_scan_ts_idx ON public.iv_analysis (scan_timestamp, iv_value DESC)",
+    "CREATE INDEX IF NOT EXISTS csp_suggestions_scan_ts_idx ON public.csp_suggestions (scan_timestamp)",
+    "CREATE INDEX IF NOT EXISTS option_trades_scan_ts_idx ON public.option_trades (scan_timestamp)",
+    "CREATE INDEX IF NOT EXISTS author_performance_leaderboard_idx ON public.author_performance (accuracy_rate DESC) WHERE total_predictions > 0",
+]
+
+def connect(**kwargs):
+    """统一的数据库连接入口，额外参数 (如 sslmode) 会覆盖 URL 中的同名设置"""
+    return psycopg2.connect(DATABASE_URL, **kwargs)
+
+class BlockingConnectionPool(ThreadedConnectionPool):
+    """
+    ThreadedConnectionPool 在连接全部借出时直接抛 PoolError；这里用信号量限制同时借出的连接数，
+    借满时排队等待 (最多 DB_POOL_TIMEOUT 秒)，突发并发不会把已经完成的写入丢掉。
+    """
+
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        self._slots = threading.BoundedSemaphore(maxconn)
+        super().__init__(minconn, maxconn, *args, **kwargs)
+
+    def getconn(self, key=None):
+        if not self._slots.acquire(timeout=DB_POOL_TIMEOUT):
+            raise PoolError(f"connection pool exhausted for {DB_POOL_TIMEOUT:g}s")
+        try:
+            return super().getconn(key)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self._slots.release()
+
+def create_pool(minconn=1, maxconn=10, **kwargs):
+    """进程级线程安全连接池，由服务在启动时创建、退出时 closeall()"""
+    return BlockingConnectionPool(minconn, maxconn, DATABASE_URL, **kwargs)
+
+@contextmanager
+def pooled_connection(pool):
+    """从连接池借出连接：正常退出提交、异常回滚；被服务端断开的连接直接丢弃而不归还"""
+    conn = pool.getconn()
+    if conn.closed:
+        # 池中空闲时已被断开的连接：丢弃后换一条
+        pool.putconn(conn, close=True)
+        conn = pool.getconn()
+    broken = False
+    try:
+        with conn:
+            yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        pool.putconn(conn, close=broken or bool(conn.closed))
+
+def ensure_schema(conn):
+    """执行增量 DDL 并提交"""
+    with conn.cursor() as cur:
+        for ddl in SCHEMA_DDL:
+            cur.execute(ddl)
+    conn.commit()
+
+def bulk_insert(cur, table, columns, rows, template=None, suffix=""):
+    """单条多行 INSERT 写入整批数据，整批只有一次网络往返"""
+    if not rows: return 0
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s {suffix}"
+    execute_values(cur, sql, rows, template=template, page_size=len(rows))
+    return len(rows)
+
+def notify(cur, event_type, **payload):
+    """在调用方事务内发送变更通知：提交后才投递，回滚则不发 (payload 上限 8000 字节)"""
+    cur.execute("SELECT pg_notify(%s, %s)", (EVENTS_CHANNEL, json.dumps({"type": event_type, **payload}, default=str)))
@@ -0,0 +1,94 @@
+"""
+镜像统一入口：python entrypoint.py <role>
+每个角色只导入自己用到的模块，并打印一行 JSON 启动耗时 (event=startup)，便于在日志里跟踪冷启动变化。
+"""
+import os
+import sys
+import json
+import time
+
+STARTED = time.perf_counter()
+
+def process_age():
+    """进程从 exec 到现在的秒数 (含解释器自身启动)；非 Linux 返回 None"""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return round(uptime - start_ticks / os.sysconf("SC_CLK_TCK"), 3)
+    except (OSError, ValueError, IndexError):
+        return None
+
+def report(role, phase, **extra):
+    payload = {"event": "startup", "role": role, "phase": phase,
+               "since_entry_s": round(time.perf_counter() - STARTED, 3), "process_s": process_age(), **extra}
+    print(json.dumps(payload), flush=True)
+    return payload
+
+def timed_import(role, name):
+    start = time.perf_counter()
+    module = __import__(name)
+    report(role, "import", module=name, import_s=round(time.perf_counter() - start, 3))
+    return module
+
+def run_api():
+    from contextlib import asynccontextmanager
+    import uvicorn
+    main = timed_import("api", "main")
+    import metrics
+    inner = main.app.router.lifespan_context
+
+    @asynccontextmanager
+    async def lifespan(app):
+        async with inner(app) as state:
+            # 连接池就绪、即将开始接收请求；同时记入 /metrics
+            ready = report("api", "ready")
+            metrics.REGISTRY.observe("startup_seconds", ready["since_entry_s"], "Entrypoint to ready", phase="ready")
+            yield state
+
+    main.app.router.lifespan_context = lifespan
+    uvicorn.run(main.app, host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
+
+def run_scanner():
+    timed_import("scanner", "options_scanner").run_production_scanner()
+
+def run_analyst():
+    timed_import("analyst", "analyst_job").run_analysis()
+
+def run_verify():
+    timed_import("verify", "verify_now").verify_results()
+
+def run_retention():
+    timed_import("retention", "retention").run_retention()
+
+def run_migrate():
+    # 部署时在新版本上线前执行一次：SCHEMA_DDL 中的 ALTER TABLE 会短暂锁表，不放在服务启动路径上
+    db = timed_import("migrate", "db")
+    conn = db.connect(sslmode='require')
+    try:
+        db.ensure_schema(conn)
+    finally:
+        conn.close()
+    report("migrate", "done")
+
+def run_dashboard():
+    # Streamlit 自己管理脚本的导入与重跑，这里只记录到 exec 为止的耗时
+    report("dashboard", "exec")
+    os.execvp("streamlit", ["streamlit", "run", "dashboard.py", f"--server.port={os.environ.get('PORT', 8080)}",
+                            "--server.address=0.0.0.0"])
+
+ROLES = {
+    "api": run_api,
+    "scanner": run_scanner,
+    "analyst": run_analyst,
+    "verify": run_verify,
+    "retention": run_retention,
+    "migrate": run_migrate,
+    "dashboard": run_dashboard,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in ROLES:
+        sys.exit(f"usage: python entrypoint.py {{{'|'.join(ROLES)}}}")
+    ROLES[sys.argv[1]]()
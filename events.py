@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from contextlib import contextmanager
+import psycopg2
+import db
+
+# LISTEN 需要直连；Neon 的连接池 (PgBouncer 事务模式) 不转发通知，可单独配置直连地址
+EVENTS_DATABASE_URL = os.getenv("EVENTS_DATABASE_URL") or db.DATABASE_URL
+# SSE 心跳间隔 (秒)：代理不会因空闲断开连接，客户端也据此判断连接是否失效
+EVENTS_HEARTBEAT = int(os.getenv("EVENTS_HEARTBEAT", "15"))
+# 每个订阅者最多积压的事件数，慢客户端超出后丢弃新事件而不是拖住其他订阅者
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+MAX_RECONNECT_DELAY = 60
+
+class EventHub:
+    """
+    API 进程内的变更通知中心：一条 LISTEN 专用连接挂在事件循环上 (add_reader)，
+    收到 NOTIFY 后扇出到每个 /events 订阅者的队列。连接断开时后台按指数退避重连。
+    """
+
+    def __init__(self, channel=db.EVENTS_CHANNEL, dsn=EVENTS_DATABASE_URL):
+        self.channel = channel
+        self.dsn = dsn
+        self._conn = None
+        self._loop = None
+        self._task = None
+        self._subscribers = set()
+        self.stats = {"received": 0, "dropped": 0, "reconnects": 0}
+
+    def start(self):
+        """在事件循环内调用；连接在后台建立，数据库暂不可用也不阻塞服务启动"""
+        self._loop = asyncio.get_running_loop()
+        self._task = self._loop.create_task(self._connect())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+        self._close()
+
+    def _listen(self):
+        conn = psycopg2.connect(self.dsn)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {self.channel}")
+        return conn
+
+    async def _connect(self):
+        delay = 1
+        while True:
+            try:
+                self._conn = await self._loop.run_in_executor(None, self._listen)
+                break
+            except Exception as e:
+                print(f"⚠️ 变更通知连接失败，{delay}s 后重试: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+        self._loop.add_reader(self._conn.fileno(), self._on_readable)
+        print(f"✅ 已订阅变更通知 ({self.channel})")
+
+    def _close(self):
+        if self._conn is None: return
+        try:
+            self._loop.remove_reader(self._conn.fileno())
+        except (ValueError, OSError):
+            pass
+        self._conn.close()
+        self._conn = None
+
+    def _on_readable(self):
+        try:
+            self._conn.poll()
+        except psycopg2.Error as e:
+            print(f"⚠️ 变更通知连接断开，重连中: {e}")
+            self._close()
+            self.stats["reconnects"] += 1
+            self._task = self._loop.create_task(self._connect())
+            return
+        while self._conn.notifies:
+            note = self._conn.notifies.pop(0)
+            try:
+                event = json.loads(note.payload)
+            except ValueError:
+                continue
+            self.stats["received"] += 1
+            self.publish(event)
+
+    def publish(self, event):
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self.stats["dropped"] += 1
+
+    @contextmanager
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=EVENTS_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        try:
+            yield queue
+        finally:
+            self._subscribers.discard(queue)
+
+    def snapshot(self):
+        return {**self.stats, "connected": self._conn is not None, "subscribers": len(self._subscribers)}
+
+def format_sse(event):
+    return f"event: {event.get('type', 'message')}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+def parse_sse(lines):
+    """把 SSE 文本行解析为事件 dict；注释行 (心跳) 与无法解析的数据被忽略"""
+    data = []
+    for line in lines:
+        if line:
+            if line.startswith("data:"):
+                data.append(line[5:].lstrip())
+            continue
+        if data:
+            try:
+                yield json.loads("\n".join(data))
+            except ValueError:
+                pass
+            data = []
+
+class EventFeed:
+    """
+    看板侧的 /events 订阅线程：不保存数据，只为每类事件维护一个递增版本号。
+    各区块把版本号作为缓存键的一部分，事件到达后下一次渲染才重新查询。
+    generation 在每次 (重新) 连接时递增，断线期间错过的事件因此也会失效缓存。
+    """
+
+    def __init__(self, url, key=None):
+        self.url = url
+        self.headers = {"X-Internal-Key": key} if key else {}
+        self.connected = False
+        self.generation = 0
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self._run, name="event-feed", daemon=True).start()
+        return self
+
+    def version(self, event_type):
+        with self._lock:
+            return self.generation, self._versions.get(event_type, 0)
+
+    def _run(self):
+        import requests # 只有看板进程需要，API 冷启动不导入
+        delay = 1
+        while True:
+            try:
+                # 读超时取心跳的三倍：连续错过心跳即视为断线重连
+                with requests.get(self.url, headers=self.headers, stream=True, timeout=(10, EVENTS_HEARTBEAT * 3)) as resp:
+                    resp.raise_for_status()
+                    with self._lock:
+                        self.generation += 1
+                        self.connected = True
+                    delay = 1
+                    for event in parse_sse(resp.iter_lines(decode_unicode=True)):
+                        with self._lock:
+                            kind = event.get("type")
+                            self._versions[kind] = self._versions.get(kind, 0) + 1
+            except Exception as e:
+                print(f"⚠️ 事件流中断，{delay}s 后重连: {e}")
+            self.connected = False
+            time.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
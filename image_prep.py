@@ -0,0 +1,65 @@
+import io
+import os
+import base64
+import hashlib
+import tempfile
+
+# PIL 只在真正解码截图时才导入 (见 prepare_image / prepare_upload)，不拖慢服务冷启动
+# 送入 Gemini 前的最大边长 / 最大字节数
+MAX_IMAGE_DIM = int(os.getenv("MAX_IMAGE_DIM", "1600"))
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", "1500000"))
+# 上传体积上限；小于 SPOOL_MEMORY_BYTES 的上传留在内存，更大的落到临时文件
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+SPOOL_MEMORY_BYTES = 1024 * 1024
+JPEG_QUALITIES = (85, 75, 65, 55, 45)
+CHUNK_SIZE = 64 * 1024
+
+class UploadTooLarge(ValueError):
+    pass
+
+def from_data_url(data_url):
+    """旧版插件的 base64 data-URL 转成文件对象"""
+    return io.BytesIO(base64.b64decode(data_url.split(',')[1]))
+
+async def spool_stream(chunks):
+    """边读边写请求体到 SpooledTemporaryFile，不在内存里拼完整 body；超过上限直接拒绝"""
+    buf = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        if size > MAX_UPLOAD_BYTES:
+            buf.close()
+            raise UploadTooLarge(f"upload exceeds {MAX_UPLOAD_BYTES} bytes")
+        buf.write(chunk)
+    buf.seek(0)
+    return buf
+
+def file_sha256(fp):
+    """分块计算文件对象的 SHA-256，结束后指针回到开头"""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: fp.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+    fp.seek(0)
+    return digest.hexdigest()
+
+def prepare_image(img):
+    """缩放到 MAX_IMAGE_DIM 以内并重新压缩为 JPEG，逐级降低质量直到不超过 MAX_IMAGE_BYTES"""
+    from PIL import Image
+    # JPEG 源图在解码阶段就按比例缩小，避免先解出全尺寸位图
+    img.draft('RGB', (MAX_IMAGE_DIM, MAX_IMAGE_DIM))
+    img = img.convert('RGB')
+    img.thumbnail((MAX_IMAGE_DIM, MAX_IMAGE_DIM), Image.LANCZOS)
+    for quality in JPEG_QUALITIES:
+        out = io.BytesIO()
+        img.save(out, 'JPEG', quality=quality, optimize=True)
+        if out.tell() <= MAX_IMAGE_BYTES:
+            break
+    return out.getvalue(), img
+
+def prepare_upload(fp):
+    """上传文件 -> (送模型的 JPEG 字节, 缩放后的图片, 原文件 SHA-256)"""
+    from PIL import Image
+    sha = file_sha256(fp)
+    with Image.open(fp) as src:
+        jpeg, img = prepare_image(src)
+    return jpeg, img, sha
@@ -0,0 +1,138 @@
+import os
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+# 无风险利率 (年化)，用于 Black-Scholes 反推
+RISK_FREE_RATE = float(os.getenv("RISK_FREE_RATE", "0.04"))
+# 美股期权在美东 16:00 收盘，到期日按当天收盘计算剩余时间
+EXPIRY_CLOSE_HOUR = 16
+SECONDS_PER_YEAR = 365.0 * 24 * 3600
+SIGMA_MIN, SIGMA_MAX = 1e-4, 5.0
+
+def norm_cdf(x):
+    """标准正态分布 CDF (Abramowitz-Stegun 26.2.17，误差 < 7.5e-8)，纯 NumPy 实现无需 scipy"""
+    x = np.asarray(x, dtype=float)
+    t = 1.0 / (1.0 + 0.2316419 * np.abs(x))
+    poly = t * (0.319381530 + t * (-0.356563782 + t * (1.781477937 + t * (-1.821255978 + t * 1.330274429))))
+    upper = 1.0 - norm_pdf(x) * poly
+    return np.where(x >= 0, upper, 1.0 - upper)
+
+def norm_pdf(x):
+    return np.exp(-0.5 * np.asarray(x, dtype=float) ** 2) / np.sqrt(2 * np.pi)
+
+def bs_price_vega(S, K, T, r, sigma, is_call):
+    """欧式期权 Black-Scholes 定价与 Vega，所有参数均可为同形状数组；Put 由平价公式得到"""
+    sqrt_t = np.sqrt(T)
+    d1 = (np.log(S / K) + (r + 0.5 * sigma ** 2) * T) / (sigma * sqrt_t)
+    d2 = d1 - sigma * sqrt_t
+    disc_k = K * np.exp(-r * T)
+    call = S * norm_cdf(d1) - disc_k * norm_cdf(d2)
+    price = np.where(is_call, call, call - S + disc_k)
+    return price, S * norm_pdf(d1) * sqrt_t
+
+def bs_price(S, K, T, r, sigma, is_call):
+    return bs_price_vega(S, K, T, r, sigma, is_call)[0]
+
+def implied_vol(price, S, K, T, is_call, r=RISK_FREE_RATE, tol=1e-6, max_iter=60):
+    """
+    批量反推隐含波动率：Newton 迭代 + 二分区间保护，整条数组一次求解。
+    价格越过无套利边界或未收敛的合约返回 NaN。
+    """
+    price, S, K, T = np.broadcast_arrays(*(np.asarray(a, dtype=float) for a in (price, S, K, T)))
+    is_call = np.broadcast_to(np.asarray(is_call, dtype=bool), price.shape)
+
+    disc_k = K * np.exp(-r * T)
+    lower = np.where(is_call, np.maximum(S - disc_k, 0.0), np.maximum(disc_k - S, 0.0))
+    upper = np.where(is_call, S, disc_k)
+    valid = np.isfinite(price) & (T > 0) & (S > 0) & (K > 0) & (price > lower) & (price < upper)
+
+    sigma = np.full(price.shape, np.nan)
+    if not valid.any():
+        return sigma
+
+    p, s, k, t, c = price[valid], S[valid], K[valid], T[valid], is_call[valid]
+    lo = np.full(p.shape, SIGMA_MIN)
+    hi = np.full(p.shape, SIGMA_MAX)
+    # Brenner-Subrahmanyam 近似作为初值
+    x = np.clip(np.sqrt(2 * np.pi / t) * p / s, 0.05, 3.0)
+    out = np.full(p.shape, np.nan)
+    active = np.arange(p.size)
+
+    for _ in range(max_iter):
+        # 每轮只对尚未收敛的合约计算，收敛后的元素直接落盘
+        xa = x[active]
+        model, vega = bs_price_vega(s[active], k[active], t[active], r, xa, c[active])
+        diff = model - p[active]
+        done = np.abs(diff) < tol * np.maximum(p[active], 1e-2)
+        out[active[done]] = xa[done]
+        keep = ~done
+        active, xa, diff, vega = active[keep], xa[keep], diff[keep], vega[keep]
+        if active.size == 0:
+            break
+        # 维护二分区间：定价偏高说明 sigma 偏大
+        hi[active] = np.where(diff > 0, xa, hi[active])
+        lo[active] = np.where(diff <= 0, xa, lo[active])
+        with np.errstate(all='ignore'):
+            newton = xa - diff / vega
+        la, ha = lo[active], hi[active]
+        x[active] = np.where((vega > 1e-10) & (newton > la) & (newton < ha), newton, 0.5 * (la + ha))
+
+    sigma[valid] = out
+    return sigma
+
+def years_to_expiry(expiry, now=None):
+    """到期日字符串 (YYYY-MM-DD) 转换为剩余年数，下限 1 小时，避免到期当日除零"""
+    now = now or datetime.now()
+    close = pd.to_datetime(expiry) + pd.Timedelta(hours=EXPIRY_CLOSE_HOUR)
+    seconds = (close - pd.Timestamp(now)).total_seconds()
+    return max(seconds, 3600.0) / SECONDS_PER_YEAR
+
+def solve_chain(chains, now=None, r=RISK_FREE_RATE):
+    """
+    对整张期权链 (可含多个标的、多个到期日、Call + Put) 一次性求解 IV。
+    chains 需要列: ticker, expiry, type ('call'/'put'), strike, bid, ask, underlying。
+    返回带 mid / T / solved_iv 列的新 DataFrame。
+    """
+    df = chains.copy()
+    if df.empty:
+        df['mid'] = df['T'] = df['solved_iv'] = pd.Series(dtype=float)
+        return df
+    now = now or datetime.now()
+    t_map = {e: years_to_expiry(e, now) for e in df['expiry'].unique()}
+    df['T'] = df['expiry'].map(t_map)
+    # 只使用双边报价有效的合约计算中间价
+    quoted = (df['bid'] > 0) & (df['ask'] >= df['bid'])
+    df['mid'] = np.where(quoted, (df['bid'] + df['ask']) / 2, np.nan)
+    df['solved_iv'] = implied_vol(df['mid'].to_numpy(), df['underlying'].to_numpy(), df['strike'].to_numpy(),
+                                  df['T'].to_numpy(), (df['type'] == 'call').to_numpy(), r=r)
+    return df
+
+def atm_term_structure(solved, skew_moneyness=0.9):
+    """
+    每个 (ticker, expiry) 的 ATM IV 与偏斜 (skew)。
+    ATM IV：现价两侧最近的虚值 Put / Call IV 按行权价线性插值；
+    skew：行权价最接近 现价 * skew_moneyness 的 Put IV 减去 ATM IV。
+    """
+    keys = ['ticker', 'expiry']
+    ok = solved[solved['solved_iv'].notna()]
+    below = ok[(ok['type'] == 'put') & (ok['strike'] <= ok['underlying'])]
+    above = ok[(ok['type'] == 'call') & (ok['strike'] >= ok['underlying'])]
+
+    lo = below.loc[below.groupby(keys)['strike'].idxmax(), keys + ['underlying', 'strike', 'solved_iv']]
+    hi = above.loc[above.groupby(keys)['strike'].idxmin(), keys + ['strike', 'solved_iv']]
+    ts = lo.merge(hi, on=keys, how='outer', suffixes=('_lo', '_hi'))
+    if ts.empty:
+        return pd.DataFrame(columns=keys + ['atm_iv', 'skew'])
+
+    span = ts['strike_hi'] - ts['strike_lo']
+    w = np.where(span > 0, (ts['underlying'] - ts['strike_lo']) / span.where(span > 0, 1), 0.5)
+    interp = ts['solved_iv_lo'] + w * (ts['solved_iv_hi'] - ts['solved_iv_lo'])
+    ts['atm_iv'] = interp.fillna(ts['solved_iv_lo']).fillna(ts['solved_iv_hi'])
+
+    puts = ok[ok['type'] == 'put'].copy()
+    puts['dist'] = (puts['strike'] - puts['underlying'] * skew_moneyness).abs()
+    wing = puts.loc[puts.groupby(keys)['dist'].idxmin(), keys + ['solved_iv']].rename(columns={'solved_iv': 'wing_iv'})
+    ts = ts.merge(wing, on=keys, how='left')
+    ts['skew'] = ts['wing_iv'] - ts['atm_iv']
+    return ts[keys + ['atm_iv', 'skew']].sort_values(keys).reset_index(drop=True)
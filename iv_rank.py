@@ -0,0 +1,116 @@
+import os
+from collections import deque
+from datetime import timedelta
+import numpy as np
+import db
+
+# 滚动窗口长度 (自然日)，默认 52 周
+IV_RANK_WINDOW_DAYS = int(os.getenv("IV_RANK_WINDOW_DAYS", "364"))
+# 百分位直方图：IV 0 ~ IV_BIN_MAX 等宽分桶，超出上限的计入最后一桶
+IV_BIN_WIDTH = 0.005
+IV_BIN_MAX = 5.0
+IV_BIN_COUNT = int(IV_BIN_MAX / IV_BIN_WIDTH)
+STATE_COLUMNS = ['ticker', 'window_start', 'through', 'n', 'bins', 'max_dates', 'max_values', 'min_dates', 'min_values']
+
+def bin_index(iv):
+    return min(max(int(iv / IV_BIN_WIDTH), 0), IV_BIN_COUNT - 1)
+
+class IvWindow:
+    """
+    单个标的 52 周 IV 窗口的增量状态 (iv_rank_state 表的一行)：
+    - 直方图 bins + 观测数 n：百分位只需分桶前缀和，与历史长度无关；
+    - 单调队列 max_q / min_q：窗口内最大 / 最小值在队首，每日观测摊还 O(1) 入队出队。
+    through 为已并入窗口的最后一个交易日；当天的 IV 只参与计算、不并入，日内多次扫描互不影响。
+    """
+
+    def __init__(self, window_start=None, through=None, n=0, bins=None,
+                 max_dates=(), max_values=(), min_dates=(), min_values=()):
+        self.window_start = window_start
+        self.through = through
+        self.n = n
+        self.bins = np.zeros(IV_BIN_COUNT, dtype=np.int64) if bins is None else np.asarray(bins, dtype=np.int64)
+        self.max_q = deque(zip(max_dates, max_values))
+        self.min_q = deque(zip(min_dates, min_values))
+
+    def push(self, day, iv):
+        self.bins[bin_index(iv)] += 1
+        self.n += 1
+        while self.max_q and self.max_q[-1][1] <= iv:
+            self.max_q.pop()
+        self.max_q.append((day, iv))
+        while self.min_q and self.min_q[-1][1] >= iv:
+            self.min_q.pop()
+        self.min_q.append((day, iv))
+        self.through = day
+
+    def expire(self, start, values):
+        """窗口起点移动到 start；values 为移出窗口的观测值"""
+        for iv in values:
+            self.bins[bin_index(iv)] -= 1
+            self.n -= 1
+        while self.max_q and self.max_q[0][0] < start:
+            self.max_q.popleft()
+        while self.min_q and self.min_q[0][0] < start:
+            self.min_q.popleft()
+        self.window_start = start
+
+    def rank(self, iv):
+        """IV Rank = (当前 - 窗口最低) / (窗口最高 - 窗口最低)，百分制；无历史返回 None"""
+        if not self.n: return None
+        lo, hi = min(self.min_q[0][1], iv), max(self.max_q[0][1], iv)
+        return round((iv - lo) / (hi - lo) * 100, 2) if hi > lo else None
+
+    def percentile(self, iv):
+        """窗口内低于当前 IV 的观测占比 (同桶计一半)，百分制"""
+        if not self.n: return None
+        b = bin_index(iv)
+        return round((int(self.bins[:b].sum()) + 0.5 * int(self.bins[b])) / self.n * 100, 2)
+
+    def to_row(self, ticker):
+        return (ticker, self.window_start, self.through, self.n, self.bins.tolist(),
+                [d for d, _ in self.max_q], [v for _, v in self.max_q],
+                [d for d, _ in self.min_q], [v for _, v in self.min_q])
+
+def load_states(cur, tickers):
+    cur.execute(f"SELECT {', '.join(STATE_COLUMNS)} FROM public.iv_rank_state WHERE ticker = ANY(%s)", (list(tickers),))
+    return {row[0]: IvWindow(*row[1:]) for row in cur.fetchall()}
+
+def update_ranks(cur, scan_date, ivs):
+    """
+    在调用方事务内：记录当天 IV，把上次之后已收盘的交易日并入窗口、移出过期观测，
+    返回 {ticker: (iv_rank, iv_percentile)}。每次只读写新增 / 过期的那几行，与历史长度无关。
+    """
+    if not ivs: return {}
+    tickers = list(ivs)
+    start = scan_date - timedelta(days=IV_RANK_WINDOW_DAYS)
+    db.bulk_insert(cur, "public.iv_history", ['ticker', 'obs_date', 'iv'],
+                   [(t, scan_date, float(iv)) for t, iv in ivs.items()],
+                   suffix="ON CONFLICT (ticker, obs_date) DO UPDATE SET iv = EXCLUDED.iv")
+    states = load_states(cur, tickers)
+
+    # 只取两类行：上次并入之后、当天之前的新观测；以及本次滑出窗口的旧观测
+    cur.execute("""
+        SELECT h.ticker, h.obs_date, h.iv, s.through IS NULL OR h.obs_date > s.through AS fresh
+        FROM public.iv_history h
+        LEFT JOIN public.iv_rank_state s ON s.ticker = h.ticker
+        WHERE h.ticker = ANY(%(tickers)s) AND h.obs_date < %(today)s
+          AND ((h.obs_date >= %(start)s AND (s.through IS NULL OR h.obs_date > s.through))
+               OR (h.obs_date >= s.window_start AND h.obs_date < %(start)s AND h.obs_date <= s.through))
+        ORDER BY h.ticker, h.obs_date
+    """, {"tickers": tickers, "today": scan_date, "start": start})
+    fresh, expired = {}, {}
+    for ticker, day, iv, is_fresh in cur.fetchall():
+        (fresh if is_fresh else expired).setdefault(ticker, []).append((day, iv))
+
+    ranks = {}
+    for t in tickers:
+        state = states.setdefault(t, IvWindow(window_start=start))
+        state.expire(start, [iv for _, iv in expired.get(t, [])])
+        for day, iv in fresh.get(t, []):
+            state.push(day, iv)
+        ranks[t] = (state.rank(ivs[t]), state.percentile(ivs[t]))
+
+    db.bulk_insert(cur, "public.iv_rank_state", STATE_COLUMNS, [s.to_row(t) for t, s in states.items()],
+                   template="(%s, %s, %s, %s, %s::integer[], %s::date[], %s::float8[], %s::date[], %s::float8[])",
+                   suffix="ON CONFLICT (ticker) DO UPDATE SET " + ", ".join(f"{c} = EXCLUDED.{c}" for c in STATE_COLUMNS[1:]))
+    return ranks
@@ -1,15 +1,88 @@
 import os
-import base64
-import io
 import json
-import psycopg2
+import math
+import asyncio
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
+from functools import lru_cache
 from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-import google.generativeai as genai
-from PIL import Image
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+import psycopg2
+import db
+import events
+import image_prep
+import metrics
+from screenshot_cache import ScreenshotCache, fingerprint
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+INTERNAL_AUTH_KEY = os.getenv("INTERNAL_AUTH_KEY")
+GEMINI_MODEL_NAME = "gemini-2.5-flash"
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+TREND_COLUMNS = ['ticker', 'sentiment', 'author', 'post_time', 'reason', 'source']
+ROLLUP_COLUMNS = ['ticker', 'bucket_hour', 'mention_count', 'bullish_count', 'bearish_count']
+# 单实例同时在途的 Gemini 调用上限，超出直接返回 429
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+gemini_slots = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+# 批量接口：单次请求的图片上限，以及单次 Gemini 调用的打包预算 (张数 / 字节 / 估算 token)
+MAX_BATCH_IMAGES = int(os.getenv("MAX_BATCH_IMAGES", "50"))
+GEMINI_BATCH_MAX_IMAGES = int(os.getenv("GEMINI_BATCH_MAX_IMAGES", "8"))
+GEMINI_BATCH_MAX_BYTES = int(os.getenv("GEMINI_BATCH_MAX_BYTES", str(15 * 1024 * 1024)))
+GEMINI_BATCH_MAX_TOKENS = int(os.getenv("GEMINI_BATCH_MAX_TOKENS", "16000"))
+
+@lru_cache(maxsize=1)
+def get_model():
+    """GenerativeModel 进程内只构建一次；SDK 导入约占冷启动的一半，延迟到启动后的后台预热或首次调用"""
+    import google.generativeai as genai
+    genai.configure(api_key=GEMINI_API_KEY)
+    return genai.GenerativeModel(GEMINI_MODEL_NAME)
+
+def warm_model():
+    try:
+        with metrics.timed("model_warmup"):
+            get_model()
+    except Exception as e:
+        print(f"⚠️ Gemini 模型预热失败: {e}")
+
+# 进程级连接池：启动时创建，退出时关闭
+db_pool = None
+# 截图去重缓存：命中时跳过 Gemini 调用和重复入库
+screenshot_cache = ScreenshotCache()
+# 新提取结果 / 新扫描批次的变更通知 (Postgres LISTEN)，由 /events 推送给看板
+event_hub = events.EventHub()
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    global db_pool
+    # 模型在后台线程预热，不阻塞端口就绪；首个请求若早于预热完成，get_model 会自行构建
+    asyncio.get_running_loop().run_in_executor(None, warm_model)
+    try:
+        # 建表/加列 (会拿 ACCESS EXCLUSIVE 锁) 由部署时的 migrate 任务执行，服务启动只建连接池
+        db_pool = db.create_pool(DB_POOL_MIN, DB_POOL_MAX)
+        print(f"✅ 数据库连接池就绪 ({DB_POOL_MIN}-{DB_POOL_MAX})")
+    except Exception as e:
+        print(f"❌ 数据库连接池创建失败: {e}")
+    event_hub.start()
+    yield
+    await event_hub.stop()
+    if db_pool:
+        db_pool.closeall()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # 按路由模板而不是原始路径打标签，未匹配的路径归为 unmatched，避免标签基数失控
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    metrics.REGISTRY.observe("http_request_seconds", time.perf_counter() - start, "HTTP request latency",
+                             route=route, status=str(response.status_code))
+    return response
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,61 +91,116 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-DATABASE_URL = os.getenv("DATABASE_URL")
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-INTERNAL_AUTH_KEY = os.getenv("INTERNAL_AUTH_KEY")
-genai.configure(api_key=GEMINI_API_KEY)
-GEMINI_MODEL_NAME = "gemini-2.5-flash"
+def rollup_rows(rows):
+    """本批帖子按标的汇总成 (ticker, 提及, 看涨, 看跌)；created_at 与 NOW() 同属一个事务，落在同一小时桶"""
+    counts = {}
+    for ticker, sentiment, *_ in rows:
+        c = counts.setdefault(ticker, [0, 0, 0])
+        c[0] += 1
+        c[1] += sentiment == 'Bullish'
+        c[2] += sentiment == 'Bearish'
+    return [(ticker, *c) for ticker, c in counts.items()]
+
+def save_to_db(records, source="ChromeExtension"):
+    """
+    增强版批量入库：一次分析结果的全部条目在同一事务内用一条多行 INSERT 写入，并累加小时热度汇总。
+    返回写入行数；写入失败返回 None (与"没有可写的行"的 0 区分)。
+    """
+    # 即使 Ticker 相同，只要 Author 或 Post_Time 不同，就是新的有效记录
+    rows = [
+        (r['ticker'].upper(), r['sentiment'].capitalize(), r['author'], r['post_time'], r['reason'], source)
+        for r in records if r.get('ticker') and r.get('sentiment')
+    ]
+    if not rows: return 0
+    if db_pool is None:
+        print("❌ 数据库写入失败: 连接池未初始化")
+        return None
+    # 服务端断开的连接会被 pooled_connection 丢弃，换一条新连接重试一次
+    for attempt in range(2):
+        try:
+            with metrics.timed("db_write", table="stock_trends"), db.pooled_connection(db_pool) as conn, conn.cursor() as cur:
+                db.bulk_insert(cur, "stock_trends", TREND_COLUMNS, rows)
+                db.bulk_insert(cur, "public.stock_trend_rollups", ROLLUP_COLUMNS, rollup_rows(rows),
+                               template="(%s, date_trunc('hour', NOW()), %s, %s, %s)",
+                               suffix="ON CONFLICT (ticker, bucket_hour) DO UPDATE SET "
+                                      "mention_count = stock_trend_rollups.mention_count + EXCLUDED.mention_count, "
+                                      "bullish_count = stock_trend_rollups.bullish_count + EXCLUDED.bullish_count, "
+                                      "bearish_count = stock_trend_rollups.bearish_count + EXCLUDED.bearish_count")
+                db.notify(cur, "trends", count=len(rows), tickers=sorted({row[0] for row in rows})[:100])
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            if attempt == 0:
+                print(f"⚠️ 数据库连接已断开，重试写入: {e}")
+                continue
+            print(f"❌ 数据库写入失败: {e}")
+            return None
+        except Exception as e:
+            print(f"❌ 数据库写入失败: {e}")
+            return None
+        metrics.rows_written("stock_trends", len(rows))
+        for ticker, sentiment, author, *_ in rows:
+            print(f"✅ 已记录: {author} 发布的 {ticker} ({sentiment})")
+        return len(rows)
+
+async def open_upload(request):
+    """
+    按 Content-Type 取出截图文件对象：
+    application/json 为旧版插件的 base64 data-URL；multipart/form-data 取 image 字段；
+    其余 (image/*、application/octet-stream) 视为原始二进制，流式写入临时文件。
+    """
+    ctype = request.headers.get("content-type", "")
+    if ctype.startswith("application/json"):
+        data = await request.json()
+        return image_prep.from_data_url(data['image'])
+    if ctype.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form['image']
+        if upload.size and upload.size > image_prep.MAX_UPLOAD_BYTES:
+            raise image_prep.UploadTooLarge(f"upload exceeds {image_prep.MAX_UPLOAD_BYTES} bytes")
+        return upload.file
+    return await image_prep.spool_stream(request.stream())
+
+async def open_batch_uploads(request):
+    """批量接口的截图列表：JSON {"images": [data-URL, ...]} 或 multipart 的多个 images 字段"""
+    ctype = request.headers.get("content-type", "")
+    if ctype.startswith("multipart/form-data"):
+        form = await request.form(max_files=MAX_BATCH_IMAGES)
+        uploads = form.getlist('images') or form.getlist('image')
+        for upload in uploads:
+            if upload.size and upload.size > image_prep.MAX_UPLOAD_BYTES:
+                raise image_prep.UploadTooLarge(f"{upload.filename} exceeds {image_prep.MAX_UPLOAD_BYTES} bytes")
+        return [upload.file for upload in uploads]
+    data = await request.json()
+    return [image_prep.from_data_url(url) for url in data['images']]
 
-def save_to_db(ticker, sentiment, author, post_time, reason):
-    """增强版入库函数：支持发帖人和发帖时间"""
-    conn = None
+def decode_image(fp):
+    """预处理截图 (缩放 + 重新压缩)，同时计算去重指纹和估算 token"""
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-        
-        # 即使 Ticker 相同，只要 Author 或 Post_Time 不同，就是新的有效记录
-        sql = """
-        INSERT INTO stock_trends (ticker, sentiment, author, post_time, reason, source) 
-        VALUES (%s, %s, %s, %s, %s, %s)
-        """
-        params = (
-            ticker.upper(), 
-            sentiment.capitalize(), 
-            author, 
-            post_time, 
-            reason, 
-            "ChromeExtension"
-        )
-        
-        cur.execute(sql, params)
-        conn.commit()
-        cur.close()
-        print(f"✅ 已记录: {author} 发布的 {ticker} ({sentiment})")
-    except Exception as e:
-        print(f"❌ 数据库写入失败: {e}")
+        jpeg, img, sha = image_prep.prepare_upload(fp)
     finally:
-        if conn:
-            conn.close()
+        fp.close()
+    return {"mime_type": "image/jpeg", "data": jpeg}, fingerprint(sha, img), estimate_image_tokens(img)
 
-@app.post("/analyze")
-async def analyze_route(request: Request):
-    auth_key = request.headers.get("X-Internal-Key")
-    if not INTERNAL_AUTH_KEY or auth_key != INTERNAL_AUTH_KEY:
-        return {"status": "error", "message": "Unauthorized"}
+def estimate_image_tokens(img):
+    """Gemini 按 768x768 切块计费，每块约 258 token"""
+    return 258 * math.ceil(img.width / 768) * math.ceil(img.height / 768)
 
-    try:
-        data = await request.json()
-        image_bytes = base64.b64decode(data['image'].split(',')[1])
-        img = Image.open(io.BytesIO(image_bytes))
+def persist_results(keyed_results, records):
+    """
+    先批量入库，成功后再写截图缓存 (同步 psycopg2，在线程池中执行)。
+    全部记录在同一事务内写入，要么全部落库要么全部没有；失败时不缓存并返回 None，重发的截图会重新分析入库。
+    """
+    saved = save_to_db(records)
+    if saved is None:
+        return None
+    with metrics.timed("cache_store"):
+        screenshot_cache.store_many(keyed_results, pool=db_pool)
+    return saved
 
-        # 获取当前时间传给 AI，方便它计算“3小时前”的具体日期
-        now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def parse_model_json(text):
+    return json.loads(text.strip().replace("```json", "").replace("```", ""))
 
-        print(f"--- 开始 AI 分析 (当前参考时间: {now_str}) ---")
-        
-        model = genai.GenerativeModel(GEMINI_MODEL_NAME)
-        prompt = f"""
+def build_prompt(now_str):
+    return f"""
         你是一个专业的社交媒体数据抓取助手。
         当前系统参考时间是: {now_str}。
         
@@ -89,27 +217,252 @@ async def analyze_route(request: Request):
         ]
         不要返回任何 Markdown 标记。
         """
+
+def build_batch_prompt(now_str, count):
+    return f"""
+        你是一个专业的社交媒体数据抓取助手。
+        当前系统参考时间是: {now_str}。
         
-        response = model.generate_content([prompt, img])
-        raw_text = response.text.strip().replace("```json", "").replace("```", "")
-        analysis_results = json.loads(raw_text)
-
-        # 遍历结果并入库
-        for item in analysis_results:
-            save_to_db(
-                ticker=item.get('ticker'),
-                sentiment=item.get('sentiment'),
-                author=item.get('author', 'Unknown'),
-                post_time=item.get('post_time', now_str), # 默认使用当前时间
-                reason="AI Vision Extraction"
-            )
+        任务：下面依次给出 {count} 张 Reddit 或小红书的截图，编号 0 到 {count - 1}。对每张截图分别提取：
+        1. 提及的股票代码 (ticker)
+        2. 情绪 (sentiment: Bullish/Bearish/Neutral)
+        3. 发帖人用户名 (author: 如果找不到则填 Unknown)
+        4. 原始发帖时间 (post_time: 如果是'2h ago'请计算出具体时间，格式 YYYY-MM-DD HH:MM:SS)
+        5. 该条结果来自的截图编号 (image_index)
+        
+        请严格返回一个 JSON 数组，包含所有截图的结果，例如:
+        [
+          {{"image_index": 0, "ticker": "NVDA", "sentiment": "Bullish", "author": "UserA", "post_time": "2026-01-01 18:00:00"}},
+          {{"image_index": 1, "ticker": "AAPL", "sentiment": "Bearish", "author": "UserB", "post_time": "2026-01-01 17:30:00"}}
+        ]
+        不要返回任何 Markdown 标记。
+        """
+
+def pack_shards(entries):
+    """按张数 / 字节 / token 预算把待分析截图切成多图请求"""
+    shards, current, size, tokens = [], [], 0, 0
+    for entry in entries:
+        blob_size = len(entry['blob']['data'])
+        if current and (len(current) >= GEMINI_BATCH_MAX_IMAGES
+                        or size + blob_size > GEMINI_BATCH_MAX_BYTES
+                        or tokens + entry['tokens'] > GEMINI_BATCH_MAX_TOKENS):
+            shards.append(current)
+            current, size, tokens = [], 0, 0
+        current.append(entry)
+        size += blob_size
+        tokens += entry['tokens']
+    if current:
+        shards.append(current)
+    return shards
+
+async def analyze_shard(shard, now_str):
+    """
+    一次 Gemini 调用分析一组截图，按 image_index 把结果映射回各自图片。
+    整组调用失败时拆成单图重试，单张坏图不会拖垮同组其他图片。
+    返回 ({图片序号: 结果列表}, {图片序号: 错误信息})；多图请求中模型没有给出任何结果的图片不在结果里
+    (无法区分"图中没有标的"与"模型漏掉了这张")，由调用方按未映射处理、不写缓存。
+    """
+    parts = [build_batch_prompt(now_str, len(shard))]
+    for pos, entry in enumerate(shard):
+        parts += [f"图片 {pos}:", entry['blob']]
+    try:
+        async with gemini_slots:
+            with metrics.timed("gemini", mode="batch"):
+                response = await get_model().generate_content_async(parts)
+        # 单图请求的空数组是明确的"没有标的"；多图请求只认模型显式映射到的图片
+        results = {shard[0]['index']: []} if len(shard) == 1 else {}
+        for item in parse_model_json(response.text):
+            pos = item.pop('image_index', 0 if len(shard) == 1 else None)
+            if isinstance(pos, int) and 0 <= pos < len(shard):
+                results.setdefault(shard[pos]['index'], []).append(item)
+        return results, {}
+    except Exception as e:
+        if len(shard) == 1:
+            return {}, {shard[0]['index']: str(e)}
+        print(f"⚠️ 多图请求失败，拆分为单图重试 ({len(shard)} 张): {e}")
+        results, errors = {}, {}
+        for r, err in await asyncio.gather(*(analyze_shard([entry], now_str) for entry in shard)):
+            results.update(r)
+            errors.update(err)
+        return results, errors
+
+def to_trend_records(analysis_results, now_str):
+    return [
+        {
+            "ticker": item.get('ticker'),
+            "sentiment": item.get('sentiment'),
+            "author": item.get('author', 'Unknown'),
+            "post_time": item.get('post_time', now_str), # 默认使用当前时间
+            "reason": "AI Vision Extraction"
+        }
+        for item in analysis_results
+    ]
+
+def persist_failed_response(data):
+    """分析已完成但入库失败：返回 503 而不是 success，结果未缓存，客户端重发会重新分析入库"""
+    return JSONResponse(status_code=503, content={"status": "error", "message": "Database write failed, retry later",
+                                                  "count": len(data), "data": data})
+
+def busy_response():
+    return JSONResponse(status_code=429, content={"status": "busy", "message": "Too many analyses in flight, retry later"})
+
+@app.post("/analyze")
+async def analyze_route(request: Request):
+    auth_key = request.headers.get("X-Internal-Key")
+    if not INTERNAL_AUTH_KEY or auth_key != INTERNAL_AUTH_KEY:
+        return {"status": "error", "message": "Unauthorized"}
+
+    # 在途 Gemini 调用已满时立即返回 429，而不是排队拖长尾延迟
+    if gemini_slots.locked():
+        return busy_response()
+
+    try:
+        with metrics.timed("upload_read"):
+            fp = await open_upload(request)
+        with metrics.timed("image_decode"):
+            img, key, _ = await run_in_threadpool(decode_image, fp)
+
+        # 相同或近似截图直接返回缓存结果，不再调用模型、不再重复入库
+        with metrics.timed("cache_lookup"):
+            cached = await run_in_threadpool(screenshot_cache.lookup, *key, db_pool)
+        metrics.cache_event("screenshot", cached is not None)
+        if cached is not None:
+            print(f"♻️ 截图缓存命中 ({key[0][:12]})")
+            return {"status": "success", "count": len(cached), "data": cached, "cached": True}
+
+        # 获取当前时间传给 AI，方便它计算“3小时前”的具体日期
+        now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        print(f"--- 开始 AI 分析 (当前参考时间: {now_str}) ---")
+
+        # 读取与解码期间名额可能已被占满，再检查一次
+        if gemini_slots.locked():
+            return busy_response()
+        async with gemini_slots:
+            with metrics.timed("gemini", mode="single"):
+                response = await get_model().generate_content_async([build_prompt(now_str), img])
+        analysis_results = parse_model_json(response.text)
+
+        # 全部结果一次性批量入库 (同步 psycopg2 放到线程池，避免阻塞事件循环)
+        saved = await run_in_threadpool(persist_results, [(key, analysis_results)], to_trend_records(analysis_results, now_str))
+        if saved is None:
+            return persist_failed_response(analysis_results)
         
         return {"status": "success", "count": len(analysis_results), "data": analysis_results}
 
+    except image_prep.UploadTooLarge as e:
+        return JSONResponse(status_code=413, content={"status": "error", "message": str(e)})
     except Exception as e:
         print(f"🚨 运行异常: {e}")
         return {"status": "error", "message": str(e)}
 
+@app.post("/analyze/batch")
+async def analyze_batch_route(request: Request):
+    """批量截图分析：多图打包进同一次 Gemini 调用，逐图返回状态，全部结果一次入库"""
+    auth_key = request.headers.get("X-Internal-Key")
+    if not INTERNAL_AUTH_KEY or auth_key != INTERNAL_AUTH_KEY:
+        return {"status": "error", "message": "Unauthorized"}
+    if gemini_slots.locked():
+        return busy_response()
+
+    try:
+        files = await open_batch_uploads(request)
+    except image_prep.UploadTooLarge as e:
+        return JSONResponse(status_code=413, content={"status": "error", "message": str(e)})
+    except Exception as e:
+        return {"status": "error", "message": f"Invalid batch payload: {e}"}
+    if len(files) > MAX_BATCH_IMAGES:
+        for fp in files: fp.close()
+        return JSONResponse(status_code=413, content={"status": "error", "message": f"At most {MAX_BATCH_IMAGES} images per batch"})
+
+    results = [None] * len(files)
+    with metrics.timed("image_decode", mode="batch"):
+        decoded = await asyncio.gather(*(run_in_threadpool(decode_image, fp) for fp in files), return_exceptions=True)
+
+    # 1. 预处理失败或缓存命中的图片不进入模型调用
+    pending = []
+    for index, item in enumerate(decoded):
+        if isinstance(item, Exception):
+            results[index] = {"index": index, "status": "error", "message": f"Invalid image: {item}"}
+            continue
+        blob, key, tokens = item
+        with metrics.timed("cache_lookup"):
+            cached = await run_in_threadpool(screenshot_cache.lookup, *key, db_pool)
+        metrics.cache_event("screenshot", cached is not None)
+        if cached is not None:
+            results[index] = {"index": index, "status": "cached", "count": len(cached), "data": cached}
+            continue
+        pending.append({"index": index, "blob": blob, "key": key, "tokens": tokens})
+
+    # 2. 其余图片按预算打包，多组并发调用 Gemini (受 GEMINI_MAX_CONCURRENCY 限制)
+    now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    shards = pack_shards(pending)
+    print(f"--- 批量 AI 分析: {len(files)} 张截图, {len(pending)} 张待分析, {len(shards)} 次模型调用 ---")
+    analyzed, errors = {}, {}
+    for r, err in await asyncio.gather(*(analyze_shard(shard, now_str) for shard in shards)):
+        analyzed.update(r)
+        errors.update(err)
+
+    # 3. 所有新结果一次入库
+    keyed_results, records, fresh = [], [], []
+    for entry in pending:
+        index = entry['index']
+        if index in errors:
+            results[index] = {"index": index, "status": "error", "message": errors[index]}
+            continue
+        if index not in analyzed:
+            # 模型没有返回这张图的结果：不缓存，重发时会重新分析
+            results[index] = {"index": index, "status": "unmapped", "count": 0, "data": [],
+                              "message": "Model returned no result for this image, retry later"}
+            continue
+        data = analyzed[index]
+        results[index] = {"index": index, "status": "success", "count": len(data), "data": data}
+        keyed_results.append((entry['key'], data))
+        records += to_trend_records(data, now_str)
+        fresh.append(index)
+    if keyed_results and await run_in_threadpool(persist_results, keyed_results, records) is None:
+        # 整批同一事务，入库失败时本批新分析的图片全部标为失败 (未缓存)，客户端可以重发
+        for index in fresh:
+            results[index] = {"index": index, "status": "error", "message": "Database write failed, retry later",
+                              "data": results[index]['data']}
+        return JSONResponse(status_code=503, content={"status": "error", "message": "Database write failed, retry later",
+                                                      "count": sum(r.get('count', 0) for r in results), "results": results})
+
+    return {"status": "success", "count": sum(r.get('count', 0) for r in results), "results": results}
+
+@app.get("/cache/stats")
+async def cache_stats_route(request: Request):
+    if not INTERNAL_AUTH_KEY or request.headers.get("X-Internal-Key") != INTERNAL_AUTH_KEY:
+        return {"status": "error", "message": "Unauthorized"}
+    return {"status": "success", "screenshot_cache": screenshot_cache.snapshot(), "events": event_hub.snapshot()}
+
+@app.get("/metrics")
+async def metrics_route(request: Request):
+    """Prometheus 文本格式的阶段耗时直方图与计数器"""
+    if not INTERNAL_AUTH_KEY or request.headers.get("X-Internal-Key") != INTERNAL_AUTH_KEY:
+        return JSONResponse(status_code=401, content={"status": "error", "message": "Unauthorized"})
+    return PlainTextResponse(metrics.REGISTRY.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/events")
+async def events_route(request: Request):
+    """Server-Sent Events：新提取结果 (trends) 与新扫描批次 (scan) 写入提交后推送，空闲时发送心跳"""
+    if not INTERNAL_AUTH_KEY or request.headers.get("X-Internal-Key") != INTERNAL_AUTH_KEY:
+        return JSONResponse(status_code=401, content={"status": "error", "message": "Unauthorized"})
+
+    async def stream():
+        with event_hub.subscribe() as queue:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), events.EVENTS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield events.format_sse(event)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 8080))
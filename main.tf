@@ -61,7 +61,7 @@ resource "google_cloud_run_v2_service" "ui_service" {
   template {
     containers {
       image   = "us-central1-docker.pkg.dev/gen-lang-client-0486815668/stock-scanner-repo/app:latest"
-      command = ["streamlit", "run", "dashboard.py", "--server.port=8080", "--server.address=0.0.0.0"]
+      command = ["python", "entrypoint.py", "dashboard"]
       env { 
         name = "DATABASE_URL"      
         value = "placeholder" 
@@ -70,6 +70,20 @@ resource "google_cloud_run_v2_service" "ui_service" {
         name = "DASHBOARD_PASSWORD" 
         value = "placeholder" 
       }
+      # 订阅 API 的 /events (LISTEN/NOTIFY -> SSE)，有新数据时推送刷新；未配置时看板退回定时轮询
+      env { 
+        name = "DASHBOARD_EVENTS_URL" 
+        value = "${google_cloud_run_v2_service.stock_service.uri}/events" 
+      }
+      env { 
+        name = "INTERNAL_AUTH_KEY" 
+        value = "placeholder" 
+      }
+      # 回测历史要读取 retention 任务导出的 Parquet 归档，必须与 retention_job 使用同一位置
+      env { 
+        name = "ARCHIVE_URI" 
+        value = "gs://placeholder/archive" 
+      }
     }
   }
 }
@@ -99,7 +113,7 @@ resource "google_cloud_run_v2_job" "analyst_job" {
     template {
       containers {
         image   = "us-central1-docker.pkg.dev/gen-lang-client-0486815668/stock-scanner-repo/app:latest"
-        command = ["python", "analyst_job.py"]
+        command = ["python", "entrypoint.py", "analyst"]
         env { 
           name = "DATABASE_URL" 
           value = "placeholder" 
@@ -117,7 +131,7 @@ resource "google_cloud_run_v2_job" "option_scanner_job" {
     template {
       containers {
         image   = "us-central1-docker.pkg.dev/gen-lang-client-0486815668/stock-scanner-repo/app:latest"
-        command = ["python", "options_scanner.py"]
+        command = ["python", "entrypoint.py", "scanner"]
         env { 
           name = "DATABASE_URL"   
           value = "placeholder" 
@@ -131,6 +145,46 @@ resource "google_cloud_run_v2_job" "option_scanner_job" {
   }
 }
 
+# C. 数据库结构迁移任务：每次部署在服务更新前执行一次 (建表、加列、建索引)
+resource "google_cloud_run_v2_job" "migrate_job" {
+  name     = "stock-migrate-job"
+  location = "us-central1"
+  template {
+    template {
+      containers {
+        image   = "us-central1-docker.pkg.dev/gen-lang-client-0486815668/stock-scanner-repo/app:latest"
+        command = ["python", "entrypoint.py", "migrate"]
+        env { 
+          name = "DATABASE_URL" 
+          value = "placeholder" 
+        }
+      }
+    }
+  }
+}
+
+# D. 分区维护与归档任务：预建月分区，超过保留期的分区导出 Parquet 后删除
+resource "google_cloud_run_v2_job" "retention_job" {
+  name     = "stock-retention-job"
+  location = "us-central1"
+  template {
+    template {
+      containers {
+        image   = "us-central1-docker.pkg.dev/gen-lang-client-0486815668/stock-scanner-repo/app:latest"
+        command = ["python", "entrypoint.py", "retention"]
+        env { 
+          name = "DATABASE_URL" 
+          value = "placeholder" 
+        }
+        env { 
+          name = "ARCHIVE_URI" 
+          value = "gs://placeholder/archive" 
+        }
+      }
+    }
+  }
+}
+
 # --- 5. 定时触发器 (Scheduler) ---
 
 # 每天早上 8:00 触发期权扫描
@@ -165,6 +219,22 @@ resource "google_cloud_scheduler_job" "analyst_trigger" {
   }
 }
 
+# 每月 1 日凌晨 3:00 执行分区维护与归档
+resource "google_cloud_scheduler_job" "retention_trigger" {
+  name      = "monthly-retention-trigger"
+  schedule  = "0 3 1 * *"
+  region    = "us-central1"
+  time_zone = "Asia/Shanghai"
+
+  http_target {
+    http_method = "POST"
+    uri         = "https://us-central1-run.googleapis.com/apis/run.googleapis.com/v1/namespaces/${data.google_project.project.number}/jobs/stock-retention-job:run"
+    oauth_token {
+      service_account_email = "aiprojectadmin@gen-lang-client-0486815668.iam.gserviceaccount.com"
+    }
+  }
+}
+
 # --- 6. 输出 ---
 output "api_url" { value = google_cloud_run_v2_service.stock_service.uri }
 output "ui_url"  { value = google_cloud_run_v2_service.ui_service.uri }
@@ -183,4 +253,12 @@ resource "google_cloud_run_v2_job_iam_member" "invoke_analyst" {
   name     = google_cloud_run_v2_job.analyst_job.name
   role     = "roles/run.invoker"
   member   = "serviceAccount:aiprojectadmin@gen-lang-client-0486815668.iam.gserviceaccount.com"
+}
+
+# 允许该服务账号调用分区维护 Job
+resource "google_cloud_run_v2_job_iam_member" "invoke_retention" {
+  location = "us-central1"
+  name     = google_cloud_run_v2_job.retention_job.name
+  role     = "roles/run.invoker"
+  member   = "serviceAccount:aiprojectadmin@gen-lang-client-0486815668.iam.gserviceaccount.com"
 }
\ No newline at end of file
@@ -0,0 +1,246 @@
+"""
+统一的 Yahoo 行情访问入口 (扫描器、初筛、日线缓存、验证任务共用)：
+- 令牌桶限速：进程内所有线程共享，并发抓取也不超过 YF_RATE_PER_SEC；
+- 共享 HTTP 会话：所有 Ticker / download 复用同一个 curl_cffi 会话 (连接与 cookie/crumb)；
+- 抖动退避重试：限流与网络错误按指数退避 + 随机抖动重试；
+- 熔断：连续限流达到阈值后在冷却期内直接失败，不让整个任务卡在重试上。
+失败分为 Throttled (被限流 / 熔断中，稍后可重试) 与 NoData (标的本身没有数据)，调用方据此区分处理。
+"""
+import os
+import math
+import time
+import random
+import threading
+from functools import lru_cache
+import pandas as pd
+import yfinance as yf
+import metrics
+
+YF_RATE_PER_SEC = float(os.getenv("YF_RATE_PER_SEC", "10"))
+YF_BURST = int(os.getenv("YF_BURST", "40"))
+YF_RETRIES = int(os.getenv("YF_RETRIES", "3"))
+YF_BACKOFF_BASE = float(os.getenv("YF_BACKOFF_BASE", "1.0"))
+YF_BACKOFF_MAX = float(os.getenv("YF_BACKOFF_MAX", "30"))
+# 连续限流多少次后熔断，以及熔断的冷却时间 (秒)
+YF_BREAKER_THRESHOLD = int(os.getenv("YF_BREAKER_THRESHOLD", "5"))
+YF_BREAKER_COOLDOWN = float(os.getenv("YF_BREAKER_COOLDOWN", "60"))
+THROTTLE_MARKERS = ("too many requests", "rate limit", "429")
+# yfinance 用这些异常表示标的本身缺数据，而不是请求失败
+MISSING_ERRORS = (yf.exceptions.YFPricesMissingError, yf.exceptions.YFTickerMissingError, yf.exceptions.YFTzMissingError)
+# yf.download 中可以原样传给单标的 history 的参数 (补抓时沿用同一窗口与复权方式)
+HISTORY_ARGS = ('start', 'end', 'period', 'interval', 'prepost', 'actions', 'auto_adjust', 'back_adjust', 'repair', 'keepna', 'rounding', 'timeout')
+
+class MarketDataError(Exception):
+    pass
+
+class Throttled(MarketDataError):
+    """被 Yahoo 限流 (重试耗尽) 或熔断中；数据可能存在，只是现在取不到"""
+
+class CircuitOpen(Throttled):
+    pass
+
+class NoData(MarketDataError):
+    """请求成功但标的没有数据 (退市、代码错误、无期权等)"""
+
+class TokenBucket:
+    """线程安全令牌桶；单次消耗可以超过桶容量 (批量下载)，欠下的令牌由后续调用等待补齐"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, cost=1):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= min(cost, self.burst):
+                    self.tokens -= cost
+                    return
+                wait = (min(cost, self.burst) - self.tokens) / self.rate
+            time.sleep(wait)
+
+class CircuitBreaker:
+    """连续限流计数达到阈值即打开；冷却期后放行一次试探请求 (半开)，成功则关闭"""
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if not self._probing and time.monotonic() - self.opened_at >= self.cooldown:
+                self._probing = True
+                return True
+            return False
+
+    def record(self, throttled):
+        with self._lock:
+            self._probing = False
+            if not throttled:
+                self.failures, self.opened_at = 0, None
+                return
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    print(f"⛔ 行情接口连续限流 {self.failures} 次，熔断 {self.cooldown:.0f}s")
+                self.opened_at = time.monotonic()
+
+bucket = TokenBucket(YF_RATE_PER_SEC, YF_BURST)
+breaker = CircuitBreaker(YF_BREAKER_THRESHOLD, YF_BREAKER_COOLDOWN)
+_stats = {"ok": 0, "throttled": 0, "no_data": 0, "error": 0, "circuit_open": 0}
+_stats_lock = threading.Lock()
+_download_lock = threading.Lock()
+
+def _record(op, outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+    metrics.count("market_data_calls_total", 1, "Market data calls by outcome", op=op, outcome=outcome)
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)
+
+def reset_stats():
+    with _stats_lock:
+        for k in _stats: _stats[k] = 0
+
+@lru_cache(maxsize=1)
+def session():
+    """进程内共享的 HTTP 会话 (yfinance 1.x 要求 curl_cffi)；curl_cffi 会话按线程复用底层连接"""
+    from curl_cffi import requests as curl_requests
+    return curl_requests.Session(impersonate="chrome")
+
+def is_throttle(exc):
+    if isinstance(exc, yf.exceptions.YFRateLimitError):
+        return True
+    return any(m in str(exc).lower() for m in THROTTLE_MARKERS)
+
+def backoff(attempt):
+    """full jitter：[0, base * 2^attempt) 内随机，避免多个线程同时重试"""
+    return random.uniform(0, min(YF_BACKOFF_MAX, YF_BACKOFF_BASE * 2 ** attempt))
+
+def fetch(op, fn, *args, cost=1, **kwargs):
+    """
+    限速 + 重试 + 熔断地执行一次行情调用。op 用于指标标签 (quote / options / chain / info / news / history / download)。
+    限流与网络错误重试 YF_RETRIES 次；NoData 与其他数据错误不重试，原样抛出。
+    """
+    for attempt in range(YF_RETRIES + 1):
+        if not breaker.allow():
+            _record(op, "circuit_open")
+            raise CircuitOpen(f"{op}: market data circuit open")
+        bucket.acquire(cost)
+        try:
+            result = fn(*args, **kwargs)
+        except NoData:
+            breaker.record(False)
+            _record(op, "no_data")
+            raise
+        except Exception as e:
+            throttled = is_throttle(e)
+            breaker.record(throttled)
+            transient = throttled or isinstance(e, (ConnectionError, TimeoutError, OSError))
+            if not transient or attempt == YF_RETRIES:
+                _record(op, "throttled" if throttled else "error")
+                if throttled:
+                    raise Throttled(f"{op}: {e}") from e
+                raise
+            time.sleep(backoff(attempt))
+            continue
+        breaker.record(False)
+        _record(op, "ok")
+        return result
+
+def ticker(symbol):
+    return yf.Ticker(symbol, session=session())
+
+def quote(t):
+    """t 为 ticker() 返回的对象；最新价缺失视为 NoData"""
+    def last_price():
+        price = t.fast_info['last_price']
+        if price is None or not math.isfinite(price) or price <= 0:
+            raise NoData(f"{t.ticker}: no last price")
+        return float(price)
+    return fetch("quote", last_price)
+
+def history(symbol, **kwargs):
+    """
+    单标的 K 线。yfinance 即使隐藏异常也会抛出 YFRateLimitError (按限流重试)；
+    缺数据时返回空表 (或在关闭 hide_exceptions 时抛 MISSING_ERRORS)，两者都视为 NoData。
+    """
+    def load():
+        try:
+            hist = ticker(symbol).history(**kwargs)
+        except MISSING_ERRORS as e:
+            raise NoData(f"{symbol}: {e}") from e
+        if hist is None or hist.empty:
+            raise NoData(f"{symbol}: empty history")
+        return hist
+    return fetch("history", load)
+
+def _empty_tickers(df, tickers, level):
+    """结果中没有任何有效数据的标的 (yfinance 对失败的标的留下全 NaN 列或干脆缺列)"""
+    if df is None or df.empty:
+        return list(tickers)
+    if not isinstance(df.columns, pd.MultiIndex):
+        return [] if df.notna().any().any() else list(tickers)
+    has_data = df.notna().any().groupby(level=level).any()
+    return [t for t in tickers if not has_data.get(t, False)]
+
+def _splice(df, frames, level):
+    """把逐个补抓的单标的 K 线按原结果的列布局 (Ticker 在第 level 层) 拼回宽表"""
+    if not isinstance(df.columns, pd.MultiIndex):
+        return next(iter(frames.values()))
+    fields = list(dict.fromkeys(df.columns.get_level_values(1 - level))) or list(next(iter(frames.values())).columns)
+    parts = [df.drop(columns=list(frames), level=level, errors='ignore')]
+    for t, hist in frames.items():
+        hist = hist.reindex(columns=fields)
+        if hist.index.tz is not None and df.index.tz is None:
+            hist.index = hist.index.tz_localize(None)
+        keys = [(t, f) if level == 0 else (f, t) for f in fields]
+        parts.append(hist.set_axis(pd.MultiIndex.from_tuples(keys, names=df.columns.names), axis=1))
+    return pd.concat(parts, axis=1, sort=True)
+
+def download(tickers, **kwargs):
+    """
+    多标的批量日线：一次 yf.download 按标的数消耗令牌，只有整批请求失败才按批重试。
+    yf.download 把单个标的的异常吞掉并留下空列，这里从返回的宽表中找出没有数据的标的，
+    逐个用 history 补抓 (每个 1 个令牌，各自区分限流 / 无数据)：缺数据的标的直接缺席，
+    被限流的标的本次缺席并告警；所有标的都取不到且存在限流时抛 Throttled。
+    """
+    tickers = list(tickers)
+    level = 0 if kwargs.get('group_by') == 'ticker' else 1
+
+    def load():
+        # yf.download 的各标的结果暂存在进程全局的 yf.shared 中且每次调用都会清空，并发调用会互相串数据，只能串行
+        with _download_lock:
+            return yf.download(tickers, session=session(), **kwargs)
+    df = fetch("download", load, cost=len(tickers))
+
+    refetch = {k: kwargs[k] for k in HISTORY_ARGS if k in kwargs}
+    refetch.setdefault('actions', False) # 与 yf.download 的默认一致
+    frames, throttled = {}, []
+    for t in _empty_tickers(df, tickers, level):
+        try:
+            frames[t] = history(t, **refetch)
+        except Throttled: # 熔断打开后后续标的直接 CircuitOpen，不再发请求
+            throttled.append(t)
+        except NoData:
+            pass
+    if frames:
+        df = _splice(df, frames, level)
+    if throttled:
+        if len(throttled) == len(tickers):
+            raise Throttled(f"download: all {len(tickers)} tickers throttled")
+        print(f"⚠️ 批量下载中 {len(throttled)} 个标的被限流，本次缺失: {', '.join(throttled[:10])}")
+    return df
@@ -0,0 +1,142 @@
+import json
+import math
+import time
+import threading
+from contextlib import contextmanager
+
+# 各阶段耗时的直方图分桶 (秒)，覆盖 DB 单次往返到整次 Gemini 调用
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PREFIX = "whaleflow_"
+
+class _Series:
+    """单个标签组合的累计值：直方图分桶计数 + count/sum/max"""
+    __slots__ = ("buckets", "counts", "count", "sum", "max")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+class Registry:
+    """进程内指标表：直方图 (histogram) 与计数器 (counter)，线程安全"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {} # name -> (kind, help, buckets, {labels: series / value})
+
+    def _series(self, kind, name, help_text, buckets, labels):
+        key = tuple(sorted(labels.items()))
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = (kind, help_text, buckets, {})
+        series = metric[3]
+        if key not in series:
+            series[key] = _Series(metric[2]) if kind == "histogram" else 0
+        return metric, key
+
+    def observe(self, name, value, help_text="", buckets=DEFAULT_BUCKETS, **labels):
+        with self._lock:
+            metric, key = self._series("histogram", name, help_text, buckets, labels)
+            metric[3][key].add(value)
+
+    def inc(self, name, amount=1, help_text="", **labels):
+        with self._lock:
+            metric, key = self._series("counter", name, help_text, None, labels)
+            metric[3][key] += amount
+
+    def reset(self):
+        with self._lock:
+            self._metrics.clear()
+
+    def render_prometheus(self):
+        """Prometheus 文本格式 (0.0.4)"""
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, buckets, series) in sorted(self._metrics.items()):
+                full = PREFIX + name
+                if help_text:
+                    lines.append(f"# HELP {full} {help_text}")
+                lines.append(f"# TYPE {full} {kind}")
+                for key, value in sorted(series.items()):
+                    if kind == "counter":
+                        lines.append(f"{full}{_labels(key)} {_num(value)}")
+                        continue
+                    cumulative = 0
+                    for bound, n in zip(buckets, value.counts):
+                        cumulative += n
+                        lines.append(f"{full}_bucket{_labels(key, le=_num(bound))} {cumulative}")
+                    lines.append(f"{full}_bucket{_labels(key, le='+Inf')} {value.count}")
+                    lines.append(f"{full}_sum{_labels(key)} {_num(value.sum)}")
+                    lines.append(f"{full}_count{_labels(key)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """结构化汇总：直方图给出 count / total / mean / max，计数器给出累计值"""
+        out = {}
+        with self._lock:
+            for name, (kind, _, _, series) in sorted(self._metrics.items()):
+                for key, value in sorted(series.items()):
+                    label = ",".join(f"{k}={v}" for k, v in key)
+                    entry = out.setdefault(name, {})
+                    if kind == "counter":
+                        entry[label or "total"] = value
+                    else:
+                        entry[label or "all"] = {"count": value.count, "total_s": round(value.sum, 4),
+                                                 "mean_ms": round(value.sum / value.count * 1000, 2) if value.count else 0,
+                                                 "max_ms": round(value.max * 1000, 2)}
+        return out
+
+def _num(value):
+    if isinstance(value, float) and math.isinf(value):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _labels(key, **extra):
+    pairs = list(key) + list(extra.items())
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+REGISTRY = Registry()
+
+STAGE_HELP = "Wall time spent per pipeline stage"
+
+@contextmanager
+def timed(stage, **labels):
+    """with timed("gemini"): ... 记录一次阶段耗时 (异常也计入)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        REGISTRY.observe("stage_seconds", time.perf_counter() - start, STAGE_HELP, stage=stage, **labels)
+
+def rows_written(table, count):
+    REGISTRY.inc("rows_written_total", count, "Rows written to Postgres", table=table)
+
+def cache_event(cache, hit, amount=1):
+    REGISTRY.inc("cache_events_total", amount, "Cache lookups by outcome", cache=cache, result="hit" if hit else "miss")
+
+def count(name, amount=1, help_text="", **labels):
+    REGISTRY.inc(name, amount, help_text, **labels)
+
+def emit_summary(job, started=None, **extra):
+    """批处理任务结束时打印一行 JSON 汇总，便于日志系统检索与比较"""
+    payload = {"event": "run_summary", "job": job}
+    if started is not None:
+        payload["wall_s"] = round(time.perf_counter() - started, 3)
+    payload.update(extra)
+    payload["metrics"] = REGISTRY.summary()
+    print(json.dumps(payload, ensure_ascii=False, default=str))
+    return payload
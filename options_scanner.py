@@ -1,15 +1,45 @@
 import os
-import yfinance as yf
-import google.generativeai as genai
-import psycopg2
 import json
-import urllib.parse as urlparse
 from datetime import datetime, timedelta
 import re
+import time
+import hashlib
+import numpy as np
+import pandas as pd
+from psycopg2.extras import Json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import db
+import csp_optimizer
+import iv_engine
+import iv_rank
+import market_data
+import metrics
+import screener
+from functools import lru_cache
+from ticker_cache import TickerFieldCache
 
-# 1. 配置 Gemini 2.5 Flash
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-model = genai.GenerativeModel('gemini-2.5-flash')
+# 1. 配置 Gemini 2.5 Flash (首次调用时才导入 SDK 并构建模型)
+@lru_cache(maxsize=1)
+def get_model():
+    import google.generativeai as genai
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    return genai.GenerativeModel('gemini-2.5-flash')
+
+# 快照阶段的并发线程数 (有界，避免触发 Yahoo 限流)
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", "8"))
+# IV 期限结构使用的近端到期日数量
+IV_TERM_EXPIRIES = int(os.getenv("IV_TERM_EXPIRIES", "6"))
+IV_COLUMNS = ['ticker', 'iv_value', 'analysis_reason', 'scan_timestamp', 'current_price', 'market_cap', 'iv_term_structure', 'iv_skew', 'iv_rank', 'iv_percentile']
+CSP_COLUMNS = ['ticker', 'current_price', 'suggested_strike', 'expiration_date', 'safety_buffer', 'iv_level', 'analysis_logic', 'scan_timestamp',
+               'premium', 'premium_yield', 'annualized_return', 'delta', 'prob_otm', 'bid_ask_spread', 'open_interest']
+TRADE_COLUMNS = ['ticker', 'side', 'sentiment_score', 'narrative_type', 'suggested_strike', 'entry_stock_price', 'expiration_date', 'risk_reward_ratio', 'final_score', 'scan_timestamp']
+# Gemini 分析阶段：每个分片的标的数/字符数上限、并发分片数、单分片重试次数、响应缓存有效期 (秒)
+AI_SHARD_MAX_TICKERS = int(os.getenv("AI_SHARD_MAX_TICKERS", "10"))
+AI_SHARD_MAX_CHARS = int(os.getenv("AI_SHARD_MAX_CHARS", "8000"))
+AI_WORKERS = int(os.getenv("AI_WORKERS", "4"))
+AI_SHARD_RETRIES = int(os.getenv("AI_SHARD_RETRIES", "2"))
+AI_CACHE_TTL = int(os.getenv("AI_CACHE_TTL", str(6 * 3600)))
+CHAIN_COLUMNS = ['ticker', 'expiry', 'type', 'strike', 'bid', 'ask', 'lastPrice', 'volume', 'openInterest', 'impliedVolatility', 'underlying']
 
 def extract_json(text):
     """安全地从 AI 文本中提取 JSON"""
@@ -18,26 +48,15 @@ def extract_json(text):
         return json.loads(match.group(1)) if match else None
     except: return None
 
-def get_option_meta(ticker):
-    """抓取该股票最真实且具备流动性的期权到期日"""
-    try:
-        s = yf.Ticker(ticker)
-        expirations = s.options
-        if not expirations: return None
-        # 选取 DTE > 7 的第一个到期日，避免临期期权干扰
-        target_expiry = next((e for e in expirations if (datetime.strptime(e, '%Y-%m-%d') - datetime.now()).days > 7), expirations[0])
-        return target_expiry
-    except: return None
+def get_option_meta(expirations):
+    """从已抓取的到期日列表中选出最真实且具备流动性的期权到期日"""
+    if not expirations: return None
+    # 选取 DTE > 7 的第一个到期日，避免临期期权干扰
+    return next((e for e in expirations if (datetime.strptime(e, '%Y-%m-%d') - datetime.now()).days > 7), expirations[0])
 
-def get_accurate_iv(ticker):
+def get_accurate_iv(chain, price):
     """高精度 IV 计算逻辑：过滤掉成交量为0或买卖价差过大的合约"""
     try:
-        s = yf.Ticker(ticker)
-        price = s.fast_info['last_price']
-        target_expiry = get_option_meta(ticker)
-        if not target_expiry: return 0
-        
-        chain = s.option_chain(target_expiry).puts # 参考 Put 链 IV 进行 CSP 评估
         # 过滤：成交量 > 0 且 买卖价差 < 1.0
         valid = chain[(chain['volume'] > 0) & ((chain['ask'] - chain['bid']) < 1.0)].copy()
         if valid.empty: return 0
@@ -47,43 +66,165 @@ def get_accurate_iv(ticker):
         return float(valid.nsmallest(6, 'dist')['impliedVolatility'].mean())
     except: return 0
 
-def run_production_scanner():
-    watch_list = ["RKLB", "ASTS", "AMZN", "NBIS", "GOOGL", "RDDT", "MU", "SOFI", "POET", "AMD", 
-                  "IREN", "HOOD", "RIVN", "NVDA", "ONDS", "LUNR", "APLD", "TSLA", "PLTR", "META", 
-                  "NVO", "AVGO", "PATH", "PL", "NFLX", "OPEN", "ANIC", "TMC", "FNMA", "UBER"]
-    
-    scan_ts = datetime.now()
-    market_dict = {}
-    market_block = []
+def news_titles(news):
+    """兼容新旧两种 yfinance 新闻结构，提取前两条标题"""
+    titles = [n.get('title') or n.get('content', {}).get('title') for n in (news or [])[:2]]
+    return [x for x in titles if x] or ["No recent news"]
 
-    print(f"📡 启动全量扫描 (Time: {scan_ts})...")
+def fetch_chains(s, ticker, price, expirations, expiry):
+    """抓取近端若干到期日 (含目标到期日) 的 Call + Put 链，合并成一张长表"""
+    term_expiries = list(expirations[:IV_TERM_EXPIRIES])
+    if expiry and expiry not in term_expiries:
+        term_expiries.append(expiry)
+    frames = []
+    for e in term_expiries:
+        oc = market_data.fetch("chain", s.option_chain, e)
+        frames.append(oc.calls.assign(type='call', expiry=e))
+        frames.append(oc.puts.assign(type='put', expiry=e))
+    if not frames: return None
+    chains = pd.concat(frames, ignore_index=True).assign(ticker=ticker, underlying=price)
+    return chains[[c for c in CHAIN_COLUMNS if c in chains.columns]]
 
-    for t in watch_list:
-        try:
-            s = yf.Ticker(t)
-            price = float(s.fast_info['last_price'])
-            iv = get_accurate_iv(t)
-            
-            # 只有当 IV 有效时才继续处理该标的，防止后端存入空值
-            if iv > 0:
-                info = s.info
-                expiry = get_option_meta(t)
-                market_dict[t] = {
-                    "price": price, 
-                    "iv": iv, 
-                    "expiry": expiry,
-                    "mkt_cap": info.get('marketCap', 0)
-                }
-                news = s.news[:2]
-                news_titles = [n['title'] for n in news] if news else ["No recent news"]
-                market_block.append(f"[{t}] Price: ${price:.2f}, IV: {iv:.1%}, News: {'; '.join(news_titles)}")
-        except Exception as e:
-            print(f"跳过 {t}: {e}")
+def fetch_snapshot(ticker, fields=None):
+    """行情快照：每个标的的报价、到期日、期权链、基本面和新闻只抓取一次，供后续各阶段共享"""
+    s = market_data.ticker(ticker)
+    with metrics.timed("yf_quote"):
+        price = market_data.quote(s)
+        expirations = market_data.fetch("options", lambda: s.options)
+    expiry = get_option_meta(expirations)
+    with metrics.timed("yf_chains"):
+        chains = fetch_chains(s, ticker, price, expirations, expiry) if expiry else None
+    snap = {"price": price, "iv": 0, "expiry": expiry, "chains": None, "term_structure": {}, "skew": None, "mkt_cap": 0, "news": []}
+    if chains is None: return snap
+
+    # 整张链 (全部行权价 x 全部到期日) 一次性向量化反推 IV
+    with metrics.timed("iv_solve"):
+        solved = iv_engine.solve_chain(chains)
+        ts = iv_engine.atm_term_structure(solved).set_index('expiry')
+    snap["chains"] = solved
+    snap["term_structure"] = {e: round(float(v), 4) for e, v in ts['atm_iv'].items() if np.isfinite(v)}
+    if expiry in ts.index and np.isfinite(ts.at[expiry, 'skew']):
+        snap["skew"] = round(float(ts.at[expiry, 'skew']), 4)
+
+    # 目标到期日的 ATM IV；中间价无法反推时退回 yfinance 的 impliedVolatility 列
+    iv = snap["term_structure"].get(expiry)
+    if not iv:
+        puts = solved[(solved['expiry'] == expiry) & (solved['type'] == 'put')] # 参考 Put 链 IV 进行 CSP 评估
+        iv = get_accurate_iv(puts, price)
+    snap["iv"] = iv
+
+    # 只有当 IV 有效时才继续抓取基本面与新闻，防止后端存入空值
+    # 市值/新闻走跨扫描缓存，命中时完全不触发 s.info / s.news 请求
+    if iv > 0:
+        fields = fields or TickerFieldCache()
+        snap["mkt_cap"] = fields.get(ticker, "mkt_cap", metrics.timed("yf_info")(lambda: market_data.fetch("info", lambda: s.info.get('marketCap', 0))))
+        snap["news"] = fields.get(ticker, "news", metrics.timed("yf_news")(lambda: news_titles(market_data.fetch("news", lambda: s.news))))
+    return snap
+
+def _timed_snapshot(ticker, fields=None):
+    """在工作线程中抓取快照并记录耗时，异常交回主线程统一打印"""
+    start = time.perf_counter()
+    try:
+        return fetch_snapshot(ticker, fields), None, time.perf_counter() - start
+    except Exception as e:
+        return None, e, time.perf_counter() - start
 
-    # --- 1. AI 深度分析 (强制中文 + 风险评估) ---
-    prompt = f"""
+def iter_snapshots(watch_list, fields=None):
+    """用有界线程池并发抓取，每个标的完成即交给下游 (生成器)，总耗时约等于最慢的单个标的"""
+    with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as pool:
+        futures = {pool.submit(_timed_snapshot, t, fields): t for t in watch_list}
+        for fut in as_completed(futures):
+            t = futures[fut]
+            snap, err, elapsed = fut.result()
+            del futures[fut] # 释放已交付的快照 (含整张期权链)
+            if err is not None:
+                # 限流 (稍后可重试) 与无数据 (标的本身的问题) 分开统计，限流导致的空扫描不会被当成"没有机会"
+                reason = "throttled" if isinstance(err, market_data.Throttled) else "no_data" if isinstance(err, market_data.NoData) else "error"
+                metrics.count("snapshot_failures_total", 1, "Skipped snapshots by reason", reason=reason)
+                print(f"跳过 {t} [{reason}]: {err} ({elapsed:.2f}s)")
+                continue
+            print(f"⏱️ {t} 快照完成 ({elapsed:.2f}s)")
+            yield t, snap
+
+def market_entry(t, snap):
+    """快照 -> 后续阶段需要的精简数据 + Prompt 行情行；期权链在这里之后不再保留"""
+    data = {
+        "price": snap['price'], 
+        "iv": snap['iv'], 
+        "expiry": snap['expiry'],
+        "mkt_cap": snap['mkt_cap'],
+        "term_structure": snap['term_structure'],
+        "skew": snap['skew']
+    }
+    skew_txt = f", Skew: {snap['skew']:+.1%}" if snap['skew'] is not None else ""
+    return data, f"[{t}] Price: ${snap['price']:.2f}, IV: {snap['iv']:.1%}{skew_txt}, News: {'; '.join(snap['news'])}"
+
+def claim_scan_timestamp(conn, now):
+    """同一次 Cloud Run 执行 (含任务重试) 复用首次登记的 scan_timestamp，保证重试不会产生重复快照"""
+    execution = os.getenv("CLOUD_RUN_EXECUTION")
+    if not execution: return now
+    with conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO public.scan_runs (execution_id, scan_timestamp) VALUES (%s, %s)
+            ON CONFLICT (execution_id) DO UPDATE SET execution_id = EXCLUDED.execution_id
+            RETURNING scan_timestamp
+        """, (execution, now))
+        return cur.fetchone()[0]
+
+def build_scan_rows(market_dict, ai_res, scan_ts, csp_picks=None):
+    """在内存中组装三张表的全部行，入库前不触碰数据库；csp_picks 为 csp_optimizer.optimize 的结果"""
+    iv_rows, csp_rows, trade_rows = [], [], []
+    # AI 返回的字段可能缺失或不是对象，全部按 .get 读取并给默认值
+    analysis_map = {x.get('ticker'): x for x in ai_res.get('iv_analysis', []) if isinstance(x, dict)}
+
+    # A. IV 分析与 CSP 建议
+    for t, data in market_dict.items():
+        analysis = analysis_map.get(t) or {}
+        reason = analysis.get('reason') or "市场波动"
+        risk = analysis.get('risk_desc') or "需关注基本面"
+        iv_rows.append((t, data['iv'], reason, scan_ts, data['price'], data['mkt_cap'], Json(data['term_structure']), data['skew']))
+
+        # 期权链上优化出的行权价；没有合格 (流动) 合约时退回 12% 安全垫
+        pick = (csp_picks or {}).get(t)
+        if pick:
+            csp_rows.append((t, data['price'], pick['strike'], pick['expiry'], f"{pick['buffer']:.1%}", data['iv'], risk, scan_ts,
+                             pick['premium'], pick['premium_yield'], pick['annualized_return'], pick['delta'], pick['prob_otm'],
+                             pick['bid_ask_spread'], pick['open_interest']))
+        else:
+            strike = round(data['price'] * 0.88 * 2) / 2
+            csp_rows.append((t, data['price'], strike, data['expiry'], "12%", data['iv'], risk, scan_ts, *[None] * 7))
+
+    # B. 策略建议
+    for t in ai_res.get('trades', []):
+        ticker = t.get('ticker') if isinstance(t, dict) else None
+        if ticker in market_dict:
+            p = market_dict[ticker]['price']
+            strike = round(p * 1.02 * 2) / 2
+            exp = (scan_ts + timedelta(days=21)).strftime('%Y-%m-%d')
+            trade_rows.append((ticker, t.get('side') or "CALL", 0.9, t.get('narrative') or "", strike, p, exp, 2.5,
+                               t.get('final_score'), scan_ts))
+    return iv_rows, csp_rows, trade_rows
+
+def save_scan_results(conn, scan_ts, iv_rows, csp_rows, trade_rows):
+    """
+    在调用方的事务内整批写入一次扫描结果。
+    先清理同一 scan_timestamp 的旧数据，重试执行只会覆盖而不会重复。
+    """
+    with conn.cursor() as cur:
+        for table in ("iv_analysis", "csp_suggestions", "option_trades"):
+            cur.execute(f"DELETE FROM public.{table} WHERE scan_timestamp = %s", (scan_ts,))
+        # 每个标的相对自身 52 周历史的 IV Rank / 百分位
+        ranks = iv_rank.update_ranks(cur, scan_ts.date(), {row[0]: row[1] for row in iv_rows})
+        iv_rows = [(*row, *ranks.get(row[0], (None, None))) for row in iv_rows]
+        db.bulk_insert(cur, "public.iv_analysis", IV_COLUMNS, iv_rows)
+        db.bulk_insert(cur, "public.csp_suggestions", CSP_COLUMNS, csp_rows)
+        db.bulk_insert(cur, "public.option_trades", TRADE_COLUMNS, trade_rows)
+        db.notify(cur, "scan", scan_timestamp=scan_ts, iv=len(iv_rows), csp=len(csp_rows), trades=len(trade_rows))
+
+def build_analysis_prompt(lines):
+    return f"""
     作为期权策略专家，基于行情执行分析：
-    {chr(10).join(market_block)}
+    {chr(10).join(lines)}
     
     要求：
     1. 【看涨筛选】：基于6步协议，找出所有 Final Score > 7.5 的标的。
@@ -96,53 +237,160 @@ def run_production_scanner():
       "iv_analysis": [{{ "ticker": "...", "reason": "中文原因", "risk_desc": "中文风险评价" }}]
     }}
     """
-    ai_res = extract_json(model.generate_content(prompt).text) or {"trades": [], "iv_analysis": []}
 
-    # --- 2. 数据库写入 ---
+def shard_lines(lines):
+    """按标的数和字符数上限把行情行切成若干分片，保持原有顺序"""
+    shards, current, size = [], [], 0
+    for line in lines:
+        if current and (len(current) >= AI_SHARD_MAX_TICKERS or size + len(line) > AI_SHARD_MAX_CHARS):
+            shards.append(current)
+            current, size = [], 0
+        current.append(line)
+        size += len(line)
+    if current: shards.append(current)
+    return shards
+
+def analyze_shard(prompt):
+    """单个分片调用 Gemini，解析失败或报错时只重试这个分片；全部失败返回 None"""
+    for attempt in range(AI_SHARD_RETRIES + 1):
+        try:
+            with metrics.timed("gemini"):
+                text = get_model().generate_content(prompt).text
+            res = extract_json(text)
+            if isinstance(res, dict):
+                return {"trades": res.get("trades") or [], "iv_analysis": res.get("iv_analysis") or []}
+            print(f"⚠️ 分片返回无法解析 (第 {attempt + 1} 次)")
+        except Exception as e:
+            print(f"⚠️ 分片调用失败 (第 {attempt + 1} 次): {e}")
+        if attempt < AI_SHARD_RETRIES:
+            time.sleep(2 ** attempt)
+    return None
+
+def load_cached_responses(conn, keys):
+    with conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT prompt_hash, response FROM public.ai_response_cache
+            WHERE prompt_hash = ANY(%s) AND created_at > NOW() - %s * INTERVAL '1 second'
+        """, (list(keys), AI_CACHE_TTL))
+        return dict(cur.fetchall())
+
+def store_cached_responses(conn, responses):
+    with conn, conn.cursor() as cur:
+        db.bulk_insert(cur, "public.ai_response_cache", ['prompt_hash', 'response'],
+                       [(k, Json(v)) for k, v in responses.items()],
+                       suffix="ON CONFLICT (prompt_hash) DO UPDATE SET response = EXCLUDED.response, created_at = NOW()")
+        cur.execute("DELETE FROM public.ai_response_cache WHERE created_at < NOW() - %s * INTERVAL '1 second'", (AI_CACHE_TTL,))
+
+def run_ai_analysis(conn, lines):
+    """
+    行情行切片后并发分析，合并各分片的 trades / iv_analysis。
+    分片响应以 prompt 的 SHA-256 为键缓存在 Postgres，数据未变的重跑不会再次调用模型。
+    """
+    merged = {"trades": [], "iv_analysis": []}
+    prompts = {hashlib.sha256(p.encode()).hexdigest(): p for p in map(build_analysis_prompt, shard_lines(lines))}
+    if not prompts: return merged
+    try:
+        results = load_cached_responses(conn, prompts)
+    except Exception as e:
+        print(f"⚠️ AI 响应缓存读取失败: {e}")
+        results = {}
+
+    pending = [k for k in prompts if k not in results]
+    metrics.cache_event("ai_response", True, len(prompts) - len(pending))
+    metrics.cache_event("ai_response", False, len(pending))
+    fresh = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(AI_WORKERS, len(pending) or 1))) as pool:
+        futures = {pool.submit(analyze_shard, prompts[k]): k for k in pending}
+        for fut in as_completed(futures):
+            res = fut.result()
+            if res is not None:
+                fresh[futures[fut]] = res
+    print(f"🤖 AI 分析：{len(prompts)} 个分片，缓存命中 {len(prompts) - len(pending)}，"
+          f"调用成功 {len(fresh)}，失败 {len(pending) - len(fresh)}")
+
+    if fresh:
+        try:
+            store_cached_responses(conn, fresh)
+        except Exception as e:
+            print(f"⚠️ AI 响应缓存写入失败: {e}")
+    results.update(fresh)
+
+    # 按分片原有顺序合并
+    for k in prompts:
+        res = results.get(k)
+        if res:
+            merged["trades"].extend(res.get("trades", []))
+            merged["iv_analysis"].extend(res.get("iv_analysis", []))
+    return merged
+
+def run_production_scanner():
     try:
-        url = urlparse.urlparse(os.getenv("DATABASE_URL"))
-        conn = psycopg2.connect(database=url.path[1:], user=url.username, password=url.password, host=url.hostname, port=url.port, sslmode='require')
-        cur = conn.cursor()
-
-        # A. 写入 IV 分析与 CSP 建议
-        for t in market_dict.keys():
-            data = market_dict[t]
-            analysis = next((x for x in ai_res['iv_analysis'] if x['ticker'] == t), None)
-            
-            reason = analysis['reason'] if analysis else "市场波动"
-            risk = analysis['risk_desc'] if analysis else "需关注基本面"
-            
-            # 存入 IV 卡片表
-            cur.execute("""
-                INSERT INTO public.iv_analysis (ticker, iv_value, analysis_reason, scan_timestamp, current_price, market_cap)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (t, data['iv'], reason, scan_ts, data['price'], data['mkt_cap']))
-            
-            # 存入 CSP 建议表 (Python 计算行权价)
-            strike = round(data['price'] * 0.88 * 2) / 2 # 12% 安全垫
-            cur.execute("""
-                INSERT INTO public.csp_suggestions (ticker, current_price, suggested_strike, expiration_date, safety_buffer, iv_level, analysis_logic, scan_timestamp)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """, (t, data['price'], strike, data['expiry'], "12%", data['iv'], risk, scan_ts))
-
-        # B. 写入策略建议
-        for t in ai_res['trades']:
-            ticker = t['ticker']
-            if ticker in market_dict:
-                p = market_dict[ticker]['price']
-                strike = round(p * 1.02 * 2) / 2
-                exp = (scan_ts + timedelta(days=21)).strftime('%Y-%m-%d')
-                cur.execute("""
-                    INSERT INTO public.option_trades (ticker, side, sentiment_score, narrative_type, suggested_strike, entry_stock_price, expiration_date, risk_reward_ratio, final_score, scan_timestamp)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """, (ticker, t['side'], 0.9, t['narrative'], strike, p, exp, 2.5, t['final_score'], scan_ts))
-
-        conn.commit()
-        cur.close()
-        conn.close()
-        print("✅ 全案入库完成。")
+        # 表结构由部署时的 entrypoint.py migrate 任务维护，扫描不再执行 DDL (ALTER 会锁住各月分区)
+        conn = db.connect(sslmode='require')
+        scan_ts = claim_scan_timestamp(conn, datetime.now())
+        universe = screener.load_universe(conn)
+    except Exception as e:
+        print(f"❌ 数据库连接失败，终止扫描: {e}")
+        return
+
+    started = time.perf_counter()
+    metrics.REGISTRY.reset() # 汇总只统计本次扫描
+    market_data.reset_stats()
+    print(f"📡 启动全量扫描 (Time: {scan_ts}, 宇宙: {len(universe)} 个标的, 并发: {SCAN_WORKERS})...")
+
+    # --- 0. 第一阶段：整个宇宙按块批量下载日线初筛，只有前 N 个进入期权链阶段 ---
+    with metrics.timed("screen"):
+        watch_list = screener.screen_universe(universe)
+    try:
+        fields = TickerFieldCache()
+        fields.prefetch(conn, watch_list)
+    except Exception as e:
+        print(f"⚠️ 基本面缓存预取失败: {e}")
+        conn.rollback()
+
+    # 第二阶段：快照逐个完成逐个精简，峰值内存只有在途的几张期权链
+    entries, put_frames = {}, []
+    with metrics.timed("snapshots"):
+        for t, snap in iter_snapshots(watch_list, fields):
+            if snap['iv'] > 0:
+                entries[t] = market_entry(t, snap)
+                puts = csp_optimizer.select_puts(snap['chains']) # 只暂存 CSP 候选 Put
+                if not puts.empty: put_frames.append(puts)
+    print(f"📦 快照阶段完成：{len(entries)}/{len(watch_list)} 个有效标的，耗时 {time.perf_counter() - started:.1f}s"
+          f" (基本面/新闻缓存命中 {fields.stats['hits']}，抓取 {fields.stats['misses']})")
+    calls = market_data.stats()
+    if calls['throttled'] or calls['circuit_open']:
+        print(f"⚠️ 行情接口限流：{calls['throttled']} 次请求重试耗尽，{calls['circuit_open']} 次因熔断跳过，本次结果不完整")
+
+    # 按初筛排名顺序组装 Prompt，分片内容稳定，AI 响应缓存才能命中
+    market_dict = {t: entries[t][0] for t in watch_list if t in entries}
+    market_block = [entries[t][1] for t in watch_list if t in entries]
+
+    # 整个观察列表的候选 Put 合并后一次性打分、逐标的选出行权价
+    with metrics.timed("csp_optimize"):
+        csp_picks = csp_optimizer.optimize(pd.concat(put_frames, ignore_index=True) if put_frames else None)
+    print(f"🎯 CSP 行权价优化：{len(csp_picks)}/{len(market_dict)} 个标的选出链上合约，其余退回 12% 安全垫")
+
+    # --- 1. AI 深度分析 (强制中文 + 风险评估)：分片并发，按输入哈希缓存 ---
+    with metrics.timed("ai_analysis"):
+        ai_res = run_ai_analysis(conn, market_block)
+
+    # --- 2. 数据库写入 (单事务、每张表一条多行 INSERT) ---
+    try:
+        iv_rows, csp_rows, trade_rows = build_scan_rows(market_dict, ai_res, scan_ts, csp_picks)
+        with metrics.timed("db_write"), conn:
+            save_scan_results(conn, scan_ts, iv_rows, csp_rows, trade_rows)
+            with conn.cursor() as cur:
+                fields.flush(cur)
+        for table, rows in (("iv_analysis", iv_rows), ("csp_suggestions", csp_rows), ("option_trades", trade_rows)):
+            metrics.rows_written(table, len(rows))
+        print(f"✅ 全案入库完成 (IV {len(iv_rows)} / CSP {len(csp_rows)} / 策略 {len(trade_rows)})。")
     except Exception as e:
         print(f"❌ 数据库入库失败: {e}")
+    finally:
+        conn.close()
+    metrics.emit_summary("scanner", started, scan_timestamp=scan_ts, universe=len(universe),
+                         screened=len(watch_list), analyzed=len(market_dict))
 
 if __name__ == "__main__":
     run_production_scanner()
\ No newline at end of file
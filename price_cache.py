@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+from datetime import date, timedelta
+import db
+import market_data
+import metrics
+
+BAR_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+def frames_from_download(df, tickers):
+    """把 yf.download(group_by='ticker') 的宽表拆成 {ticker: 日线 DataFrame}"""
+    frames = {}
+    if df is None or df.empty:
+        return frames
+    for t in tickers:
+        if isinstance(df.columns, pd.MultiIndex):
+            if t not in df.columns.get_level_values(0): continue
+            sub = df[t]
+        else:
+            sub = df
+        sub = sub.rename(columns=str.lower)[BAR_COLUMNS].dropna(subset=['open', 'close'])
+        if not sub.empty:
+            sub.index = pd.to_datetime(sub.index).date
+            frames[t] = sub
+    return frames
+
+def bulk_download(tickers, start, end):
+    """一次多标的请求抓取 [start, end) 的日线"""
+    with metrics.timed("yf_download"):
+        df = market_data.download(tickers, start=start.isoformat(), end=end.isoformat(),
+                                  group_by='ticker', auto_adjust=True, progress=False, threads=True)
+    return frames_from_download(df, tickers)
+
+def _complete_until(end):
+    """窗口 [.., end) 内可以登记为"已完整覆盖"的最后一天：今天的日线尚未收盘，最多到昨天"""
+    return min(end - timedelta(days=1), date.today() - timedelta(days=1))
+
+def _covered(ranges, ticker, start, end):
+    """缓存已完整覆盖 [start, end) 中截至昨天的部分时，无需再请求 (今天的日线不等收盘)"""
+    r = ranges.get(ticker)
+    return r is not None and r[0] <= start and r[1] >= _complete_until(end)
+
+def _tail_start(r, start):
+    """已缓存区间覆盖窗口起点时只需补抓缺失的尾部，返回尾部起点；否则返回 None (整个窗口重新抓取)"""
+    if r is not None and r[0] <= start <= r[1] + timedelta(days=1):
+        return r[1] + timedelta(days=1)
+    return None
+
+def _merge_range(old, start, last):
+    """合并已完整覆盖的日期区间；不相邻时以新区间为准"""
+    if old and old[0] <= last + timedelta(days=1) and start <= old[1] + timedelta(days=1):
+        return min(old[0], start), max(old[1], last)
+    return start, last
+
+def load_daily_bars(conn, windows):
+    """
+    windows: {ticker: (start_date, end_date)}，end 不含。
+    先查 price_bars 缓存，只批量下载各标的未覆盖的部分 (通常只是上次运行之后的尾部) 并回写缓存。
+    返回 {ticker: DataFrame(index=bar_date, columns=open/high/low/close/volume)}
+    """
+    if not windows:
+        return {}
+    tickers = sorted(windows)
+    span_start = min(w[0] for w in windows.values())
+    span_end = max(w[1] for w in windows.values())
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT ticker, first_date, last_date FROM public.price_bar_ranges WHERE ticker = ANY(%s)", (tickers,))
+        ranges = {t: (first, last) for t, first, last in cur.fetchall()}
+        missing = [t for t in tickers if not _covered(ranges, t, *windows[t])]
+        metrics.cache_event("price_bars", True, len(tickers) - len(missing))
+        metrics.cache_event("price_bars", False, len(missing))
+
+        # 只缺尾部的标的按尾部起点分组 (日常运行各标的都缓存到同一天，通常只有一组)，
+        # 没有可用缓存的标的合成一组，从其中最早的窗口起点整段下载；每组一次批量请求
+        groups, cold = {}, []
+        for t in missing:
+            tail = _tail_start(ranges.get(t), windows[t][0])
+            if tail:
+                groups.setdefault(tail, []).append(t)
+            else:
+                cold.append(t)
+        if cold:
+            groups.setdefault(min(windows[t][0] for t in cold), []).extend(cold)
+        for fetch_start, group in sorted(groups.items()):
+            fetch_end = max(windows[t][1] for t in group)
+            print(f"📥 批量下载日线: {len(group)} 个标的 ({fetch_start} ~ {fetch_end})，缓存命中 {len(tickers) - len(missing)} 个")
+            try:
+                fetched = bulk_download(group, fetch_start, fetch_end)
+            except market_data.Throttled as e:
+                # 被限流时只用已缓存的日线，未覆盖区间不登记，下次运行自动补抓
+                print(f"⚠️ 日线下载被限流，本次只使用缓存: {e}")
+                continue
+            rows = [(t, d, *(float(v) if pd.notna(v) else None for v in bar))
+                    for t, frame in fetched.items() for d, bar in zip(frame.index, frame[BAR_COLUMNS].itertuples(index=False))]
+            written = db.bulk_insert(cur, "public.price_bars", ['ticker', 'bar_date'] + BAR_COLUMNS, rows,
+                           suffix="ON CONFLICT (ticker, bar_date) DO UPDATE SET open = EXCLUDED.open, high = EXCLUDED.high, "
+                                  "low = EXCLUDED.low, close = EXCLUDED.close, volume = EXCLUDED.volume")
+            metrics.rows_written("price_bars", written)
+            complete_until = _complete_until(fetch_end)
+            if complete_until < fetch_start:
+                continue
+            # 补抓区间内没有工作日 (周末) 时下载结果本来就是空的，同样登记为已覆盖
+            no_sessions = np.busday_count(fetch_start, complete_until + timedelta(days=1)) == 0
+            range_rows = [(t, *_merge_range(ranges.get(t), fetch_start, complete_until)) for t in group if t in fetched or no_sessions]
+            db.bulk_insert(cur, "public.price_bar_ranges", ['ticker', 'first_date', 'last_date'], range_rows,
+                           suffix="ON CONFLICT (ticker) DO UPDATE SET first_date = EXCLUDED.first_date, "
+                                  "last_date = EXCLUDED.last_date, fetched_at = NOW()")
+
+        cur.execute("""
+            SELECT ticker, bar_date, open, high, low, close, volume FROM public.price_bars
+            WHERE ticker = ANY(%s) AND bar_date >= %s AND bar_date < %s
+            ORDER BY ticker, bar_date
+        """, (tickers, span_start, span_end))
+        bars = pd.DataFrame(cur.fetchall(), columns=['ticker', 'bar_date'] + BAR_COLUMNS)
+    conn.commit()
+    return {t: frame.set_index('bar_date')[BAR_COLUMNS] for t, frame in bars.groupby('ticker')}
@@ -0,0 +1,191 @@
+"""
+按月分区 + 保留期 + Parquet 归档：
+
+    python retention.py migrate   # 一次性：把四张只追加的大表改为按月分区表 (原表整体挂为默认分区，只搬当月的行)
+    python retention.py           # 定期：预建未来分区，过期分区导出 Parquet 后 DETACH + DROP (要求 ARCHIVE_URI=gs://...)
+
+迁移后的结构：<表> 是分区父表；<表>_legacy 是迁移前的原表，作为 DEFAULT 分区接收不落在任何月分区内的行；
+<表>_pYYYY_MM 是每个自然月的分区。旧数据随保留期从默认分区逐月导出删除，月分区整体导出后直接丢弃。
+"""
+import os
+import sys
+import time
+from datetime import date
+import db
+import archive
+import metrics
+
+# 表 -> 分区键 (看板与历史查询都按这些列过滤)
+PARTITIONED_TABLES = {
+    "stock_trends": "created_at",
+    "iv_analysis": "scan_timestamp",
+    "csp_suggestions": "scan_timestamp",
+    "option_trades": "scan_timestamp",
+}
+# 在线保留的月数 (含当月)，更早的数据只在归档中
+RETENTION_MONTHS = int(os.getenv("RETENTION_MONTHS", "6"))
+# 提前建好的未来月分区数，避免新数据落进默认分区
+PARTITION_PREMAKE_MONTHS = int(os.getenv("PARTITION_PREMAKE_MONTHS", "3"))
+
+def add_months(day, months):
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(table, month_start):
+    return f"{table}_p{month_start:%Y_%m}"
+
+def is_partitioned(cur, table):
+    cur.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", (f"public.{table}",))
+    return cur.fetchone() is not None
+
+def migrate_table(conn, table, key):
+    """
+    原表改名为 <表>_legacy 并整体挂为新父表的 DEFAULT 分区：只改元数据；只有当月已有的行会搬进当月分区。
+    原表的索引一并改名，父表上的同名分区索引随后由 db.ensure_schema 创建 (匹配的旧索引会被直接挂上)。
+    """
+    legacy = f"{table}_legacy"
+    with conn, conn.cursor() as cur:
+        if is_partitioned(cur, table):
+            print(f"  {table} 已是分区表，跳过")
+            return False
+        cur.execute(f"LOCK TABLE public.{table} IN ACCESS EXCLUSIVE MODE")
+        cur.execute("SELECT pg_get_serial_sequence(%s, 'id')", (f"public.{table}",))
+        sequence = cur.fetchone()[0]
+        cur.execute(f"ALTER TABLE public.{table} RENAME TO {legacy}")
+        cur.execute("SELECT indexname FROM pg_indexes WHERE schemaname = 'public' AND tablename = %s", (legacy,))
+        for (index,) in cur.fetchall():
+            renamed = legacy + index[len(table):] if index.startswith(table) else f"{index}_legacy"
+            cur.execute(f"ALTER INDEX public.{index} RENAME TO {renamed}")
+        cur.execute(f"CREATE TABLE public.{table} (LIKE public.{legacy} INCLUDING DEFAULTS) PARTITION BY RANGE ({key})")
+        if sequence:
+            cur.execute(f"ALTER SEQUENCE {sequence} OWNED BY public.{table}.id")
+        cur.execute(f"ALTER TABLE public.{table} ATTACH PARTITION public.{legacy} DEFAULT")
+        create_partitions(cur, table, date.today().replace(day=1), PARTITION_PREMAKE_MONTHS)
+    return True
+
+def create_partitions(cur, table, first_month, count):
+    """
+    建好 [first_month, first_month + count] 的月分区。默认分区里已有某月的行时 (迁移当月)，
+    把这些行搬进新建的月分区，保证该月之后的新行和保留期清理都按月分区进行。
+    """
+    key = PARTITIONED_TABLES[table]
+    created = 0
+    for i in range(count + 1):
+        start = add_months(first_month, i)
+        end = add_months(start, 1)
+        name = partition_name(table, start)
+        cur.execute("SELECT to_regclass(%s)", (f"public.{name}",))
+        if cur.fetchone()[0]:
+            continue
+        cur.execute(f"SELECT EXISTS (SELECT 1 FROM public.{table}_legacy WHERE {key} >= %s AND {key} < %s)", (start, end))
+        if cur.fetchone()[0]:
+            moved = move_from_default(cur, table, name, start, end)
+            print(f"  ↪️ {name}: 从默认分区迁入 {moved} 行")
+        else:
+            cur.execute(f"CREATE TABLE public.{name} PARTITION OF public.{table} FOR VALUES FROM (%s) TO (%s)", (start, end))
+        created += 1
+    return created
+
+def move_from_default(cur, table, name, start, end):
+    """
+    默认分区里已有该月的行时无法直接建分区：先建独立表，把这些行从默认分区搬过去，再挂为月分区。
+    在调用方事务内完成 (ATTACH 会校验默认分区里不再有该月的行)，之后该月的新行不再落进默认分区。
+    """
+    key = PARTITIONED_TABLES[table]
+    columns = ", ".join(column for column, _ in archive.table_columns(cur, table))
+    cur.execute(f"CREATE TABLE public.{name} (LIKE public.{table} INCLUDING DEFAULTS)")
+    cur.execute(f"""
+        WITH moved AS (
+            DELETE FROM public.{table}_legacy WHERE {key} >= %s AND {key} < %s RETURNING {columns}
+        )
+        INSERT INTO public.{name} ({columns}) SELECT {columns} FROM moved
+    """, (start, end))
+    moved = cur.rowcount
+    cur.execute(f"ALTER TABLE public.{table} ATTACH PARTITION public.{name} FOR VALUES FROM (%s) TO (%s)", (start, end))
+    return moved
+
+def month_partitions(cur, table):
+    """[(分区名, 月初)]，按月份升序"""
+    cur.execute("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s) AND c.relname ~ '_p[0-9]{4}_[0-9]{2}$'
+        ORDER BY c.relname
+    """, (f"public.{table}",))
+    return [(name, date(int(name[-7:-3]), int(name[-2:]), 1)) for (name,) in cur.fetchall()]
+
+def archive_table(conn, table, cutoff):
+    """cutoff (月初) 之前的数据：月分区整体导出后 DETACH + DROP；默认分区里的旧行逐月导出后 DELETE"""
+    key = PARTITIONED_TABLES[table]
+    legacy = f"{table}_legacy"
+    archived = 0
+    with conn.cursor() as cur:
+        partitions = [(name, start) for name, start in month_partitions(cur, table) if add_months(start, 1) <= cutoff]
+        cur.execute(f"SELECT MIN({key}) FROM public.{legacy} WHERE {key} < %s", (cutoff,))
+        oldest = cur.fetchone()[0]
+    conn.commit()
+
+    for name, start in partitions:
+        with conn:
+            rows = archive.export(conn, table, name, f"{start:%Y-%m}")
+            with conn.cursor() as cur:
+                cur.execute(f"ALTER TABLE public.{table} DETACH PARTITION public.{name}")
+                cur.execute(f"DROP TABLE public.{name}")
+        archived += rows
+        print(f"  📦 {name}: 归档 {rows} 行并删除分区")
+
+    month = oldest.date().replace(day=1) if oldest is not None else cutoff
+    while month < cutoff:
+        end = add_months(month, 1)
+        # 导出与删除在同一事务：提交失败时行仍在库中，重跑覆盖同一文件
+        with conn:
+            rows = archive.export(conn, table, legacy, f"{month:%Y-%m}", f"{key} >= %s AND {key} < %s", (month, end))
+            with conn.cursor() as cur:
+                cur.execute(f"DELETE FROM public.{legacy} WHERE {key} >= %s AND {key} < %s", (month, end))
+        if rows:
+            archived += rows
+            print(f"  📦 {legacy} {month:%Y-%m}: 归档 {rows} 行")
+        month = end
+    metrics.count("archived_rows_total", archived, "Rows moved to the Parquet archive", table=table)
+    return archived
+
+def migrate():
+    conn = db.connect(sslmode='require')
+    try:
+        db.ensure_schema(conn)
+        for table, key in PARTITIONED_TABLES.items():
+            if migrate_table(conn, table, key):
+                print(f"✅ {table} 已改为按 {key} 月分区")
+        # 在分区父表上 (重新) 创建 SCHEMA_DDL 中的索引
+        db.ensure_schema(conn)
+        # 分区表的主键必须包含分区键，id 上只能建普通索引 (每个分区各一份)，供按 id 更新的语句使用
+        with conn, conn.cursor() as cur:
+            for table in PARTITIONED_TABLES:
+                cur.execute(f"CREATE INDEX IF NOT EXISTS {table}_id_idx ON public.{table} (id)")
+    finally:
+        conn.close()
+
+def run_retention():
+    # 归档写到容器内目录时，DROP 分区后数据随实例消失：只有显式配置的 gs:// 归档才允许删除在线数据
+    if not archive.is_durable():
+        raise SystemExit(f"❌ ARCHIVE_URI 未配置为 gs:// 持久存储 (当前: {archive.ARCHIVE_URI_SETTING or '未设置'})，拒绝归档删除")
+    started = time.perf_counter()
+    metrics.REGISTRY.reset()
+    conn = db.connect(sslmode='require')
+    cutoff = add_months(date.today().replace(day=1), -(RETENTION_MONTHS - 1))
+    print(f"🗄️ 分区维护：保留 {cutoff} 之后的数据，归档到 {archive.ARCHIVE_URI}")
+    totals = {}
+    try:
+        for table in PARTITIONED_TABLES:
+            with conn, conn.cursor() as cur:
+                if not is_partitioned(cur, table):
+                    print(f"⚠️ {table} 尚未分区，先运行 python retention.py migrate")
+                    continue
+                created = create_partitions(cur, table, date.today().replace(day=1), PARTITION_PREMAKE_MONTHS)
+            totals[table] = archive_table(conn, table, cutoff)
+            print(f"✅ {table}: 新建分区 {created} 个，归档 {totals[table]} 行")
+    finally:
+        conn.close()
+    metrics.emit_summary("retention", started, cutoff=cutoff, archived=totals)
+
+if __name__ == "__main__":
+    migrate() if sys.argv[1:] == ["migrate"] else run_retention()
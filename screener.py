@@ -0,0 +1,93 @@
+import os
+import heapq
+import numpy as np
+import market_data
+import metrics
+import price_cache
+
+# 扫描宇宙来源：逗号分隔的文件列表 (相对本文件目录或绝对路径) + scan_universe 表
+UNIVERSE_FILES = [p for p in os.getenv("SCAN_UNIVERSE_FILES", "universe/watchlist.txt").split(",") if p.strip()]
+# 第一阶段：每次批量下载的标的数、回看交易日数
+SCREEN_CHUNK_SIZE = int(os.getenv("SCREEN_CHUNK_SIZE", "200"))
+SCREEN_LOOKBACK = os.getenv("SCREEN_LOOKBACK", "1mo")
+# 进入期权链阶段的标的数及筛选条件
+SCREEN_TOP_N = int(os.getenv("SCREEN_TOP_N", "30"))
+SCREEN_MIN_PRICE = float(os.getenv("SCREEN_MIN_PRICE", "0"))
+SCREEN_MIN_DOLLAR_VOLUME = float(os.getenv("SCREEN_MIN_DOLLAR_VOLUME", "0"))
+SCREEN_RANK_BY = os.getenv("SCREEN_RANK_BY", "dollar_volume")
+RANK_METRICS = ('dollar_volume', 'volume_surge', 'abs_return_5d', 'realized_vol')
+
+def read_universe_file(path):
+    if not os.path.isabs(path):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+    with open(path, encoding='utf-8') as f:
+        return [line.split('#')[0].strip().upper() for line in f if line.split('#')[0].strip()]
+
+def load_universe(conn=None, paths=UNIVERSE_FILES):
+    """合并文件与 scan_universe 表 (active = TRUE) 中的标的，去重并保持首次出现的顺序"""
+    tickers = []
+    for path in paths:
+        try:
+            tickers += read_universe_file(path.strip())
+        except OSError as e:
+            print(f"⚠️ 标的列表读取失败: {e}")
+    if conn is not None:
+        with conn, conn.cursor() as cur:
+            cur.execute("SELECT ticker FROM public.scan_universe WHERE active ORDER BY ticker")
+            tickers += [t.upper() for (t,) in cur.fetchall()]
+    return list(dict.fromkeys(tickers))
+
+def screen_metrics(frame):
+    """单个标的日线 -> 初筛指标；数据不足返回 None"""
+    close = frame['close'].to_numpy(dtype=float)
+    volume = frame['volume'].to_numpy(dtype=float)
+    if len(close) < 6 or not np.isfinite(close[-1]):
+        return None
+    avg_volume = np.nanmean(volume[:-1]) if len(volume) > 1 else np.nan
+    log_ret = np.diff(np.log(close))
+    return {
+        "price": float(close[-1]),
+        "dollar_volume": float(np.nanmean(close * volume)),
+        "volume_surge": float(volume[-1] / avg_volume) if avg_volume > 0 else 0.0,
+        "abs_return_5d": float(abs(close[-1] / close[-6] - 1)),
+        "realized_vol": float(np.nanstd(log_ret) * np.sqrt(252)),
+    }
+
+def passes_filters(m, min_price=SCREEN_MIN_PRICE, min_dollar_volume=SCREEN_MIN_DOLLAR_VOLUME):
+    return m["price"] >= min_price and m["dollar_volume"] >= min_dollar_volume
+
+def screen_universe(universe, top_n=SCREEN_TOP_N, rank_by=SCREEN_RANK_BY, chunk_size=SCREEN_CHUNK_SIZE):
+    """
+    第一阶段廉价初筛：按块批量下载日线 (每块一次多标的请求)，算完指标即丢弃原始数据，
+    只用大小为 top_n 的小顶堆保留候选，内存不随宇宙规模增长。返回按得分降序的标的列表。
+    """
+    if rank_by not in RANK_METRICS:
+        raise ValueError(f"SCREEN_RANK_BY must be one of {RANK_METRICS}")
+    heap, screened = [], 0
+    for i in range(0, len(universe), chunk_size):
+        chunk = universe[i:i + chunk_size]
+        try:
+            with metrics.timed("yf_download"):
+                df = market_data.download(chunk, period=SCREEN_LOOKBACK, interval='1d', group_by='ticker',
+                                          auto_adjust=True, progress=False, threads=True)
+            frames = price_cache.frames_from_download(df, chunk)
+        except market_data.Throttled as e:
+            print(f"⚠️ 初筛下载被限流，跳过 {len(chunk)} 个标的: {e}")
+            continue
+        except Exception as e:
+            print(f"⚠️ 初筛批量下载失败 ({len(chunk)} 个标的): {e}")
+            continue
+        for t, frame in frames.items():
+            m = screen_metrics(frame)
+            if m is None or not passes_filters(m): continue
+            screened += 1
+            item = (m[rank_by], t)
+            if len(heap) < top_n:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+    print(f"🔎 初筛完成：宇宙 {len(universe)} 个，通过过滤 {screened} 个，按 {rank_by} 取前 {len(heap)} 个")
+    if not heap:
+        # 行情源整体不可用时退回宇宙前 top_n 个，扫描不至于空跑
+        return universe[:top_n]
+    return [t for _, t in sorted(heap, reverse=True)]
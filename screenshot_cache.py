@@ -0,0 +1,151 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from psycopg2.extras import Json
+import db
+
+SCREENSHOT_CACHE_TTL = int(os.getenv("SCREENSHOT_CACHE_TTL", "86400"))
+SCREENSHOT_CACHE_SIZE = int(os.getenv("SCREENSHOT_CACHE_SIZE", "2048"))
+# 感知哈希 (4096 bit) 允许的最大汉明距离；默认 0 = 只认 SHA-256 精确重复。
+# 同一版式、不同标的/情绪的截图之间只差 5~6 bit，近似命中会把别的帖子的结果当成本帖，只应在明确接受误判时开启
+SCREENSHOT_PHASH_DISTANCE = int(os.getenv("SCREENSHOT_PHASH_DISTANCE", "0"))
+SCREENSHOT_CACHE_PERSIST = os.getenv("SCREENSHOT_CACHE_PERSIST", "0") == "1"
+PHASH_SIZE = 64
+PHASH_BITS = PHASH_SIZE * PHASH_SIZE
+# 近似命中还要求宽高比一致，避免不同版式的截图互相误判
+ASPECT_TOLERANCE = 0.02
+
+def exact_hash(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+def perceptual_hash(img):
+    """dHash：缩成 65x64 灰度图，比较相邻像素明暗，得到 4096 bit 整数；重新压缩/轻微缩放后基本不变"""
+    import numpy as np
+    from PIL import Image
+    small = np.asarray(img.convert('L').resize((PHASH_SIZE + 1, PHASH_SIZE), Image.LANCZOS), dtype=np.int16)
+    bits = np.packbits(small[:, :-1] > small[:, 1:])
+    return int.from_bytes(bits.tobytes(), 'big')
+
+def fingerprint(sha, img):
+    """截图指纹：(原始字节的精确哈希, 感知哈希, 宽高比)"""
+    return sha, perceptual_hash(img), round(img.width / max(img.height, 1), 4)
+
+class ScreenshotCache:
+    """内容寻址的截图分析结果缓存：TTL + 容量上限的 LRU，可选持久化到 Postgres"""
+
+    def __init__(self, ttl=SCREENSHOT_CACHE_TTL, max_entries=SCREENSHOT_CACHE_SIZE,
+                 max_distance=SCREENSHOT_PHASH_DISTANCE, persist=SCREENSHOT_CACHE_PERSIST):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.persist = persist
+        self._entries = OrderedDict() # sha256 -> (phash, aspect, result, stored_at)
+        self._lock = threading.Lock()
+        self.stats = {"exact_hits": 0, "near_hits": 0, "db_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _lookup_memory(self, sha, phash, aspect):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(sha)
+            if entry and now - entry[3] < self.ttl:
+                self._entries.move_to_end(sha)
+                self.stats["exact_hits"] += 1
+                return entry[2]
+            if self.max_distance <= 0:
+                return None
+            best, best_dist = None, self.max_distance + 1
+            for key, (other, other_aspect, result, stored_at) in self._entries.items():
+                if now - stored_at >= self.ttl or abs(other_aspect - aspect) > ASPECT_TOLERANCE:
+                    continue
+                dist = (other ^ phash).bit_count()
+                if dist < best_dist:
+                    best, best_dist = key, dist
+            if best is None:
+                return None
+            self._entries.move_to_end(best)
+            self.stats["near_hits"] += 1
+            return self._entries[best][2]
+
+    def _lookup_db(self, pool, sha, phash, aspect):
+        with db.pooled_connection(pool) as conn, conn.cursor() as cur:
+            if self.max_distance <= 0:
+                cur.execute("""
+                    SELECT result FROM public.screenshot_cache
+                    WHERE sha256 = %s AND created_at > NOW() - %s * INTERVAL '1 second'
+                """, (sha, self.ttl))
+                row = cur.fetchone()
+                return row[0] if row else None
+            cur.execute("""
+                SELECT result, length(replace((phash # %s::bit(4096))::text, '0', '')) AS dist
+                FROM public.screenshot_cache
+                WHERE created_at > NOW() - %s * INTERVAL '1 second'
+                  AND (sha256 = %s OR abs(aspect - %s) <= %s)
+                ORDER BY (sha256 = %s) DESC, dist
+                LIMIT 1
+            """, (format(phash, f'0{PHASH_BITS}b'), self.ttl, sha, aspect, ASPECT_TOLERANCE, sha))
+            row = cur.fetchone()
+        if row and row[1] <= self.max_distance:
+            return row[0]
+        return None
+
+    def _remember(self, sha, phash, aspect, result):
+        with self._lock:
+            self._entries[sha] = (phash, aspect, result, time.time())
+            self._entries.move_to_end(sha)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def lookup(self, sha, phash, aspect, pool=None):
+        """先查进程内 LRU，再查 Postgres；命中返回缓存的分析结果，未命中返回 None"""
+        result = self._lookup_memory(sha, phash, aspect)
+        if result is not None:
+            return result
+        if self.persist and pool is not None:
+            try:
+                result = self._lookup_db(pool, sha, phash, aspect)
+            except Exception as e:
+                print(f"⚠️ 截图缓存查询失败: {e}")
+            if result is not None:
+                self._count("db_hits")
+                self._remember(sha, phash, aspect, result)
+                return result
+        self._count("misses")
+        return None
+
+    def store(self, sha, phash, aspect, result, pool=None):
+        self.store_many([((sha, phash, aspect), result)], pool=pool)
+
+    def store_many(self, entries, pool=None):
+        """批量写入 [((sha, phash, aspect), result), ...]，持久化时整批一条多行 INSERT"""
+        rows = {}
+        for (sha, phash, aspect), result in entries:
+            self._remember(sha, phash, aspect, result)
+            self._count("stores")
+            rows[sha] = (sha, format(phash, f'0{PHASH_BITS}b'), aspect, Json(result))
+        if not (self.persist and pool is not None and rows):
+            return
+        try:
+            with db.pooled_connection(pool) as conn, conn.cursor() as cur:
+                db.bulk_insert(cur, "public.screenshot_cache", ['sha256', 'phash', 'aspect', 'result'], list(rows.values()),
+                               template="(%s, %s::bit(4096), %s, %s)",
+                               suffix="ON CONFLICT (sha256) DO UPDATE SET result = EXCLUDED.result, created_at = NOW()")
+                # 顺手清理过期行，表大小随 TTL 封顶
+                cur.execute("DELETE FROM public.screenshot_cache WHERE created_at < NOW() - %s * INTERVAL '1 second'", (self.ttl,))
+        except Exception as e:
+            print(f"⚠️ 截图缓存写入失败: {e}")
+
+    def snapshot(self):
+        """命中统计：每次命中都省掉一次 Gemini 调用和对应的重复入库"""
+        with self._lock:
+            stats = dict(self.stats, entries=len(self._entries))
+        hits = stats["exact_hits"] + stats["near_hits"] + stats["db_hits"]
+        total = hits + stats["misses"]
+        stats["hit_rate"] = round(hits / total, 4) if total else 0.0
+        return stats
@@ -0,0 +1,65 @@
+import os
+import threading
+from psycopg2.extras import Json
+import db
+import metrics
+
+# 每个字段单独的有效期 (秒)：市值一天内几乎不变，新闻标题几小时刷新一次即可
+FIELD_TTLS = {
+    "mkt_cap": int(os.getenv("MKT_CAP_CACHE_TTL", str(24 * 3600))),
+    "news": int(os.getenv("NEWS_CACHE_TTL", str(3 * 3600))),
+}
+
+class TickerFieldCache:
+    """
+    跨扫描的标的字段缓存 (Postgres ticker_field_cache 表)。
+    扫描开始时一次查询预取所有未过期字段；扫描中按需读取，未命中才调用 loader；
+    新抓取的值在扫描结束时一条多行 UPSERT 写回。
+    """
+
+    def __init__(self, ttls=FIELD_TTLS):
+        self.ttls = dict(ttls)
+        self._values = {} # (ticker, field) -> value
+        self._dirty = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def prefetch(self, conn, tickers):
+        """一次查询取回这批标的所有仍在有效期内的字段"""
+        if not tickers: return
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT c.ticker, c.field, c.value
+                FROM public.ticker_field_cache c
+                JOIN (SELECT unnest(%s::text[]) AS field, unnest(%s::int[]) AS ttl) t ON t.field = c.field
+                WHERE c.ticker = ANY(%s) AND c.fetched_at > NOW() - t.ttl * INTERVAL '1 second'
+            """, (list(self.ttls), list(self.ttls.values()), list(tickers)))
+            rows = cur.fetchall()
+        conn.commit()
+        with self._lock:
+            for ticker, field, value in rows:
+                self._values[(ticker, field)] = value
+
+    def get(self, ticker, field, loader):
+        """命中直接返回；未命中调用 loader() 抓取并记为待写回。loader 在锁外执行，不阻塞其他线程"""
+        key = (ticker, field)
+        with self._lock:
+            hit = key in self._values
+            self.stats["hits" if hit else "misses"] += 1
+            value = self._values.get(key)
+        metrics.cache_event("ticker_fields", hit)
+        if hit:
+            return value
+        value = loader()
+        with self._lock:
+            self._values[key] = value
+            self._dirty[key] = value
+        return value
+
+    def flush(self, cur):
+        """在调用方的事务内写回本次新抓取的字段，返回写入行数"""
+        with self._lock:
+            rows = [(ticker, field, Json(value)) for (ticker, field), value in self._dirty.items()]
+            self._dirty.clear()
+        return db.bulk_insert(cur, "public.ticker_field_cache", ['ticker', 'field', 'value'], rows,
+                              suffix="ON CONFLICT (ticker, field) DO UPDATE SET value = EXCLUDED.value, fetched_at = NOW()")
@@ -1,48 +1,161 @@
 import os
+import numpy as np
+import pandas as pd
 import psycopg2
-import yfinance as yf
+from datetime import timedelta
 from dotenv import load_dotenv
+import db
+import market_data
+import price_cache
 
 load_dotenv()
 
+# 验证周期：帖子发布后各时间点的价格与预测是否正确
+HORIZONS = {"1h": timedelta(hours=1), "4h": timedelta(hours=4), "1d": timedelta(days=1), "5d": timedelta(days=5)}
+# 行情延迟：到期时间点之后再等这么久才取价，避免拿到尚未更新的旧 K 线
+DATA_DELAY = timedelta(minutes=int(os.getenv("VERIFY_DATA_DELAY_MINUTES", "15")))
+# 超过最长周期再加宽限期仍取不到价格的帖子不再重试；5 分钟 K 线最多回溯 60 天
+GRACE = timedelta(days=int(os.getenv("VERIFY_GRACE_DAYS", "2")))
+INTRADAY_INTERVAL = os.getenv("VERIFY_INTERVAL", "5m")
+# 这些周期在分钟线取不到 (限流、超出回溯范围) 时退回日线缓存中最近一次收盘价
+DAILY_FALLBACK = [h for h, d in HORIZONS.items() if d >= timedelta(days=1)]
+MARKET_TZ = "America/New_York"
+
+# price_tracking 的多周期列 (幂等)，只在验证任务里执行，避免其他服务依赖 posts 表
+TRACKING_DDL = [
+    "CREATE TABLE IF NOT EXISTS price_tracking (post_id TEXT PRIMARY KEY)",
+    "ALTER TABLE price_tracking " + ", ".join(
+        f"ADD COLUMN IF NOT EXISTS price_{h} NUMERIC, ADD COLUMN IF NOT EXISTS is_correct_{h} BOOLEAN" for h in HORIZONS),
+    "ALTER TABLE price_tracking ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ DEFAULT NOW()",
+    "CREATE INDEX IF NOT EXISTS posts_created_at_idx ON posts (created_at)",
+]
+
+def due_query():
+    """只选出至少有一个周期刚到期、且该周期尚未记录价格的帖子；扫描范围由 created_at 下界封顶"""
+    due = [f"(t.price_{h} IS NULL AND p.created_at <= NOW() - INTERVAL '{int(d.total_seconds())} seconds' - %(delay)s)"
+           for h, d in HORIZONS.items()]
+    return f"""
+        SELECT p.post_id, p.ticker, p.initial_price, p.sentiment, p.created_at,
+               {', '.join(f'{c} AS due_{h}' for c, h in zip(due, HORIZONS))}
+        FROM posts p
+        LEFT JOIN price_tracking t ON t.post_id = p.post_id
+        WHERE p.created_at > NOW() - %(window)s
+          AND ({' OR '.join(due)})
+    """
+
+def is_correct(sentiment, initial_price, price):
+    sentiment = (sentiment or '').upper()
+    if sentiment == 'BULLISH':
+        return bool(price >= initial_price)
+    if sentiment == 'BEARISH':
+        return bool(price <= initial_price)
+    return False
+
+def to_utc(ts):
+    ts = pd.Timestamp(ts)
+    return ts.tz_localize('UTC') if ts.tzinfo is None else ts.tz_convert('UTC')
+
+def fetch_intraday(ticker, start, end):
+    """单个标的一次请求取回覆盖所有待验证时间点的分钟 K 线，返回 (UTC 时间数组, 收盘价数组)"""
+    try:
+        hist = market_data.history(ticker, start=start.strftime('%Y-%m-%d'), end=(end + timedelta(days=1)).strftime('%Y-%m-%d'),
+                                   interval=INTRADAY_INTERVAL)
+    except market_data.NoData:
+        return np.array([], dtype='datetime64[ns]'), np.array([])
+    index = pd.DatetimeIndex(hist.index)
+    index = index.tz_localize('UTC') if index.tz is None else index.tz_convert('UTC')
+    return index.tz_localize(None).values, hist['Close'].to_numpy(dtype=float)
+
+def daily_closes(bars):
+    """日线缓存 -> (各交易日 16:00 美东收盘时刻的 UTC 时间数组, 收盘价数组)，与 fetch_intraday 的输出同构"""
+    if bars is None or bars.empty:
+        return np.array([], dtype='datetime64[ns]'), np.array([])
+    close_at = (pd.DatetimeIndex(pd.to_datetime(list(bars.index))) + pd.Timedelta(hours=16)).tz_localize(MARKET_TZ).tz_convert('UTC')
+    return close_at.tz_localize(None).values, bars['close'].to_numpy(dtype=float)
+
+def load_daily(conn, posts):
+    """所有标的的日线一次走 price_cache (与 analyst_job 共用缓存)，失败时只用分钟线"""
+    spans = posts.groupby('ticker')['created_at'].agg(['min', 'max'])
+    today = pd.Timestamp.now(tz='UTC').date()
+    windows = {t: (row['min'].date() - timedelta(days=1), min((row['max'] + max(HORIZONS.values())).date() + timedelta(days=1), today + timedelta(days=1)))
+               for t, row in spans.iterrows()}
+    try:
+        return price_cache.load_daily_bars(conn, windows)
+    except Exception as e:
+        conn.rollback()
+        print(f"⚠️ 日线缓存读取失败，只使用分钟线: {e}")
+        return {}
+
+def prices_at(times, closes, targets):
+    """每个目标时间点之前最后一根 K 线的收盘价 (向量化 as-of 查找)，没有数据为 NaN"""
+    if len(times) == 0:
+        return np.full(len(targets), np.nan)
+    idx = np.searchsorted(times, targets, side='right') - 1
+    return np.where(idx >= 0, closes[np.clip(idx, 0, None)], np.nan)
+
 def verify_results():
     conn = psycopg2.connect(os.getenv("DATABASE_URL"))
     cur = conn.cursor()
+    for ddl in TRACKING_DDL:
+        cur.execute(ddl)
+    conn.commit()
 
-    # 抓取所有还没验证的记录
-    cur.execute("SELECT post_id, ticker, initial_price, sentiment FROM posts")
+    cur.execute(due_query(), {"delay": DATA_DELAY, "window": max(HORIZONS.values()) + GRACE})
     rows = cur.fetchall()
 
     if not rows:
-        print("数据库里还没有数据，请先成功运行 mock_test.py")
+        print("没有到期待验证的帖子")
+        cur.close()
+        conn.close()
         return
 
-    for post_id, ticker, initial_price, sentiment in rows:
-        print(f"正在验证 {ticker}...")
-        
-        # 获取最新的瞬间价格
-        stock = yf.Ticker(ticker)
-        current_price = float(stock.history(period="1d")['Close'].iloc[-1])
-        
-        # 核心逻辑：看涨且价格涨了 = 正确
-        is_correct = False
-        if sentiment == 'BULLISH' and current_price >= initial_price:
-            is_correct = True
-        elif sentiment == 'BEARISH' and current_price <= initial_price:
-            is_correct = True
-            
-        # 写入追踪表
-        cur.execute("""
-            INSERT INTO price_tracking (post_id, price_1h, is_correct_1h)
-            VALUES (%s, %s, %s)
-            ON CONFLICT (post_id) DO UPDATE SET is_correct_1h = EXCLUDED.is_correct_1h
-        """, (post_id, current_price, is_correct))
-        
-        print(f"结果: 初始 ${initial_price} -> 现在 ${current_price} | AI预测: {sentiment} | 是否准确: {is_correct}")
+    posts = pd.DataFrame(rows, columns=['post_id', 'ticker', 'initial_price', 'sentiment', 'created_at'] + [f'due_{h}' for h in HORIZONS])
+    posts['created_at'] = posts['created_at'].map(to_utc)
+    print(f"待验证帖子: {len(posts)} 条，涉及 {posts['ticker'].nunique()} 个标的")
+    daily = load_daily(conn, posts)
 
+    updates, throttled = [], 0
+    for ticker, group in posts.groupby('ticker'):
+        # 只覆盖本组实际到期的时间点
+        targets = {h: (group['created_at'] + d).dt.tz_localize(None).values.astype('datetime64[ns]') for h, d in HORIZONS.items()}
+        due_targets = np.concatenate([targets[h][group[f'due_{h}'].to_numpy()] for h in HORIZONS])
+        times, closes = np.array([], dtype='datetime64[ns]'), np.array([])
+        try:
+            times, closes = fetch_intraday(ticker, pd.Timestamp(due_targets.min()) - timedelta(days=1), pd.Timestamp(due_targets.max()))
+        except market_data.Throttled as e:
+            # 限流的标的只用日线补齐长周期，短周期保持待验证状态，下次运行重试
+            throttled += 1
+            print(f"⚠️ {ticker} 分钟线被限流，下次重试: {e}")
+        except Exception as e:
+            print(f"⚠️ {ticker} 分钟线获取失败: {e}")
+
+        prices = {h: prices_at(times, closes, targets[h]) for h in HORIZONS}
+        day_times, day_closes = daily_closes(daily.get(ticker))
+        for h in DAILY_FALLBACK:
+            prices[h] = np.where(np.isfinite(prices[h]), prices[h], prices_at(day_times, day_closes, targets[h]))
+        for i, (post_id, initial_price, sentiment) in enumerate(group[['post_id', 'initial_price', 'sentiment']].itertuples(index=False)):
+            row, matured = [post_id], False
+            for h in HORIZONS:
+                price = prices[h][i]
+                if group[f'due_{h}'].iat[i] and np.isfinite(price):
+                    row += [float(price), is_correct(sentiment, float(initial_price), price)]
+                    matured = True
+                else:
+                    row += [None, None]
+            if matured:
+                updates.append(tuple(row))
+
+    # 一条多行 UPSERT 写入全部周期；已记录的周期不会被覆盖
+    columns = ['post_id'] + [c for h in HORIZONS for c in (f'price_{h}', f'is_correct_{h}')]
+    assignments = ", ".join(f"{c} = COALESCE(price_tracking.{c}, EXCLUDED.{c})" for c in columns[1:])
+    written = db.bulk_insert(cur, "price_tracking", columns, updates,
+                             suffix=f"ON CONFLICT (post_id) DO UPDATE SET {assignments}, updated_at = NOW()")
     conn.commit()
     cur.close()
     conn.close()
 
+    matured = sum(1 for row in updates for v in row[1::2] if v is not None)
+    print(f"验证完成：{written} 条帖子，新到期周期 {matured} 个" + (f"，{throttled} 个标的因限流顺延" if throttled else ""))
+
 if __name__ == "__main__":
     verify_results()